@@ -173,6 +173,13 @@ class ArcGeo(object):
         Generates the absolute geometry based on itself and the parent. This
         is done for rotating and scaling purposes
         """
+        self.abs_geo = self.get_abs_geo(parent)
+
+    def get_abs_geo(self, parent=None):
+        """
+        Returns the absolute geometry based on itself and the parent, without
+        storing it
+        """
         Ps = self.Ps.rot_sca_abs(parent=parent)
         Pe = self.Pe.rot_sca_abs(parent=parent)
         O = self.O.rot_sca_abs(parent=parent)
@@ -183,7 +190,7 @@ class ArcGeo(object):
         if parent is not None and parent.sca[0] * parent.sca[1] < 0.0:
             direction *= -1
 
-        self.abs_geo = ArcGeo(Ps=Ps, Pe=Pe, O=O, r=r, direction=direction)
+        return ArcGeo(Ps=Ps, Pe=Pe, O=O, r=r, direction=direction)
 
     def scaled_r(self, r, parent):
         """
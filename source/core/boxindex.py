@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+############################################################################
+#
+#   Copyright (C) 2008-2015
+#    Christian Kohlöffel
+#    Vinzenz Schulz
+#
+#   This file is part of DXF2GCODE.
+#
+#   DXF2GCODE is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   DXF2GCODE is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with DXF2GCODE.  If not, see <http://www.gnu.org/licenses/>.
+#
+############################################################################
+
+from __future__ import absolute_import
+from __future__ import division
+
+from math import floor, pi
+import logging
+
+from core.arcgeo import ArcGeo
+from core.holegeo import HoleGeo
+
+logger = logging.getLogger("Core.BoxIndex")
+
+BOX_TOLERANCE = 1e-6
+"""
+bounding boxes are enlarged by this, so that rounding can't hide intersections
+"""
+
+
+def getBoundingBox(points, tolerance=BOX_TOLERANCE):
+    """
+    The bounding box (xmin, ymin, xmax, ymax) of the points, enlarged by
+    tolerance
+    """
+    xs = [point.x for point in points]
+    ys = [point.y for point in points]
+    return (min(xs) - tolerance, min(ys) - tolerance,
+            max(xs) + tolerance, max(ys) + tolerance)
+
+
+def getGeoBoundingBox(geo):
+    """
+    The bounding box of a line, an arc or a hole. The box of an arc includes the
+    points of the circle in the directions of the axes it passes, and is
+    enlarged relative to its radius, since points on it are found with
+    angular tolerances.
+    """
+    if isinstance(geo, ArcGeo):
+        points = [geo.Ps, geo.Pe]
+        for quarter in range(4):
+            ang = quarter * pi / 2
+            if geo.ext > 0:
+                passed = (ang - geo.s_ang) % (2 * pi) <= geo.ext
+            else:
+                passed = (geo.s_ang - ang) % (2 * pi) <= -geo.ext
+            if passed:
+                points.append(geo.O.get_arc_point(ang, geo.r))
+        return getBoundingBox(points, BOX_TOLERANCE * max(1.0, geo.r))
+    elif isinstance(geo, HoleGeo):
+        return getBoundingBox([geo.Ps])
+    return getBoundingBox([geo.Ps, geo.Pe])
+
+
+class BoxIndex(object):
+    """
+    Uniform grid over bounding boxes, so that a geometry is only tested
+    against the items near it. The cells are about as large as an average
+    item. Items which are much larger are not put into the grid but always
+    tested.
+    """
+    # Items covering more cells than this are always tested
+    MAX_CELLS = 64
+
+    def __init__(self, boxes):
+        """
+        @param boxes: the bounding boxes of the items
+        """
+        self.boxes = boxes
+        self.cells = {}
+        self.large = []
+        self.cellSize = 1.0
+        if boxes:
+            self.cellSize = max(sum(max(box[2] - box[0], box[3] - box[1]) for box in boxes) / len(boxes),
+                                BOX_TOLERANCE)
+
+        for nr, box in enumerate(boxes):
+            x0, y0, x1, y1 = self.getCells(box)
+            if (x1 - x0 + 1) * (y1 - y0 + 1) > self.MAX_CELLS:
+                self.large.append(nr)
+                continue
+            for x in range(x0, x1 + 1):
+                for y in range(y0, y1 + 1):
+                    self.cells.setdefault((x, y), []).append(nr)
+
+        logger.debug("Box index: %d cells of size %f, %d large items"
+                     % (len(self.cells), self.cellSize, len(self.large)))
+
+    def getCells(self, box):
+        """
+        The first and last cells (x0, y0, x1, y1) covered by the box
+        """
+        return tuple(int(floor(value / self.cellSize)) for value in box)
+
+    def query(self, box):
+        """
+        The numbers of the items whose bounding boxes overlap the given one,
+        in ascending order
+        """
+        x0, y0, x1, y1 = self.getCells(box)
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > len(self.boxes):
+            candidates = range(len(self.boxes))
+        else:
+            candidates = set(self.large)
+            for x in range(x0, x1 + 1):
+                for y in range(y0, y1 + 1):
+                    candidates.update(self.cells.get((x, y), ()))
+            candidates = sorted(candidates)
+
+        return [nr for nr in candidates
+                if self.boxes[nr][0] <= box[2] and box[0] <= self.boxes[nr][2] and
+                self.boxes[nr][1] <= box[3] and box[1] <= self.boxes[nr][3]]
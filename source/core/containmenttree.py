@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+
+############################################################################
+#
+#   Copyright (C) 2008-2015
+#    Christian Kohlöffel
+#    Vinzenz Schulz
+#
+#   This file is part of DXF2GCODE.
+#
+#   DXF2GCODE is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   DXF2GCODE is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with DXF2GCODE.  If not, see <http://www.gnu.org/licenses/>.
+#
+############################################################################
+
+from __future__ import absolute_import
+from __future__ import division
+
+from math import cos, degrees, hypot
+import logging
+
+import globals.globals as g
+from core.arcgeo import ArcGeo
+from core.customgcode import CustomGCode
+from core.boxindex import BoxIndex, getGeoBoundingBox
+
+logger = logging.getLogger("Core.ContainmentTree")
+
+
+def getContourPoints(shape):
+    """
+    The points of the contour of a shape, arcs are approximated by segments
+    of at most 3 degrees as when they are drawn. The end point is included
+    for open shapes.
+    @return: tuple (points, error), the error is the largest distance of
+    the segments from the arcs
+    """
+    points = []
+    error = 0.0
+    for geo in shape.geos.abs_iter(False):
+        if isinstance(geo, ArcGeo):
+            segments = int(abs(degrees(geo.ext)) // 3 + 1)
+            points.extend(geo.get_point_from_start(i, segments) for i in range(segments))
+            error = max(error, geo.r * (1 - cos(geo.ext / segments / 2)))
+        else:
+            points.append(geo.Ps)
+    if not shape.closed and len(shape.geos):
+        points.append(geo.get_start_end_points(False))
+    return [(point.x, point.y) for point in points], error
+
+
+def isPointInContour(x, y, contour):
+    """
+    Even-odd test whether the point is inside the closed contour
+    @param contour: the points as returned by getContourPoints()
+    """
+    inside = False
+    x1, y1 = contour[-1]
+    for x2, y2 in contour:
+        if (y1 > y) != (y2 > y) and x < x1 + (y - y1) * (x2 - x1) / (y2 - y1):
+            inside = not inside
+        x1, y1 = x2, y2
+    return inside
+
+
+def getSegmentParameter(x, y, segment):
+    """
+    The parameter (0 at the start, 1 at the end) of the point of the segment
+    nearest to the point, and the distance to it
+    """
+    x1, y1, x2, y2 = segment
+    dx = x2 - x1
+    dy = y2 - y1
+    length2 = dx * dx + dy * dy
+    t = 0.0 if length2 == 0 else min(1.0, max(0.0, ((x - x1) * dx + (y - y1) * dy) / length2))
+    return t, hypot(x1 + t * dx - x, y1 + t * dy - y)
+
+
+def isPointOnSegments(x, y, segments, tolerance):
+    return any(getSegmentParameter(x, y, segment)[1] <= tolerance for segment in segments)
+
+
+class ContainmentTree(object):
+    """
+    The nesting of the shapes of a layer. A shape is contained by a closed
+    shape if its bounding box lies inside the one of the closed shape and
+    no part of its contour lies outside the contour of the closed shape.
+    Contours touching the closed shape from inside, within the point
+    tolerance, are contained. Only shapes with overlapping bounding boxes
+    are compared, using a BoxIndex.
+
+    The depth of a shape is the length of the longest chain of shapes
+    containing it, 0 for outer shapes. The parent of a shape is its
+    container with the largest depth.
+    """
+    def __init__(self, shapes):
+        """
+        @param shapes: the shapes to nest, custom gcodes are outer shapes
+        """
+        self.shapes = list(shapes)
+        self.depths = {}
+        self.parents = {}
+        self.children = {}
+
+        nested = []
+        boxes = []
+        for shape in self.shapes:
+            self.depths[shape] = 0
+            self.parents[shape] = None
+            self.children[shape] = []
+            if isinstance(shape, CustomGCode) or len(shape.geos) == 0:
+                continue
+            boxes.append(self.getShapeBoundingBox(shape))
+            nested.append(shape)
+        boxIndex = BoxIndex(boxes)
+
+        contours = [None] * len(nested)
+        # Containers have larger bounding boxes than the shapes inside, so
+        # their depths are known when the shapes inside are processed
+        for nr in sorted(range(len(nested)), key=lambda nr: -self.getArea(boxes[nr])):
+            shape = nested[nr]
+            for outer_nr in boxIndex.query(boxes[nr]):
+                outerShape = nested[outer_nr]
+                if not outerShape.closed or not self.isBoxContained(boxes[nr], boxes[outer_nr]):
+                    continue
+                if contours[nr] is None:
+                    contours[nr] = getContourPoints(shape)
+                if contours[outer_nr] is None:
+                    contours[outer_nr] = getContourPoints(outerShape)
+                contour, error = contours[nr]
+                outerContour, outerError = contours[outer_nr]
+                tolerance = g.config.point_tolerance + error + outerError
+                if not self.isContourContained(contour, outerContour, shape.closed, tolerance):
+                    continue
+                if self.depths[outerShape] + 1 > self.depths[shape]:
+                    self.depths[shape] = self.depths[outerShape] + 1
+                    self.parents[shape] = outerShape
+
+        for shape in self.shapes:
+            if self.parents[shape] is not None:
+                self.children[self.parents[shape]].append(shape)
+
+        logger.debug("Nested %d shapes, maximum depth %d"
+                     % (len(self.shapes), max([0] + list(self.depths.values()))))
+
+    def getShapeBoundingBox(self, shape):
+        boxes = [getGeoBoundingBox(geo) for geo in shape.geos.abs_iter(False)]
+        return (min(box[0] for box in boxes), min(box[1] for box in boxes),
+                max(box[2] for box in boxes), max(box[3] for box in boxes))
+
+    def getArea(self, box):
+        return (box[2] - box[0]) * (box[3] - box[1])
+
+    def isBoxContained(self, box, outerBox):
+        return outerBox[0] < box[0] and box[2] < outerBox[2] and\
+            outerBox[1] < box[1] and box[3] < outerBox[3]
+
+    def isContourContained(self, contour, outerContour, closed, tolerance):
+        """
+        Whether the contour lies inside the closed outer contour. Each
+        segment of the contour is split where it crosses or touches the
+        outer contour, and the middle of each part must be inside the outer
+        contour or on it, so no part of the contour lies outside.
+        @param closed: whether the last point is joined to the first one
+        @param tolerance: points which are this close to the outer contour
+        are on it
+        """
+        if len(outerContour) < 3:
+            return False
+        xs = [x for x, y in contour]
+        ys = [y for x, y in contour]
+        xmin = min(xs) - tolerance
+        ymin = min(ys) - tolerance
+        xmax = max(xs) + tolerance
+        ymax = max(ys) + tolerance
+        # Only the segments of the outer contour near the contour can touch it
+        outerSegments = [(x1, y1, x2, y2) for (x1, y1), (x2, y2) in
+                         zip(outerContour[-1:] + outerContour[:-1], outerContour)
+                         if max(x1, x2) >= xmin and min(x1, x2) <= xmax and
+                         max(y1, y2) >= ymin and min(y1, y2) <= ymax]
+
+        if not outerSegments:
+            # The contours neither cross nor touch
+            x, y = contour[0]
+            return isPointInContour(x, y, outerContour)
+
+        def isInside(x, y):
+            return isPointOnSegments(x, y, outerSegments, tolerance) or\
+                isPointInContour(x, y, outerContour)
+
+        if not all(isInside(x, y) for x, y in contour):
+            return False
+
+        segments = list(zip(contour, contour[1:] + contour[:1] if closed else contour[1:]))
+        for (x1, y1), (x2, y2) in segments:
+            dx = x2 - x1
+            dy = y2 - y1
+            params = [0.0, 1.0]
+            for outerSegment in outerSegments:
+                ox1, oy1, ox2, oy2 = outerSegment
+                odx = ox2 - ox1
+                ody = oy2 - oy1
+                denominator = dx * ody - dy * odx
+                if denominator != 0:
+                    t = ((ox1 - x1) * ody - (oy1 - y1) * odx) / denominator
+                    u = ((ox1 - x1) * dy - (oy1 - y1) * dx) / denominator
+                    if 0 < t < 1 and 0 <= u <= 1:
+                        params.append(t)
+                # The segments touch at the points of the outer contour on
+                # the segment, or overlap between them
+                for x, y in ((ox1, oy1), (ox2, oy2)):
+                    t, distance = getSegmentParameter(x, y, (x1, y1, x2, y2))
+                    if distance <= tolerance:
+                        params.append(t)
+            params.sort()
+            for t0, t1 in zip(params, params[1:]):
+                t = (t0 + t1) / 2
+                if t1 > t0 and not isInside(x1 + t * dx, y1 + t * dy):
+                    return False
+        return True
+
+    def getDepth(self, shape):
+        return self.depths[shape]
+
+    def getParent(self, shape):
+        return self.parents[shape]
+
+    def getChildren(self, shape):
+        return self.children[shape]
+
+    def getExportOrder(self):
+        """
+        The shapes ordered with the innermost ones first. Shapes with the
+        same depth are in reversed order
+        """
+        return list(reversed(sorted(self.shapes, key=self.getDepth)))
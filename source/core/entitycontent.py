@@ -55,3 +55,16 @@ class EntityContent(object):
 
     def append(self, child):
         self.children.append(child)
+
+    def isUniformlyScaled(self):
+        """
+        Whether this entity and its parents only move, rotate and scale their
+        geometries uniformly, so that their directions and the shapes of their
+        arcs are kept
+        """
+        entity = self
+        while entity is not None:
+            if not entity.sca[0] == entity.sca[1] > 0.0:
+                return False
+            entity = entity.parent
+        return True
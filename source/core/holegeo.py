@@ -69,9 +69,16 @@ class HoleGeo(object):
         Generates the absolute geometry based on itself and the parent. This
         is done for rotating and scaling purposes
         """
+        self.abs_geo = self.get_abs_geo(parent)
+
+    def get_abs_geo(self, parent=None):
+        """
+        Returns the absolute geometry based on itself and the parent, without
+        storing it
+        """
         Ps = self.Ps.rot_sca_abs(parent=parent)
 
-        self.abs_geo = HoleGeo(Ps)
+        return HoleGeo(Ps)
 
     def get_start_end_points(self, start_point, angles=None):
         if angles is None:
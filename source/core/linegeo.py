@@ -73,10 +73,17 @@ class LineGeo(object):
         Generates the absolute geometry based on itself and the parent. This
         is done for rotating and scaling purposes
         """
+        self.abs_geo = self.get_abs_geo(parent)
+
+    def get_abs_geo(self, parent=None):
+        """
+        Returns the absolute geometry based on itself and the parent, without
+        storing it
+        """
         Ps = self.Ps.rot_sca_abs(parent=parent)
         Pe = self.Pe.rot_sca_abs(parent=parent)
 
-        self.abs_geo = LineGeo(Ps=Ps, Pe=Pe)
+        return LineGeo(Ps=Ps, Pe=Pe)
 
     def distance2point(self, point):
         """
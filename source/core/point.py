@@ -136,19 +136,18 @@ class Point(object):
         @return: A new Point which is absolute position
         """
         if sca is None and parent is not None:
-            p0 = parent.p0
-            pb = parent.pb
-            sca = parent.sca
-            rot = parent.rot
-
-            pc = self - pb
-            rotx = (pc.x * cos(rot) + pc.y * -sin(rot)) * sca[0]
-            roty = (pc.x * sin(rot) + pc.y * cos(rot)) * sca[1]
-            p1 = Point(rotx, roty) + p0
-
-            # Recursive loop if the point self is  introduced
-            if parent.parent is not None:
-                p1 = p1.rot_sca_abs(parent=parent.parent)
+            # Apply the transforms of the parent and of its parents in turn,
+            # without making a Point for each of them
+            x = self.x
+            y = self.y
+            while parent is not None:
+                pcx = x - parent.pb.x
+                pcy = y - parent.pb.y
+                rot = parent.rot
+                x = (pcx * cos(rot) + pcy * -sin(rot)) * parent.sca[0] + parent.p0.x
+                y = (pcx * sin(rot) + pcy * cos(rot)) * parent.sca[1] + parent.p0.y
+                parent = parent.parent
+            p1 = Point(x, y)
 
         elif parent is None and sca is None:
             p0 = Point()
@@ -51,7 +51,9 @@ def execute(self, content):
 
 class Project(object):
     header = "# +~+~+~ DXF2GCODE project file V%s ~+~+~+"
-    version = 1.1
+    version = 1.2
+    # V1.1 identifies the shapes by get_hash(), V1.2 by Shape.getFingerprint()
+    supported_versions = (1.1, 1.2)
 
     def __init__(self, parent):
         self.parent = parent
@@ -79,6 +81,9 @@ class Project(object):
                                                            string_to_translate))
 
     def get_hash(self, shape):
+        """
+        get_hash() - The hash identifying a shape in project files before V1.2
+        """
         reversed = False
         if not shape.cw:
             reversed = True
@@ -88,7 +93,13 @@ class Project(object):
             shape.reverse()
         return hashlib.sha1(''.join(sorted(geos)).encode('utf-8')).hexdigest()
 
-    def export(self):
+    def get_layers(self, with_nr=False):
+        """
+        get_layers() - The settings of the layers and of their shapes, in
+        the order of the tree view
+        @param with_nr: also store the numbers of the shapes, they identify
+        the shapes as long as the contours are not made anew
+        """
         self.parent.TreeHandler.updateExportOrder(True)
         layers = []
         for layer in self.parent.layerContents:
@@ -101,11 +112,12 @@ class Project(object):
                                    'disabled': shape.disabled})
                 else:
                     stpoint = shape.get_start_end_points(True)
-                    shapes.append({'hash_': self.get_hash(shape),
+                    shapes.append({'fingerprint': shape.getFingerprint(),
                                    'cut_cor': shape.cut_cor,
                                    'cw': shape.cw,
                                    'send_to_TSP': shape.send_to_TSP,
                                    'disabled': shape.disabled,
+                                   'allowedToChange': shape.allowedToChange,
                                    'start_mill_depth': shape.axis3_start_mill_depth,
                                    'slice_depth': shape.axis3_slice_depth,
                                    'mill_depth': shape.axis3_mill_depth,
@@ -113,6 +125,8 @@ class Project(object):
                                    'f_g1_depth': shape.f_g1_depth,
                                    'start_x': stpoint.x,
                                    'start_y': stpoint.y})
+                    if with_nr:
+                        shapes[-1]['nr'] = shape.nr
             layers.append({'name': layer.name,
                            'tool_nr': layer.tool_nr,
                            'diameter': layer.tool_diameter,
@@ -121,6 +135,10 @@ class Project(object):
                            'retract': layer.axis3_retract,
                            'safe_margin': layer.axis3_safe_margin,
                            'shapes': shapes})
+        return layers
+
+    def export(self):
+        layers = self.get_layers()
 
         pyCode = Project.header % str(Project.version) + '''
 d2g.file = "''' + self.parent.filename + '''"
@@ -141,7 +159,7 @@ d2g.layers = ''' + str(layers)
         if not match:
             raise Exception('Incorrect project file')
         version = float(match.groups()[0])
-        if version != Project.version:
+        if version not in Project.supported_versions:
             raise VersionMismatchError(match.group(), Project.version)
 
         execute(self, content)
@@ -163,12 +181,25 @@ d2g.layers = ''' + str(layers)
                 self.parent.unsetCursor()
                 return
 
+        if version < 1.2:
+            self.apply_layers(self.layers, 'hash_', self.get_hash)
+        else:
+            self.apply_layers(self.layers, 'fingerprint', lambda shape: shape.getFingerprint())
+        self.parent.plot()
+
+    def apply_layers(self, parent_layers, key, get_hash):
+        """
+        apply_layers() - Apply the settings of layers and shapes, as returned
+        by get_layers(), to the layers and shapes made by makeShapes()
+        @param key: the key of the shape settings identifying the shape
+        @param get_hash: returns this value for a shape
+        """
         name_layers = dict((layer.name, layer) for layer in self.parent.layerContents)
         # dict comprehensions are supported since Py2.7
         # name_layers = {layer.name: layer for layer in self.parent.layerContents}
 
         layers = []
-        for parent_layer in self.layers:
+        for parent_layer in parent_layers:
             if parent_layer['name'] in name_layers:
                 layer = name_layers[parent_layer['name']]
                 layer.tool_nr = parent_layer['tool_nr']
@@ -179,9 +210,11 @@ d2g.layers = ''' + str(layers)
                 layer.axis3_retract = parent_layer['retract']
                 layer.axis3_safe_margin = parent_layer['safe_margin']
 
-                hash_shapes = dict((self.get_hash(shape), shape) for shape in layer.shapes)
-                # dict comprehensions are supported since Py2.7
-                # hash_shapes = {self.get_hash(shape): shape for shape in layer.shapes}
+                # Identical shapes have the same hash, they are assigned in turn
+                hash_shapes = {}
+                for shape in layer.shapes:
+                    if not isinstance(shape, CustomGCode):
+                        hash_shapes.setdefault(get_hash(shape), []).append(shape)
 
                 shapes = []
                 for parent_shape in parent_layer['shapes']:
@@ -190,11 +223,14 @@ d2g.layers = ''' + str(layers)
                         self.parent.newNumber += 1
                         shape.disabled = parent_shape['disabled']
                         shapes.append(shape)
-                    elif parent_shape['hash_'] in hash_shapes:
-                        shape = hash_shapes[parent_shape['hash_']]
+                    elif hash_shapes.get(parent_shape[key]):
+                        shape = hash_shapes[parent_shape[key]].pop(0)
                         shape.cut_cor = parent_shape['cut_cor']
                         shape.send_to_TSP = parent_shape['send_to_TSP']
-                        shape.disabled = parent_shape['disabled']
+                        # The machine type may force the state of a shape,
+                        # a forced state is neither kept nor overwritten
+                        if shape.allowedToChange and parent_shape.get('allowedToChange', True):
+                            shape.disabled = parent_shape['disabled']
                         shape.axis3_start_mill_depth = parent_shape['start_mill_depth']
                         shape.axis3_slice_depth = parent_shape['slice_depth']
                         shape.axis3_mill_depth = parent_shape['mill_depth']
@@ -212,16 +248,68 @@ d2g.layers = ''' + str(layers)
 
         layers.extend(set(self.parent.layerContents) - set(layers))  # add "new" layers to the end
         self.parent.layerContents = Layers(layers)  # overwrite original
-        self.parent.plot()
 
     def reload(self, compleet=True):
-        if self.parent.filename:
-            self.parent.setCursor(QtCore.Qt.WaitCursor)
-            self.parent.canvas.resetAll()
-            self.parent.app.processEvents()
+        """
+        reload() - Make the shapes again after settings were changed. Only
+        the stages depending on the changed settings are done again:
+        - the fitting tolerance: the file is imported again
+        - the point tolerance: the contours are searched again
+        - splitting line segments or the machine type: the shapes are made
+          again
+        - workpiece zero, scale or rotation: the absolute geometries are made
+          again
+        The shapes are plotted again in any case.
+        @param compleet: import the file again, and take the settings from
+        the exported project
+        """
+        if not self.parent.filename:
+            return
+
+        self.parent.stopTsp()
+        self.parent.setCursor(QtCore.Qt.WaitCursor)
+        self.parent.canvas.resetAll()
+        self.parent.app.processEvents()
+
+        valuesDXF = self.parent.valuesDXF
+        if compleet or valuesDXF.fitting_tolerance != g.config.fitting_tolerance:
             pyCode = self.export()
             self.parent.makeShapes()
-            self.load(pyCode, compleet)
+            self.load(pyCode, True)
+        elif valuesDXF.point_tolerance != g.config.point_tolerance:
+            logger.debug(self.tr("Point tolerance changed, searching the contours again"))
+            layers = self.get_layers()
+            valuesDXF.Get_All_Contours()
+            self.parent.makeShapes()
+            self.apply_layers(layers, 'fingerprint', lambda shape: shape.getFingerprint())
+            self.parent.plot()
+        elif self.parent.splitLines != self.parent.ui.actionSplitLineSegments.isChecked() or\
+                self.parent.machineType != g.config.machine_type:
+            logger.debug(self.tr("Splitting of line segments or machine type changed, making the shapes again"))
+            # The contours are the same, so the shapes are made in the same order
+            layers = self.get_layers(True)
+            self.parent.makeShapes()
+            self.apply_layers(layers, 'nr', lambda shape: shape.nr)
+            self.parent.plot()
+        else:
+            self.keep_export_order()
+            if self.parent.updateEntityRoot():
+                logger.debug(self.tr("Workpiece zero, scale or rotation changed, transforming the shapes again"))
+                for shape in self.parent.shapes:
+                    shape.geos.clear_abs_geos()
+            self.parent.plot()
+
+    def keep_export_order(self):
+        """
+        keep_export_order() - Order the layers and shapes as in the tree
+        view, so that the order is kept when the tree view is built again
+        """
+        self.parent.TreeHandler.updateExportOrder(True)
+        for layer in self.parent.layerContents:
+            shapes = [layer.shapes[nr] for nr in layer.exp_order_complete]
+            listed = set(shapes)
+            shapes.extend(shape for shape in layer.shapes if shape not in listed)
+            layer.shapes = Shapes(shapes)
 
     def small_reload(self):
         self.reload(False)
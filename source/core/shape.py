@@ -28,8 +28,10 @@ from __future__ import absolute_import
 from __future__ import division
 
 from math import radians, pi
-from copy import deepcopy
+from copy import copy, deepcopy
+import hashlib
 import logging
+import struct
 
 import globals.globals as g
 from core.point import Point
@@ -46,6 +48,41 @@ else:
 
 logger = logging.getLogger("Core.Shape")
 
+FINGERPRINT_RESOLUTION = 1e-3
+"""
+coordinates are rounded to this before they are hashed into the fingerprint of
+a shape
+"""
+
+
+def getDirectionArea(geos, closed):
+    """
+    getDirectionArea() - Twice the area of the absolute geometries by the
+    shoelace formula, positive if they are CCW. Arcs are approximated by 10
+    segments, open geometries are closed by a line.
+    @param geos: the Geos
+    @param closed: whether the geometries are closed
+    @return: the area, 0 if it is inconclusive
+    """
+    start = geos.abs_el(0).get_start_end_points(True)
+    summe = 0.0
+    for geo in geos.abs_iter():
+        if isinstance(geo, LineGeo):
+            end = geo.get_start_end_points(False)
+            summe += (start.x + end.x) * (end.y - start.y)
+            start = end
+        elif isinstance(geo, ArcGeo):
+            segments = 10
+            for i in range(1, segments + 1):
+                end = geo.get_point_from_start(i, segments)
+                summe += (end.x + start.x) * (end.y - start.y)
+                start = end
+    if not closed:
+        # if shape is not closed... simply treat it as closed
+        end = geos.abs_el(0).get_start_end_points(True)
+        summe += (end.x + start.x) * (end.y - start.y)
+    return summe
+
 
 class Shape(object):
     """
@@ -63,12 +100,15 @@ class Shape(object):
         self.cut_cor = 40
         self.parentEntity = parentEntity
         self.parentLayer = None
-        self.geos = Geos([])
+        self.geos = Geos([], parentEntity)
 
         self.cw = True
 
         self.stmove = None
 
+        # see getFingerprint()
+        self.fingerprint = None
+
         self.topLeft = None
         self.bottomRight = None
 
@@ -128,23 +168,7 @@ class Shape(object):
 
     def isDirectionOfGeosCCW(self, geos):
         # By calculating the area of the shape
-        start = geos.abs_el(0).get_start_end_points(True)
-        summe = 0.0
-        for geo in geos.abs_iter():
-            if isinstance(geo, LineGeo):
-                end = geo.get_start_end_points(False)
-                summe += (start.x + end.x) * (end.y - start.y)
-                start = end
-            elif isinstance(geo, ArcGeo):
-                segments = 10
-                for i in range(1, segments + 1):
-                    end = geo.get_point_from_start(i, segments)
-                    summe += (end.x + start.x) * (end.y - start.y)
-                    start = end
-        if not self.closed:
-            # if shape is not closed... simply treat it as closed
-            end = geos.abs_el(0).get_start_end_points(True)
-            summe += (end.x + start.x) * (end.y - start.y)
+        summe = getDirectionArea(geos, self.closed)
 
         if summe == 0:  # inconclusive
             logger.debug(self.tr("Shoelace method cannot (directly) be applied to this shape"))
@@ -166,36 +190,51 @@ class Shape(object):
             summe = direction
         return summe > 0.0
 
-    def AnalyseAndOptimize(self):
+    def AnalyseAndOptimize(self, blockArea=0.0):
+        """
+        AnalyseAndOptimize() - Start the shape next to the workpiece zero and
+        make it CW
+        @param blockArea: the area of the geometries in the coordinates of
+        their block, as returned by getDirectionArea(), 0 if it is not known.
+        The inserts of a block share it, if they do not distort or mirror
+        their geometries. Otherwise the absolute geometries are analysed.
+        """
         self.setNearestStPoint(Point())
         logger.debug(self.tr("Analysing the shape for CW direction Nr: %s" % self.nr))
 
-        if self.isDirectionOfGeosCCW(self.geos):
+        if blockArea and self.parentEntity is not None and self.parentEntity.isUniformlyScaled():
+            ccw = blockArea > 0.0
+        else:
+            ccw = self.isDirectionOfGeosCCW(self.geos)
+        if ccw:
             self.reverse()
             logger.debug(self.tr("Had to reverse the shape to be CW"))
         self.cw = True
 
+        self.getFingerprint()
+
     def setNearestStPoint(self, stPoint):
         if self.closed:
             logger.debug(self.tr("Clicked Point: %s" % stPoint))
-            start = self.get_start_end_points(True)
-            logger.debug(self.tr("Old Start Point: %s" % start))
+            starts = list(self.geos.abs_start_points())
+            logger.debug(self.tr("Old Start Point: %s" % starts[0]))
 
-            min_geo_nr, _ = min(enumerate(self.geos.abs_iter()),
-                                key=lambda geo: geo[1].get_start_end_points(True).distance(stPoint))
+            min_geo_nr, _ = min(enumerate(starts),
+                                key=lambda start: start[1].distance(stPoint))
 
             # Overwrite the geometries in changed order.
-            self.geos = Geos(self.geos[min_geo_nr:] + self.geos[:min_geo_nr])
+            self.geos = self.geos.shifted(min_geo_nr)
 
-            start = self.get_start_end_points(True)
-            logger.debug(self.tr("New Start Point: %s" % start))
+            logger.debug(self.tr("New Start Point: %s" % starts[min_geo_nr]))
 
     def reverse(self, geos=None):
         if not geos:
-            geos = self.geos
-        geos.reverse()
-        for geo in geos:
-            geo.reverse()
+            # The geometries may be shared with the other inserts of a block
+            self.geos = self.geos.reversed()
+        else:
+            geos.reverse()
+            for geo in geos:
+                geo.reverse()
         self.cw = not self.cw
 
     def switch_cut_cor(self):
@@ -211,8 +250,51 @@ class Shape(object):
             self.cut_cor = 41
 
     def append(self, geo):
-        geo.make_abs_geo(self.parentEntity)
+        # The absolute geometry is made by self.geos when it is needed
         self.geos.append(geo)
+        self.fingerprint = None
+
+    def getFingerprint(self):
+        """
+        getFingerprint() - A hash of the geometries of the shape and of the
+        inserts containing it, which does not depend on the start point and
+        the direction of the shape. It is used to find the shape again after
+        it has been imported anew. The hash is calculated once, and again
+        after geometries have been appended.
+        @return: the hash as hex string
+        """
+        if self.fingerprint is None:
+            def quantize(value):
+                return int(round(value / FINGERPRINT_RESOLUTION))
+
+            values = []
+            for geo in self.geos:
+                if isinstance(geo, HoleGeo):
+                    values.append((3, quantize(geo.Ps.x), quantize(geo.Ps.y)))
+                    continue
+                # The end points in a fixed order, so that the direction does not matter
+                points = sorted([(quantize(geo.Ps.x), quantize(geo.Ps.y)),
+                                 (quantize(geo.Pe.x), quantize(geo.Pe.y))])
+                if isinstance(geo, ArcGeo):
+                    values.append((2,) + points[0] + points[1] +
+                                  (quantize(geo.O.x), quantize(geo.O.y), quantize(abs(geo.ext))))
+                else:
+                    values.append((1,) + points[0] + points[1])
+            # Sorted, so that the start point does not matter
+            values.sort()
+
+            # Inserts of the same block have the same geometries. The root
+            # entity holds the workpiece zero, scale and rotation, which may change.
+            entity = self.parentEntity
+            while entity is not None and entity.parent is not None:
+                values.append((4, quantize(entity.p0.x), quantize(entity.p0.y),
+                               quantize(entity.pb.x), quantize(entity.pb.y),
+                               quantize(entity.sca[0]), quantize(entity.sca[1]), quantize(entity.rot)))
+                entity = entity.parent
+
+            flat = [value for geo_values in values for value in geo_values]
+            self.fingerprint = hashlib.sha1(struct.pack('<%dq' % len(flat), *flat)).hexdigest()
+        return self.fingerprint
 
     def get_start_end_points_physical(self, start_point=None, angles=None):
         """
@@ -250,7 +332,10 @@ class Shape(object):
             return self.geos.abs_el(-1).get_start_end_points(False, angles)
 
     def make_path(self, drawHorLine, drawVerLine):
-        for geo in self.geos.abs_iter():
+        # The bounding box is determined again, the shape may have moved
+        self.topLeft = None
+        self.bottomRight = None
+        for geo in self.geos.abs_iter(False):
             drawVerLine(self, geo.get_start_end_points(True))
 
             geo.make_path(self, drawHorLine)
@@ -265,10 +350,19 @@ class Shape(object):
         if not self.closed:
             drawVerLine(self, geo.get_start_end_points(False))
 
+    def make_block_path(self, drawHorLine):
+        """
+        make_block_path() - Draws the geometries in the coordinates of the
+        parent entity, in which they are shared by all inserts of a block.
+        The caller transforms the drawing and determines the bounding box.
+        """
+        for geo in self.geos:
+            geo.make_path(self, drawHorLine)
+
     def isHit(self, xy, tol):
         if self.topLeft.x - tol <= xy.x <= self.bottomRight.x + tol\
                 and self.bottomRight.y - tol <= xy.y <= self.topLeft.y + tol:
-            for geo in self.geos.abs_iter():
+            for geo in self.geos.abs_iter(False):
                 if geo.isHit(self, xy, tol):
                     return True
         return False
@@ -291,8 +385,19 @@ class Shape(object):
         @param PostPro: this is the Postprocessor class including the methods
         to export
         """
+        return "".join(self.Write_GCode_Fragments(PostPro))
+
+    def Write_GCode_Fragments(self, PostPro):
+        """
+        This method yields the strings to be exported for this shape one after
+        the other, including the defined start and end move of the shape.
+        @param PostPro: this is the Postprocessor class including the methods
+        to export
+        """
         if g.config.machine_type == 'drag_knife':
-            return self.Write_GCode_Drag_Knife(PostPro)
+            for exstr in self.Write_GCode_Drag_Knife_Fragments(PostPro):
+                yield exstr
+            return
 
         prv_cut_cor = self.cut_cor
         if self.cut_cor != 40 and not g.config.vars.Cutter_Compensation["done_by_machine"]:
@@ -302,9 +407,6 @@ class Shape(object):
             new_geos = self.geos
 
         new_geos = PostPro.breaks.getNewGeos(new_geos)
-        # initialisation of the string
-        exstr = ""
-
         # Get the mill settings defined in the GUI
         safe_retract_depth = self.parentLayer.axis3_retract
         safe_margin = self.parentLayer.axis3_safe_margin
@@ -338,39 +440,39 @@ class Shape(object):
         mom_depth = initial_mill_depth
 
         # Move the tool to the start.
-        exstr += self.stmove.geos.abs_el(0).Write_GCode(PostPro)
+        yield self.stmove.geos.abs_el(0).Write_GCode(PostPro)
 
         # Add string to be added before the shape will be cut.
-        exstr += PostPro.write_pre_shape_cut()
+        yield PostPro.write_pre_shape_cut()
 
         # Cutter radius compensation when G41 or G42 is on, AND cutter compensation option is set to be done outside the piece
         if self.cut_cor != 40 and PostPro.vars.General["cc_outside_the_piece"]:
-            exstr += PostPro.set_cut_cor(self.cut_cor)
+            yield PostPro.set_cut_cor(self.cut_cor)
 
-            exstr += PostPro.chg_feed_rate(f_g1_plane)
-            exstr += self.stmove.geos.abs_el(1).Write_GCode(PostPro)
-            exstr += self.stmove.geos.abs_el(2).Write_GCode(PostPro)
+            yield PostPro.chg_feed_rate(f_g1_plane)
+            yield self.stmove.geos.abs_el(1).Write_GCode(PostPro)
+            yield self.stmove.geos.abs_el(2).Write_GCode(PostPro)
 
-        exstr += PostPro.rap_pos_z(
+        yield PostPro.rap_pos_z(
             workpiece_top_Z + abs(safe_margin))  # Compute the safe margin from the initial mill depth
-        exstr += PostPro.chg_feed_rate(f_g1_depth)
-        exstr += PostPro.lin_pol_z(mom_depth)
-        exstr += PostPro.chg_feed_rate(f_g1_plane)
+        yield PostPro.chg_feed_rate(f_g1_depth)
+        yield PostPro.lin_pol_z(mom_depth)
+        yield PostPro.chg_feed_rate(f_g1_plane)
 
         # Cutter radius compensation when G41 or G42 is on, AND cutter compensation option is set to be done inside the piece
         if self.cut_cor != 40 and not PostPro.vars.General["cc_outside_the_piece"]:
-            exstr += PostPro.set_cut_cor(self.cut_cor)
+            yield PostPro.set_cut_cor(self.cut_cor)
 
-            exstr += self.stmove.geos.abs_el(1).Write_GCode(PostPro)
-            exstr += self.stmove.geos.abs_el(2).Write_GCode(PostPro)
+            yield self.stmove.geos.abs_el(1).Write_GCode(PostPro)
+            yield self.stmove.geos.abs_el(2).Write_GCode(PostPro)
 
         # Write the geometries for the first cut
         for geo in new_geos.abs_iter():
-            exstr += self.Write_GCode_for_geo(geo, PostPro)
+            yield self.Write_GCode_for_geo(geo, PostPro)
 
         # Turning the cutter radius compensation
         if self.cut_cor != 40 and PostPro.vars.General["cancel_cc_for_depth"]:
-            exstr += PostPro.deactivate_cut_cor()
+            yield PostPro.deactivate_cut_cor()
 
         # Numbers of loops
         snr = 0
@@ -382,9 +484,9 @@ class Shape(object):
                 mom_depth = depth
 
             # Erneutes Eintauchen
-            exstr += PostPro.chg_feed_rate(f_g1_depth)
-            exstr += PostPro.lin_pol_z(mom_depth)
-            exstr += PostPro.chg_feed_rate(f_g1_plane)
+            yield PostPro.chg_feed_rate(f_g1_depth)
+            yield PostPro.lin_pol_z(mom_depth)
+            yield PostPro.chg_feed_rate(f_g1_plane)
 
             # If it is not a closed contour
             if not self.closed:
@@ -395,27 +497,27 @@ class Shape(object):
                 # If cutter radius compensation is turned on. Turn it off - because some interpreters cannot handle
                 # a switch
                 if self.cut_cor != 40 and not PostPro.vars.General["cancel_cc_for_depth"]:
-                    exstr += PostPro.deactivate_cut_cor()
+                    yield PostPro.deactivate_cut_cor()
 
             # If cutter correction is enabled
             if self.cut_cor != 40 and PostPro.vars.General["cancel_cc_for_depth"]:
-                exstr += PostPro.set_cut_cor(self.cut_cor)
+                yield PostPro.set_cut_cor(self.cut_cor)
 
             for geo in new_geos.abs_iter():
-                exstr += self.Write_GCode_for_geo(geo, PostPro)
+                yield self.Write_GCode_for_geo(geo, PostPro)
 
             # Turning off the cutter radius compensation if needed
             if self.cut_cor != 40 and PostPro.vars.General["cancel_cc_for_depth"]:
-                exstr += PostPro.deactivate_cut_cor()
+                yield PostPro.deactivate_cut_cor()
 
         # Do the tool retraction
-        exstr += PostPro.chg_feed_rate(f_g1_depth)
-        exstr += PostPro.lin_pol_z(workpiece_top_Z + abs(safe_margin))
-        exstr += PostPro.rap_pos_z(safe_retract_depth)
+        yield PostPro.chg_feed_rate(f_g1_depth)
+        yield PostPro.lin_pol_z(workpiece_top_Z + abs(safe_margin))
+        yield PostPro.rap_pos_z(safe_retract_depth)
 
         # If cutter radius compensation is turned on.
         if self.cut_cor != 40 and not PostPro.vars.General["cancel_cc_for_depth"]:
-            exstr += PostPro.deactivate_cut_cor()
+            yield PostPro.deactivate_cut_cor()
 
         # Initial value of direction restored if necessary
         if has_reversed:
@@ -425,22 +527,17 @@ class Shape(object):
         self.cut_cor = prv_cut_cor
 
         # Add string to be added before the shape will be cut.
-        exstr += PostPro.write_post_shape_cut()
+        yield PostPro.write_post_shape_cut()
 
-        return exstr
-
-    def Write_GCode_Drag_Knife(self, PostPro):
+    def Write_GCode_Drag_Knife_Fragments(self, PostPro):
         """
-        This method returns the string to be exported for this shape, including
+        This method yields the strings to be exported for this shape, including
         the defined start and end move of the shape. This function is used for
         Drag Knife cutting machine only.
         @param PostPro: this is the Postprocessor class including the methods
         to export
         """
 
-        # initialisation of the string
-        exstr = ""
-
         # Get the mill settings defined in the GUI
         safe_retract_depth = self.parentLayer.axis3_retract
         safe_margin = self.parentLayer.axis3_safe_margin
@@ -456,71 +553,140 @@ class Shape(object):
         drag_depth = self.axis3_slice_depth
 
         # Move the tool to the start.
-        exstr += self.stmove.geos.abs_el(0).Write_GCode(PostPro)
+        yield self.stmove.geos.abs_el(0).Write_GCode(PostPro)
 
         # Add string to be added before the shape will be cut.
-        exstr += PostPro.write_pre_shape_cut()
+        yield PostPro.write_pre_shape_cut()
 
         # Move into workpiece and start cutting into Z
-        exstr += PostPro.rap_pos_z(
+        yield PostPro.rap_pos_z(
             workpiece_top_Z + abs(safe_margin))  # Compute the safe margin from the initial mill depth
-        exstr += PostPro.chg_feed_rate(f_g1_depth)
+        yield PostPro.chg_feed_rate(f_g1_depth)
 
         # Write the geometries for the first cut
         if isinstance(self.stmove.geos.abs_el(1), ArcGeo):
             if self.stmove.geos.abs_el(1).drag:
-                exstr += PostPro.lin_pol_z(drag_depth)
+                yield PostPro.lin_pol_z(drag_depth)
                 drag = True
             else:
-                exstr += PostPro.lin_pol_z(mom_depth)
+                yield PostPro.lin_pol_z(mom_depth)
                 drag = False
         else:
-            exstr += PostPro.lin_pol_z(mom_depth)
+            yield PostPro.lin_pol_z(mom_depth)
             drag = False
-        exstr += PostPro.chg_feed_rate(f_g1_plane)
+        yield PostPro.chg_feed_rate(f_g1_plane)
 
-        exstr += self.stmove.geos.abs_el(1).Write_GCode(PostPro)
+        yield self.stmove.geos.abs_el(1).Write_GCode(PostPro)
 
         for geo in Geos(self.stmove.geos[2:]).abs_iter():
             if isinstance(geo, ArcGeo):
                 if geo.drag:
-                    exstr += PostPro.chg_feed_rate(f_g1_depth)
-                    exstr += PostPro.lin_pol_z(drag_depth)
-                    exstr += PostPro.chg_feed_rate(f_g1_plane)
+                    yield PostPro.chg_feed_rate(f_g1_depth)
+                    yield PostPro.lin_pol_z(drag_depth)
+                    yield PostPro.chg_feed_rate(f_g1_plane)
                     drag = True
                 elif drag:
-                    exstr += PostPro.chg_feed_rate(f_g1_depth)
-                    exstr += PostPro.lin_pol_z(mom_depth)
-                    exstr += PostPro.chg_feed_rate(f_g1_plane)
+                    yield PostPro.chg_feed_rate(f_g1_depth)
+                    yield PostPro.lin_pol_z(mom_depth)
+                    yield PostPro.chg_feed_rate(f_g1_plane)
                     drag = False
             elif drag:
-                exstr += PostPro.chg_feed_rate(f_g1_depth)
-                exstr += PostPro.lin_pol_z(mom_depth)
-                exstr += PostPro.chg_feed_rate(f_g1_plane)
+                yield PostPro.chg_feed_rate(f_g1_depth)
+                yield PostPro.lin_pol_z(mom_depth)
+                yield PostPro.chg_feed_rate(f_g1_plane)
                 drag = False
 
-            exstr += self.Write_GCode_for_geo(geo, PostPro)
+            yield self.Write_GCode_for_geo(geo, PostPro)
 
         # Do the tool retraction
-        exstr += PostPro.chg_feed_rate(f_g1_depth)
-        exstr += PostPro.lin_pol_z(workpiece_top_Z + abs(safe_margin))
-        exstr += PostPro.rap_pos_z(safe_retract_depth)
+        yield PostPro.chg_feed_rate(f_g1_depth)
+        yield PostPro.lin_pol_z(workpiece_top_Z + abs(safe_margin))
+        yield PostPro.rap_pos_z(safe_retract_depth)
 
         # Add string to be added before the shape will be cut.
-        exstr += PostPro.write_post_shape_cut()
-
-        return exstr
+        yield PostPro.write_post_shape_cut()
 
 
 class Geos(list):
-    def __init__(self, *args):
-        list.__init__(self, *args)
+    def __init__(self, geos=(), parentEntity=None, absGeos=None):
+        """
+        @param geos: the geometries
+        @param parentEntity: if given, the absolute geometries are made from
+        the geometries and this parent the first time they are needed
+        @param absGeos: the absolute geometries made before for the same parent
+        """
+        list.__init__(self, geos)
+        self.parentEntity = parentEntity
+        # The geometries of a block are shared by all its inserts, so their
+        # absolute geometries are kept here by the ids of the geometries, and
+        # not in the geometries. The geometry is kept too, so that its id is
+        # not reused.
+        self.absGeos = {} if absGeos is None else absGeos
 
-    def abs_iter(self):
+    def abs_iter(self, keep=True):
+        """
+        @param keep: keep the absolute geometries which are made. False if
+        they are needed only once, e.g. for drawing, so that they are not
+        kept for every insert of a block.
+        """
         for geo in list.__iter__(self):
-            yield geo.abs_geo if geo.abs_geo else geo
-        else:
-            raise StopIteration()
+            yield self.abs_geo(geo, keep)
 
     def abs_el(self, element):
-        return self[element].abs_geo if self[element].abs_geo else self[element]
+        return self.abs_geo(self[element])
+
+    def abs_geo(self, geo, keep=True):
+        if self.parentEntity is None:
+            return geo.abs_geo if geo.abs_geo else geo
+        entry = self.absGeos.get(id(geo))
+        if entry is None:
+            if not keep:
+                return geo.get_abs_geo(self.parentEntity)
+            entry = self.absGeos[id(geo)] = (geo, geo.get_abs_geo(self.parentEntity))
+        return entry[1]
+
+    def abs_start_points(self):
+        """
+        abs_start_points() - The start points of the absolute geometries,
+        without making the absolute geometries
+        """
+        for geo in list.__iter__(self):
+            if self.parentEntity is None or id(geo) in self.absGeos:
+                yield self.abs_geo(geo).get_start_end_points(True)
+            else:
+                yield geo.get_start_end_points(True).rot_sca_abs(parent=self.parentEntity)
+
+    def shifted(self, element):
+        """
+        shifted() - The geometries starting with the given one
+        @param element: the number of the new first geometry
+        @return: the new Geos, which shares the absolute geometries
+        """
+        return Geos(self[element:] + self[:element], self.parentEntity, self.absGeos)
+
+    def reversed(self):
+        """
+        reversed() - The geometries in reversed order and direction. They are
+        copied, since they may be shared by other shapes.
+        @return: the new Geos
+        """
+        geos = Geos([], self.parentEntity)
+        for geo in list.__reversed__(self):
+            entry = self.absGeos.get(id(geo))
+            geo = copy(geo)
+            if geo.abs_geo:
+                geo.abs_geo = copy(geo.abs_geo)
+            geo.reverse()
+            geos.append(geo)
+            if entry is not None:
+                abs_geo = copy(entry[1])
+                abs_geo.reverse()
+                geos.absGeos[id(geo)] = (geo, abs_geo)
+        return geos
+
+    def clear_abs_geos(self):
+        """
+        clear_abs_geos() - Forget the absolute geometries, when the transform
+        of the parent changed
+        """
+        self.absGeos.clear()
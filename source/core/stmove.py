@@ -36,6 +36,7 @@ from core.linegeo import LineGeo
 from core.arcgeo import ArcGeo
 from core.point import Point
 from core.intersect import Intersect
+from core.boxindex import BoxIndex, getGeoBoundingBox
 from core.shape import Geos
 
 logger = logging.getLogger('Gui.StMove')
@@ -151,7 +152,7 @@ class StMove(object):
         prvend, prvnorm = Point(), Point()
         first = True
 
-        for geo in self.shape.geos.abs_iter():
+        for geo in self.shape.geos.abs_iter(False):
             if isinstance(geo, LineGeo):
                 geo_b = deepcopy(geo)
                 if first:
@@ -228,7 +229,7 @@ class StMove(object):
             prv_Pe = end + toolwidth * end_proj
         else:
             prv_Pe = None
-        for geo_nr, geo in enumerate(self.shape.geos.abs_iter()):
+        for geo_nr, geo in enumerate(self.shape.geos.abs_iter(False)):
             start, start_dir = geo.get_start_end_points(True, False)
             end, end_dir = geo.get_start_end_points(False, False)
             start_proj = Point(direction * start_dir.y, -direction * start_dir.x)
@@ -262,26 +263,53 @@ class StMove(object):
         for geo in geos.abs_iter():
             tot_length += geo.length
 
+        # Find the geometries which may intersect each other once, so that
+        # only these are tested below
+        boxes = [getGeoBoundingBox(geo) for geo in geos]
+        boxIndex = BoxIndex(boxes)
+        candidates = [boxIndex.query(box) for box in boxes]
+
         reorder_shape = False
         for start_geo_nr in range(len(geos)):
             # if shape is not closed we may only remove shapes from the start
             last_geo_nr = start_geo_nr if self.shape.closed else 0
-            geos_adj = deepcopy(geos[start_geo_nr:]) + deepcopy(geos[:last_geo_nr])
+            order = list(range(start_geo_nr, len(geos))) + list(range(last_geo_nr))
+            positions = [-1] * len(geos)
+            for i, geo_nr in enumerate(order):
+                positions[geo_nr] = i
+            # The geometries are only copied when they are changed
+            geos_adj = [geos[geo_nr] for geo_nr in order]
+            changed = set()
+
+            def changeable(i):
+                if i not in changed:
+                    geos_adj[i] = deepcopy(geos_adj[i])
+                    changed.add(i)
+                return geos_adj[i]
+
             new_geos = Geos([])
             i = 0
             while i in range(len(geos_adj)):
                 geo = geos_adj[i]
+                if i in changed:
+                    near = boxIndex.query(getGeoBoundingBox(geo))
+                else:
+                    near = candidates[order[i]]
+                # changed geometries may have left their bounding boxes
+                later = set(j for j in changed if j > i)
+                later.update(j for j in (positions[geo_nr] for geo_nr in near) if j > i)
                 intersections = []
-                for j in range(i+1, len(geos_adj)):
+                for j in sorted(later):
                     intersection = Intersect.get_intersection_point(geos_adj[j], geos_adj[i])
                     if intersection and intersection != geos_adj[i].Ps:
                         intersections.append([j, intersection])
                 if len(intersections) > 0:
+                    geo = changeable(i)
                     intersection = intersections[-1]
                     change_end_of_geo = True
                     if i == 0 and intersection[0] >= len(geos_adj)//2:
                         geo.update_start_end_points(True, intersection[1])
-                        geos_adj[intersection[0]].update_start_end_points(False, intersection[1])
+                        changeable(intersection[0]).update_start_end_points(False, intersection[1])
                         if len(intersections) > 1:
                             intersection = intersections[-2]
                         else:
@@ -290,7 +318,7 @@ class StMove(object):
                     if change_end_of_geo:
                         geo.update_start_end_points(False, intersection[1])
                         i = intersection[0]
-                        geos_adj[i].update_start_end_points(True, intersection[1])
+                        changeable(i).update_start_end_points(True, intersection[1])
                 else:
                     i += 1
                 # TODO
@@ -316,7 +344,7 @@ class StMove(object):
                 break
         if reorder_shape and self.shape.closed:
             # we do not reorder the original shape if it's not closed
-            self.shape.geos = Geos(self.shape.geos[geos[start_geo_nr].geo_nr:] + self.shape.geos[:geos[start_geo_nr].geo_nr])
+            self.shape.geos = self.shape.geos.shifted(geos[start_geo_nr].geo_nr)
 
         if len(self.geos) == 0:
             self.append(RapidPos(self.start))
@@ -36,13 +36,16 @@ import logging
 import argparse
 import subprocess
 import tempfile
+import multiprocessing
 
 from core.point import Point
 from core.layercontent import LayerContent, Layers, Shapes
 from core.entitycontent import EntityContent
 from core.customgcode import CustomGCode
+from core.containmenttree import ContainmentTree
 from core.linegeo import LineGeo
 from core.holegeo import HoleGeo
+from core.shape import Geos, getDirectionArea
 from core.project import Project
 from globals.config import MyConfig
 import globals.globals as g
@@ -55,7 +58,7 @@ from gui.aboutdialog import AboutDialog
 from dxfimport.importer import ReadDXF
 
 from postpro.postprocessor import MyPostProcessor
-from postpro.tspoptimisation import TspOptimization
+from postpro.tspoptimisation import TspPool
 
 from globals.six import text_type, PY2
 import globals.constants as c
@@ -115,6 +118,8 @@ class MainWindow(QMainWindow):
 
         self.MyPostProcessor = MyPostProcessor()
         self.d2g = Project(self)
+        # The route optimisation running in the background
+        self.TspPool = None
 
         self.createActions()
         self.connectToolbarToConfig()
@@ -122,6 +127,7 @@ class MainWindow(QMainWindow):
         self.filename = ""
 
         self.valuesDXF = None
+        self.entityContours = {}
         self.shapes = Shapes([])
         self.entityRoot = None
         self.layerContents = Layers([])
@@ -357,8 +363,7 @@ class MainWindow(QMainWindow):
         """
         Optimize the tool path, then export the shapes
         """
-        self.optimizeTSP()
-        self.exportShapes()
+        self.optimizeTSP(export=True)
 
     def updateExportRoute(self):
         """
@@ -375,22 +380,30 @@ class MainWindow(QMainWindow):
             self.canvas_scene.addexprouteen()
         self.canvas_scene.update()
 
-    def optimizeTSP(self):
+    def optimizeTSP(self, export=False):
         """
         Method is called to optimize the order of the shapes. This is performed
-        by solving the TSP Problem.
+        by solving the TSP Problem. The GUI stays responsive while the layers
+        are optimised, calling it again while the optimisation runs stops it.
+        The shapes and their order can't be edited until it is done.
+        @param export: export the shapes when the optimisation is done
         """
-        self.setCursor(QtCore.Qt.WaitCursor)
-        self.app.processEvents()
+        if self.TspPool is not None:
+            logger.info(self.tr("Stopping the route optimisation"))
+            self.TspPool.cancel()
+            return
 
         logger.debug(self.tr('Optimize order of enabled shapes per layer'))
-        self.canvas_scene.delete_opt_paths()
 
         # Get the export order from the QTreeView
         logger.debug(self.tr('Updating order according to TreeView'))
         self.TreeHandler.updateExportOrder()
-        self.canvas_scene.addexproutest()
 
+        # The layers to optimise, with their export order before the optimisation
+        self.tsp_layers = []
+        jobs = []
+        settings = g.config.vars.Route_Optimisation
+        settings = dict((key, settings[key]) for key in settings)
         for LayerContent in self.layerContents.non_break_layer_iter():
             # Initial values for the Lists to export.
             shapes_to_write = []
@@ -422,71 +435,105 @@ class MainWindow(QMainWindow):
                 ende = Point(x_st, y_st)
                 shapes_st_en_points.append([start, ende])
 
-                TSPs = TspOptimization(shapes_st_en_points, shapes_fixed_order)
-                logger.info(self.tr("TSP start values initialised for Layer %s") % LayerContent.name)
                 logger.debug(self.tr("Shapes to write: %s") % shapes_to_write)
                 logger.debug(self.tr("Fixed order: %s") % shapes_fixed_order)
 
-                for it_nr in range(iter_):
-                    # Only show each 50th step.
-                    if it_nr % 50 == 0:
-                        TSPs.calc_next_iteration()
-                        new_exp_order = [LayerContent.exp_order[nr] for nr in TSPs.opt_route[1:]]
+                self.tsp_layers.append((LayerContent, LayerContent.exp_order))
+                # The worker processes get the coordinates, points can't be pickled
+                coordinates = [((st.x, st.y), (en.x, en.y)) for st, en in shapes_st_en_points]
+                jobs.append((coordinates, shapes_fixed_order, iter_, settings))
+            else:
+                LayerContent.exp_order = []
 
-                logger.debug(self.tr("TSP done with result: %s") % TSPs)
+        self.tsp_export = export
+        self.TspPool = TspPool(jobs, g.config.vars.Route_Optimisation['processes'])
+        self.TspPool.routeFound.connect(self.updateTspRoute)
+        self.TspPool.layerFinished.connect(self.finishTspLayer)
+        self.TspPool.finished.connect(self.finishTsp)
 
-                LayerContent.exp_order = new_exp_order
+        self.ui.actionOptimizePaths.setText(self.tr("Stop Optimizing Paths"))
+        self.setTspActionsEnabled(False)
+        self.setCursor(QtCore.Qt.BusyCursor)
+        self.updateExportRoute()
+        self.TspPool.start()
 
-                self.canvas_scene.addexproute(LayerContent.exp_order, LayerContent.nr)
-                logger.debug(self.tr("New Export Order after TSP: %s") % new_exp_order)
-                self.app.processEvents()
-            else:
-                LayerContent.exp_order = []
+    def updateTspRoute(self, index, route, length):
+        """
+        Show a better route of a layer, while the optimisation goes on
+        """
+        LayerContent, exp_order = self.tsp_layers[index]
+        LayerContent.exp_order = [exp_order[nr] for nr in route[1:]]
+        logger.debug(self.tr("Better route for Layer %s: %0.1f") % (LayerContent.name, length))
+        self.updateExportRoute()
 
-        if len(self.canvas_scene.routearrows) > 0:
-            self.ui.actionDeleteG0Paths.setEnabled(True)
-            self.canvas_scene.addexprouteen()
+    def finishTspLayer(self, index, route, lengths):
+        """
+        Take the result of the optimisation of a layer
+        """
+        LayerContent, exp_order = self.tsp_layers[index]
+        LayerContent.exp_order = [exp_order[nr] for nr in route[1:]]
+        logger.info(self.tr("Route length of Layer %s: %0.1f before, %0.1f after the optimisation")
+                    % ((LayerContent.name,) + tuple(lengths)))
+        logger.debug(self.tr("New Export Order after TSP: %s") % LayerContent.exp_order)
+        self.updateExportRoute()
+
+    def finishTsp(self):
+        """
+        Called when the optimisation of all layers is done or was stopped
+        """
+        self.stopTsp()
 
         # Update order in the treeView, according to path calculation done by the TSP
         self.TreeHandler.updateTreeViewOrder()
-        self.canvas_scene.update()
+        self.updateExportRoute()
 
-        self.unsetCursor()
+        if self.tsp_export:
+            self.exportShapes()
+
+    def stopTsp(self):
+        """
+        Stop the route optimisation, without taking any more results
+        """
+        if self.TspPool is not None:
+            self.TspPool.close()
+            self.TspPool = None
+            self.ui.actionOptimizePaths.setText(self.tr("Optimize Paths"))
+            self.setTspActionsEnabled(True)
+            self.unsetCursor()
+
+    def setTspActionsEnabled(self, status):
+        """
+        Enable or disable the actions which can't be used during the route
+        optimisation, and the editing of the shapes and their order in the
+        tree views and the context menu of the canvas, since the results
+        replace the export order
+        """
+        self.ui.actionOpen.setEnabled(status)
+        self.ui.actionReload.setEnabled(status)
+        self.ui.actionExportShapes.setEnabled(status)
+        self.ui.actionOptimizeAndExportShapes.setEnabled(status)
+        self.ui.mytabWidget.setEnabled(status)
+        self.canvas.setContextMenuPolicy(QtCore.Qt.DefaultContextMenu if status else QtCore.Qt.PreventContextMenu)
 
     def automaticCutterCompensation(self):
         if self.ui.actionAutomaticCutterCompensation.isEnabled() and\
            self.ui.actionAutomaticCutterCompensation.isChecked():
             for layerContent in self.layerContents.non_break_layer_iter():
                 if layerContent.automaticCutterCompensationEnabled():
-                    new_exp_order = []
-                    outside_compensation = True
-                    shapes_left = layerContent.shapes
-                    while len(shapes_left) > 0:
-                        shapes_left = [shape for shape in shapes_left
-                                       if not self.ifNotContainedChangeCutCor(shape, shapes_left, outside_compensation, new_exp_order)]
-                        outside_compensation = not outside_compensation
-                    layerContent.exp_order = list(reversed(new_exp_order))
+                    tree = ContainmentTree(layerContent.shapes)
+                    for shape in layerContent.shapes:
+                        if not isinstance(shape, CustomGCode):
+                            # outside compensation for the outer shapes, then alternating
+                            outside_compensation = tree.getDepth(shape) % 2 == 0
+                            if outside_compensation == shape.cw:
+                                shape.cut_cor = 41
+                            else:
+                                shape.cut_cor = 42
+                            self.canvas_scene.repaint_shape(shape)
+                    layerContent.exp_order = [shape.nr for shape in tree.getExportOrder()]
         self.TreeHandler.updateTreeViewOrder()
         self.canvas_scene.update()
 
-    def ifNotContainedChangeCutCor(self, shape, shapes_left, outside_compensation, new_exp_order):
-        if not isinstance(shape, CustomGCode):
-            for outerShape in shapes_left:
-                if self.isShapeContained(shape, outerShape):
-                    return False
-            if outside_compensation == shape.cw:
-                shape.cut_cor = 41
-            else:
-                shape.cut_cor = 42
-            self.canvas_scene.repaint_shape(shape)
-        new_exp_order.append(shape.nr)
-        return True
-
-    def isShapeContained(self, shape, outerShape):
-        return shape != outerShape and not isinstance(outerShape, CustomGCode) and\
-            outerShape.topLeft.x < shape.topLeft.x and shape.bottomRight.x < outerShape.bottomRight.x and\
-            outerShape.bottomRight.y < shape.bottomRight.y and shape.topLeft.y < outerShape.topLeft.y
-
     def showSaveDialog(self, title, MyFormats):
         """
         This function is called by the menu "Export/Export Shapes" of the main toolbar.
@@ -580,7 +627,7 @@ class MainWindow(QMainWindow):
         g.config.point_tolerance = float(SetTolDialog.result[0])
         g.config.fitting_tolerance = float(SetTolDialog.result[1])
 
-        self.d2g.reload()  # set tolerances requires a complete reload
+        self.d2g.small_reload()  # the contours are searched again, the file imported again if needed
 
     def scaleAll(self):
         title = self.tr('Scale Contour')
@@ -592,7 +639,6 @@ class MainWindow(QMainWindow):
             return
 
         self.cont_scale = float(ScaEntDialog.result[0])
-        self.entityRoot.sca = self.cont_scale
 
         self.d2g.small_reload()
 
@@ -606,7 +652,6 @@ class MainWindow(QMainWindow):
             return
 
         self.cont_rotate = radians(float(RotEntDialog.result[0]))
-        self.entityRoot.rot = self.cont_rotate
 
         self.d2g.small_reload()
 
@@ -637,9 +682,6 @@ class MainWindow(QMainWindow):
             self.cont_dx = float(MoveWpzDialog.result[0])
             self.cont_dy = float(MoveWpzDialog.result[1])
 
-        self.entityRoot.p0.x = self.cont_dx
-        self.entityRoot.p0.y = self.cont_dy
-
         self.d2g.small_reload()
 
     def setMachineTypeToMilling(self):
@@ -723,6 +765,7 @@ class MainWindow(QMainWindow):
             if not self.filename:
                 return False  # cancelled
 
+        self.stopTsp()
         self.setCursor(QtCore.Qt.WaitCursor)
         self.setWindowTitle("DXF2GCODE - [%s]" % self.filename)
         self.canvas.resetAll()
@@ -800,6 +843,9 @@ class MainWindow(QMainWindow):
 
         # Paint the canvas
         if not g.config.mode3d:
+            if self.canvas_scene is not None:
+                # Shapes kept by a reload must not be deleted with the old scene
+                self.canvas_scene.releaseShapes()
             self.canvas_scene = MyGraphicsScene()
             self.canvas.setScene(self.canvas_scene)
 
@@ -835,7 +881,10 @@ class MainWindow(QMainWindow):
                                         sca=[self.cont_scale, self.cont_scale, self.cont_scale], rot=self.cont_rotate)
         self.layerContents = Layers([])
         self.shapes = Shapes([])
+        self.entityContours = {}
 
+        self.splitLines = self.ui.actionSplitLineSegments.isChecked()
+        self.machineType = g.config.machine_type
         self.makeEntityShapes(self.entityRoot)
 
         for layerContent in self.layerContents:
@@ -843,6 +892,20 @@ class MainWindow(QMainWindow):
         self.layerContents.sort(key=lambda x: x.nr)
         self.newNumber = len(self.shapes)
 
+    def updateEntityRoot(self):
+        """
+        Apply the workpiece zero, scale and rotation to the root entity of
+        the shapes made before
+        @return: True if they changed
+        """
+        root = self.entityRoot
+        changed = (root.p0.x, root.p0.y, root.sca[0], root.rot) !=\
+            (self.cont_dx, self.cont_dy, self.cont_scale, self.cont_rotate)
+        root.p0 = Point(self.cont_dx, self.cont_dy)
+        root.sca = [self.cont_scale, self.cont_scale, self.cont_scale]
+        root.rot = self.cont_rotate
+        return changed
+
     def makeEntityShapes(self, parent, layerNr=-1):
         """
         Instance is called prior to plotting the shapes. It creates
@@ -851,30 +914,19 @@ class MainWindow(QMainWindow):
         @param parent: The parent of a shape is always an Entity. It may be the root
         or, if it is a Block, this is the Block.
         """
-        if parent.name == "Entities":
-            entities = self.valuesDXF.entities
-        else:
-            ent_nr = self.valuesDXF.Get_Block_Nr(parent.name)
-            entities = self.valuesDXF.blocks.Entities[ent_nr]
-
-        # Assigning the geometries in the variables geos & contours in cont
-        ent_geos = entities.geo
-
         # Loop for the number of contours
-        for cont in entities.cont:
+        for cont, ent_geo, cont_geos, area in self.getEntityContours(parent.name):
             # Query if it is in the contour of an insert or of a block
-            if ent_geos[cont.order[0][0]].Typ == "Insert":
-                ent_geo = ent_geos[cont.order[0][0]]
-
+            if cont_geos is None:
                 # Assign the base point for the block
                 new_ent_nr = self.valuesDXF.Get_Block_Nr(ent_geo.BlockName)
                 new_entities = self.valuesDXF.blocks.Entities[new_ent_nr]
                 pb = new_entities.basep
 
                 # Scaling, etc. assign the block
-                p0 = ent_geos[cont.order[0][0]].Point
-                sca = ent_geos[cont.order[0][0]].Scale
-                rot = ent_geos[cont.order[0][0]].rot
+                p0 = ent_geo.Point
+                sca = ent_geo.Scale
+                rot = ent_geo.rot
 
                 # Creating the new Entitie Contents for the insert
                 newEntityContent = EntityContent(nr=0,
@@ -895,22 +947,13 @@ class MainWindow(QMainWindow):
                                   cont.closed,
                                   parent)
 
-                for ent_geo_nr in range(len(cont.order)):
-                    ent_geo = ent_geos[cont.order[ent_geo_nr][0]]
-                    if cont.order[ent_geo_nr][1]:
-                        ent_geo.geo.reverse()
-                        for geo in ent_geo.geo:
-                            geo = copy(geo)
-                            geo.reverse()
-                            self.append_geo_to_shape(tmp_shape, geo)
-                        ent_geo.geo.reverse()
-                    else:
-                        for geo in ent_geo.geo:
-                            self.append_geo_to_shape(tmp_shape, copy(geo))
+                # The geometries are shared by all inserts of a block
+                for geo in cont_geos:
+                    self.append_geo_to_shape(tmp_shape, geo)
 
                 if len(tmp_shape.geos) > 0:
                     # All shapes have to be CW direction.
-                    tmp_shape.AnalyseAndOptimize()
+                    tmp_shape.AnalyseAndOptimize(area)
 
                     self.shapes.append(tmp_shape)
                     if g.config.vars.Import_Parameters['insert_at_block_layer'] and layerNr != -1:
@@ -925,7 +968,61 @@ class MainWindow(QMainWindow):
                         tmp_shape.setSelectionChangedCallback(self.TreeHandler.updateShapeSelection)
                         tmp_shape.setEnableDisableCallback(self.TreeHandler.updateShapeEnabling)
 
-    def append_geo_to_shape(self, shape, geo):
+    def getEntityContours(self, name):
+        """
+        Returns the contours of the Entities or of a Block. The geometries of
+        each contour are collected in their order and direction once, they are
+        shared by all inserts of a Block. The inserts only add their transform
+        in their EntityContent. The direction of the contour is analysed once
+        too, as area of the geometries.
+        @param name: "Entities" or the name of the Block
+        @return: list of (contour, last geometry, geometries, area) -
+        geometries is None if the contour is an insert, the area is 0 if the
+        direction must be analysed for each insert.
+        """
+        if name in self.entityContours:
+            return self.entityContours[name]
+
+        if name == "Entities":
+            entities = self.valuesDXF.entities
+        else:
+            ent_nr = self.valuesDXF.Get_Block_Nr(name)
+            entities = self.valuesDXF.blocks.Entities[ent_nr]
+
+        # Assigning the geometries in the variables geos & contours in cont
+        ent_geos = entities.geo
+
+        contours = []
+        for cont in entities.cont:
+            if ent_geos[cont.order[0][0]].Typ == "Insert":
+                contours.append((cont, ent_geos[cont.order[0][0]], None, 0.0))
+                continue
+
+            cont_geos = []
+            for ent_geo_nr in range(len(cont.order)):
+                ent_geo = ent_geos[cont.order[ent_geo_nr][0]]
+                if cont.order[ent_geo_nr][1]:
+                    for geo in reversed(ent_geo.geo):
+                        geo = copy(geo)
+                        geo.reverse()
+                        self.append_geo_to_contour(cont_geos, geo)
+                else:
+                    for geo in ent_geo.geo:
+                        self.append_geo_to_contour(cont_geos, geo)
+
+            area = 0.0
+            if cont_geos:
+                area = getDirectionArea(Geos(cont_geos), cont.closed)
+                # Nearly degenerated contours are analysed for each insert,
+                # since rounding may change their direction
+                if abs(area) < 1e-6 * sum(geo.length for geo in cont_geos) ** 2:
+                    area = 0.0
+            contours.append((cont, ent_geo, cont_geos, area))
+
+        self.entityContours[name] = contours
+        return contours
+
+    def append_geo_to_contour(self, geos, geo):
         if -1e-5 <= geo.length < 1e-5:  # TODO adjust import for this
             return
 
@@ -936,12 +1033,15 @@ class MainWindow(QMainWindow):
                 geo_a = deepcopy(geo)
                 geo_b.Pe -= diff
                 geo_a.Ps += diff
-                shape.append(geo_b)
-                shape.append(geo_a)
+                geos.append(geo_b)
+                geos.append(geo_a)
             else:
-                shape.append(geo)
+                geos.append(geo)
         else:
-            shape.append(geo)
+            geos.append(geo)
+
+    def append_geo_to_shape(self, shape, geo):
+        shape.append(geo)
 
         if isinstance(geo, HoleGeo):
             shape.type = 'Hole'
@@ -1005,6 +1105,7 @@ class MainWindow(QMainWindow):
 
     def closeEvent(self, e):
         logger.debug(self.tr("Closing"))
+        self.stopTsp()
         # self.writeSettings()
         e.accept()
 
@@ -1027,6 +1128,10 @@ if __name__ == "__main__":
     """
     The main function which is executed after program start.
     """
+    # The worker processes of the route optimisation start this program
+    # again when it is frozen into an executable
+    multiprocessing.freeze_support()
+
     Log = LoggerClass(logger)
 
     g.config = MyConfig()
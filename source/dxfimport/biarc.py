@@ -211,6 +211,9 @@ class BiarcClass(object):
         """
         get_biarc_fitting_error()
         """
+        if self.shape == "LineGeo":
+            return self.geos[0].distance2point(Pt)
+
         # Query in which segment of the circle the point is:
         w1 = self.geos[0].O.norm_angle(Pt)
         if (w1 >= min([self.geos[0].s_ang, self.geos[0].e_ang]))and\
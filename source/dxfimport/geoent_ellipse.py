@@ -27,6 +27,7 @@ from __future__ import absolute_import
 from __future__ import division
 
 from math import sqrt, sin, cos, atan2, degrees, pi
+import logging
 
 from core.point import Point
 from dxfimport.biarc import BiarcClass
@@ -34,6 +35,7 @@ from dxfimport.classes import PointsClass, ContourClass
 
 import globals.globals as g
 
+logger = logging.getLogger("DXFImport.GeoentEllipse")
 
 class GeoentEllipse(object):
     """
@@ -69,7 +71,7 @@ class GeoentEllipse(object):
 
         # Errechnen der Ellipse / Calculate the ellipse
         self.Ellipse_Grundwerte()
-        self.Ellipse_2_Arcs(tol)
+        self.Ellipse_2_Arcs(tol, g.config.vars.Import_Parameters['ellipse_fitting'])
 
     def __str__(self):
         # how to print the object
@@ -182,9 +184,22 @@ class GeoentEllipse(object):
             punkt, angle = self.geo[-1].get_start_end_points(direction)
         return punkt, angle
 
-    def Ellipse_2_Arcs(self, tol):
+    def Ellipse_2_Arcs(self, tol, fitting='uniform'):
         """
         Ellipse_2_Arcs()
+        @param tol: the fitting tolerance
+        @param fitting: 'uniform' or 'subdivide', see Ellipse_2_Arcs_subdivide()
+        """
+        if fitting == 'subdivide':
+            self.Ellipse_2_Arcs_subdivide(tol)
+        else:
+            self.Ellipse_2_Arcs_uniform(tol)
+        logger.debug("Ellipse Nr. %i fitted with %i biarcs" % (self.Nr, len(self.PtsVec) - 1))
+
+    def Ellipse_2_Arcs_uniform(self, tol):
+        """
+        Ellipse_2_Arcs_uniform() - Fit the ellipse with biarcs of equal
+        angular width, one more each time one of them is out of tolerance
         """
         # Anfangswert f�r Anzahl Elemente
         # Initial value for number of elements
@@ -237,6 +252,56 @@ class GeoentEllipse(object):
         # print degrees(angle)
         # print self
 
+    def Ellipse_2_Arcs_subdivide(self, tol):
+        """
+        Ellipse_2_Arcs_subdivide() - Fit the ellipse with biarcs, but only
+        split the intervals whose biarc is out of tolerance in halves. The
+        points and tangents needed by all intervals of a pass are calculated
+        at once.
+        """
+        min_step = 1e-9
+
+        # Start with two elements, as Ellipse_2_Arcs_uniform does
+        angles = [self.AngS, self.AngS + self.ext / 2, self.AngS + self.ext]
+        nodes = list(zip(angles, self.Ellipse_Points(angles), self.Ellipse_Tangents(angles)))
+        intervals = list(zip(nodes[:-1], nodes[1:]))
+        fitted = []
+
+        while intervals:
+            biarcs = [BiarcClass(node0[1], node0[2], node1[1], node1[2], tol / 100)
+                      for node0, node1 in intervals]
+
+            check_angs = []
+            for node0, node1 in intervals:
+                check_step = (node1[0] - node0[0]) / 4
+                check_angs += [node0[0] + check_step * i for i in range(1, 4)]
+            check_Pts = self.Ellipse_Points(check_angs)
+
+            failed = []
+            for nr, (node0, node1) in enumerate(intervals):
+                biarc = biarcs[nr]
+                if abs(node1[0] - node0[0]) < min_step or\
+                        max([biarc.get_biarc_fitting_error(Pt)
+                             for Pt in check_Pts[3 * nr:3 * nr + 3]]) < tol:
+                    fitted.append((abs(node0[0] - self.AngS), biarc, node1))
+                else:
+                    failed.append((node0, node1))
+
+            mid_angs = [(node0[0] + node1[0]) / 2 for node0, node1 in failed]
+            mid_nodes = zip(mid_angs, self.Ellipse_Points(mid_angs), self.Ellipse_Tangents(mid_angs))
+            intervals = []
+            for (node0, node1), mid_node in zip(failed, mid_nodes):
+                intervals += [(node0, mid_node), (mid_node, node1)]
+
+        # Bring the fitted intervals into the order of the ellipse again
+        fitted.sort(key=lambda interval: interval[0])
+
+        self.geo = []
+        self.PtsVec = [[nodes[0][1], nodes[0][2]]]
+        for dummy, biarc, node1 in fitted:
+            self.geo += biarc.geos[:]
+            self.PtsVec.append([node1[1], node1[2]])
+
     def check_ellipse_fitting_tolerance(self, biarc, tol, ang0, ang1):
         """
         check_ellipse_fitting_tolerance()
@@ -280,6 +345,27 @@ class GeoentEllipse(object):
         Ey = self.a * cos(alpha) * sin(self.rotation) + self.b * sin(alpha) * cos(self.rotation)
         return Point(self.center.x + Ex, self.center.y + Ey)
 
+    def Ellipse_Points(self, alphas):
+        """
+        Ellipse_Points() - Same as Ellipse_Point() for a list of angles
+        """
+        cos_rot = cos(self.rotation)
+        sin_rot = sin(self.rotation)
+        Points = []
+        for alpha in alphas:
+            a_cos = self.a * cos(alpha)
+            b_sin = self.b * sin(alpha)
+            Points.append(Point(self.center.x + a_cos * cos_rot - b_sin * sin_rot,
+                                self.center.y + a_cos * sin_rot + b_sin * cos_rot))
+        return Points
+
+    def Ellipse_Tangents(self, alphas):
+        """
+        Ellipse_Tangents() - Same as Ellipse_Tangent() for a list of angles
+        """
+        return [atan2(self.a * sin(alpha), self.b * cos(alpha)) + self.rotation + pi / 2
+                for alpha in alphas]
+
     def Ellipse_Tangent(self, alpha=0):  # Point(0,0)
         """
         Ellipse_Tanget()
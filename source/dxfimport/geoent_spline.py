@@ -56,11 +56,13 @@ class GeoentSpline:
         # Assign the fitting tolerance
         tol = g.config.fitting_tolerance
         check = g.config.vars.Import_Parameters['spline_check']
+        fitting = g.config.vars.Import_Parameters['spline_fitting']
 
         # Umwandeln zu einem ArcSpline
         # Convert to a ArcSpline
         Spline2ArcsClass = Spline2Arcs(degree=self.degree, Knots=self.Knots,
-                                       Weights=self.Weights, CPoints=self.CPoints, tol=tol, check=check)
+                                       Weights=self.Weights, CPoints=self.CPoints, tol=tol, check=check,
+                                       fitting=fitting)
 
         self.geo = Spline2ArcsClass.Curve
 
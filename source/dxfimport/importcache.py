@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+
+############################################################################
+#
+#   Copyright (C) 2008-2015
+#    Christian Kohlöffel
+#    Vinzenz Schulz
+#
+#   This file is part of DXF2GCODE.
+#
+#   DXF2GCODE is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   DXF2GCODE is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with DXF2GCODE.  If not, see <http://www.gnu.org/licenses/>.
+#
+############################################################################
+
+from __future__ import absolute_import
+
+import hashlib
+import os
+import sys
+import zlib
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+import globals.globals as g
+import globals.constants as c
+
+import logging
+logger = logging.getLogger("DxfImport.ImportCache")
+
+IMPORT_CACHE_VERSION = "1"
+"""
+version tag - increment this each time the importer or the classes it
+returns change, so that files imported by older versions are read again
+"""
+
+CACHE_EXTENSION = '.d2gcache'
+
+
+class ImportCacheClass(object):
+    """
+    On disk cache of imported DXF files. An entry is the pickled and
+    compressed result of ReadDXF, stored under a hash of the file contents,
+    the version of the application and the settings which change the
+    result. When the cache grows too
+    large, the least recently used entries are removed.
+    """
+    def __init__(self, folder, max_size):
+        """
+        @param folder: the folder the entries are stored in
+        @param max_size: the maximum size of all entries in bytes
+        """
+        self.folder = folder
+        self.max_size = max_size
+
+    def make_key(self, buffer_):
+        """
+        make_key() - Calculate the key of a DXF file
+        @param buffer_: the contents of the file
+        @return: the key as hex string
+        """
+        settings = (IMPORT_CACHE_VERSION,
+                    c.VERSION,
+                    c.REVISION,
+                    c.DATE,
+                    sys.version_info[0],
+                    g.config.point_tolerance,
+                    g.config.fitting_tolerance,
+                    g.config.vars.Import_Parameters['spline_check'],
+                    g.config.vars.Import_Parameters['spline_fitting'],
+                    g.config.vars.Import_Parameters['ellipse_fitting'],
+                    g.config.vars.Import_Parameters['contour_search'],
+                    g.config.vars.Import_Parameters['contour_search_max_paths'])
+        key = hashlib.sha1(buffer_)
+        key.update(repr(settings).encode('ascii'))
+        return key.hexdigest()
+
+    def get_filename(self, key):
+        return os.path.join(self.folder, key + CACHE_EXTENSION)
+
+    def load(self, key):
+        """
+        load() - Read an entry of the cache
+        @param key: as returned by make_key()
+        @return: the stored values, None if there is no such entry
+        """
+        filename = self.get_filename(key)
+        try:
+            with open(filename, 'rb') as file_:
+                values = pickle.loads(zlib.decompress(file_.read()))
+            # Mark the entry as recently used
+            os.utime(filename, None)
+        except EnvironmentError:
+            return None
+        except Exception as e:
+            logger.warning("Removing unreadable import cache entry %s: %s" % (filename, e))
+            self.remove(filename)
+            return None
+
+        logger.debug("Read import cache entry %s" % filename)
+        return values
+
+    def save(self, key, values):
+        """
+        save() - Store an entry in the cache and remove the least recently
+        used entries if the cache gets too large
+        @param key: as returned by make_key()
+        @param values: the picklable values to store
+        """
+        filename = self.get_filename(key)
+        try:
+            data = zlib.compress(pickle.dumps(values, pickle.HIGHEST_PROTOCOL))
+        except Exception as e:
+            logger.warning("Import result can not be cached: %s" % e)
+            return
+
+        if len(data) > self.max_size:
+            return
+
+        try:
+            if not os.path.isdir(self.folder):
+                os.makedirs(self.folder)
+            # Write to a temporary file first, so that no half written
+            # entries are read by other instances
+            temp_filename = filename + '.tmp'
+            with open(temp_filename, 'wb') as file_:
+                file_.write(data)
+            self.remove(filename)
+            os.rename(temp_filename, filename)
+        except EnvironmentError as e:
+            logger.warning("Writing import cache entry %s failed: %s" % (filename, e))
+            return
+
+        logger.debug("Wrote import cache entry %s (%i bytes)" % (filename, len(data)))
+        self.evict()
+
+    def evict(self):
+        """
+        evict() - Remove the least recently used entries, until all entries
+        fit into the maximum size
+        """
+        entries = []
+        try:
+            for name in os.listdir(self.folder):
+                if name.endswith(CACHE_EXTENSION):
+                    filename = os.path.join(self.folder, name)
+                    stat = os.stat(filename)
+                    entries.append((stat.st_mtime, stat.st_size, filename))
+        except EnvironmentError:
+            return
+
+        size = sum(entry[1] for entry in entries)
+        for mtime, entry_size, filename in sorted(entries):
+            if size <= self.max_size:
+                break
+            logger.debug("Removing import cache entry %s" % filename)
+            self.remove(filename)
+            size -= entry_size
+
+    def remove(self, filename):
+        try:
+            os.remove(filename)
+        except EnvironmentError:
+            pass
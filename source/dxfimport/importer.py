@@ -27,11 +27,19 @@ from __future__ import division
 
 from __future__ import absolute_import
 
+from array import array
+from bisect import bisect_left
 from copy import deepcopy, copy
+import locale
 import logging
+from math import floor
+import mmap
+from multiprocessing import cpu_count
+import os
+import time
 
 from core.point import Point
-from dxfimport.classes import ContourClass
+from dxfimport.classes import ContourClass, PointsClass
 from dxfimport.geoent_arc import GeoentArc
 from dxfimport.geoent_circle import GeoentCircle
 from dxfimport.geoent_insert import GeoentInsert
@@ -41,10 +49,11 @@ from dxfimport.geoent_spline import GeoentSpline
 from dxfimport.geoent_ellipse import GeoentEllipse
 from dxfimport.geoent_lwpolyline import GeoentLwPolyline
 from dxfimport.geoent_point import GeoentPoint
+from dxfimport.importcache import ImportCacheClass
 
 import globals.globals as g
 
-from globals.six import text_type
+from globals.six import text_type, PY2
 import globals.constants as c
 if c.PYQT5notPYQT4:
     from PyQt5.QtWidgets import QMessageBox
@@ -53,6 +62,12 @@ else:
     from PyQt4.QtGui import QMessageBox
     from PyQt4 import QtCore
 
+try:
+    from concurrent.futures import ProcessPoolExecutor
+except ImportError:
+    # Python 2 without the futures backport, the contours are searched serially
+    ProcessPoolExecutor = None
+
 logger = logging.getLogger("DxfImport.Import")
 
 
@@ -61,41 +76,83 @@ class ReadDXF(QtCore.QObject):
     def __init__(self, filename=None):
         QtCore.QObject.__init__(self)
 
+        if filename is None:
+            # Used by the worker processes, which only search contours
+            return
+
         # Setting up logger
         # logger = g.logger.logger
 
-        str_ = self.Read_File(filename)
-        g.config.metric = self.Get_Unit(str_)
+        # The tolerances the geometries and contours are made with
+        self.point_tolerance = g.config.point_tolerance
+        self.fitting_tolerance = g.config.fitting_tolerance
 
-        self.update_tool_values()
+        buffer_ = self.Read_File(filename)
+        # The mapping is also closed if reading fails, since it keeps the
+        # file locked on Windows
+        try:
+            import_cache = self.Get_Import_Cache()
+            if import_cache is not None:
+                cache_key = import_cache.make_key(buffer_)
+                values = import_cache.load(cache_key)
+                if values is not None:
+                    logger.info(self.tr("Reading DXF Structure from the import cache"))
+                    self.Set_Cached_Values(values)
+                    return
+
+            # Load the contour and store the values in the classes
+            self.line_pairs = self.Get_Line_Pairs(buffer_)
 
-        # Load the contour and store the values in the classes
-        self.line_pairs = self.Get_Line_Pairs(str_)
+            g.config.metric = self.Get_Unit(self.line_pairs)
 
-        # Debug Informationen
-        # logger.info(("\n\nFile has   %0.0f Lines" % len(str_)), 1)
-        # logger.info(("\nFile has   %0.0f Linepairs" % self.line_pairs.nrs), 1)
+            self.update_tool_values()
 
-        logger.info(self.tr("Reading DXF Structure"))
-        sections_pos = self.Get_Sections_pos()
-        self.layers = self.Read_Layers(sections_pos)
+            # Debug Informationen
+            # logger.info(("\nFile has   %0.0f Linepairs" % self.line_pairs.nrs), 1)
 
-        blocks_pos = self.Get_Blocks_pos(sections_pos)
-        self.blocks = self.Read_Blocks(blocks_pos)
-        self.entities = self.Read_Entities(sections_pos)
+            logger.info(self.tr("Reading DXF Structure"))
+            sections_pos = self.Get_Sections_pos()
+            self.layers = self.Read_Layers(sections_pos)
+
+            blocks_pos = self.Get_Blocks_pos(sections_pos)
+            self.blocks = self.Read_Blocks(blocks_pos)
+            self.entities = self.Read_Entities(sections_pos)
+        finally:
+            # All geometries are read, the file contents are not needed anymore
+            if hasattr(self, 'line_pairs'):
+                self.line_pairs.close()
+            elif hasattr(buffer_, 'close'):
+                buffer_.close()
+
+        self.Get_All_Contours()
+
+        if import_cache is not None:
+            import_cache.save(cache_key, (g.config.metric, self.layers, self.blocks, self.entities))
+
+    def Get_All_Contours(self):
+        """
+        Get_All_Contours() - Search the contours of all blocks and of the
+        entities. Called again when only the point tolerance changed, the
+        geometries do not depend on it.
+        """
+        self.point_tolerance = g.config.point_tolerance
 
         # Aufruf der Klasse um die Konturen zur suchen
         # Schleife f�r die Anzahl der Bl�cke und den Layern
         # Call the class to define the contours of search
         # Loop for the number of blocks and the layer
-        for i in range(len(self.blocks.Entities)):
-            # '\n'
-            # print self.blocks.Entities[i]
-            logger.info(self.tr("Creating Contours of Block Nr: %i") %i)
-            self.blocks.Entities[i].cont = self.Get_Contour(self.blocks.Entities[i])
+        processes = g.config.vars.Import_Parameters['contour_search_processes']
+        if processes != 1 and ProcessPoolExecutor is not None and len(self.blocks.Entities):
+            self.Get_Contours_Parallel(self.blocks.Entities + [self.entities], processes or None)
+        else:
+            for i in range(len(self.blocks.Entities)):
+                # '\n'
+                # print self.blocks.Entities[i]
+                logger.info(self.tr("Creating Contours of Block Nr: %i") %i)
+                self.blocks.Entities[i].cont = self.Get_Contour(self.blocks.Entities[i])
 
-        logger.info(self.tr("Creating Contours of Entities"))
-        self.entities.cont = self.Get_Contour(self.entities)
+            logger.info(self.tr("Creating Contours of Entities"))
+            self.entities.cont = self.Get_Contour(self.entities)
 
     def tr(self, string_to_translate):
         """
@@ -106,18 +163,49 @@ class ReadDXF(QtCore.QObject):
         return text_type(QtCore.QCoreApplication.translate('ReadDXF',
                                                            string_to_translate))
 
+    def Get_Import_Cache(self):
+        """
+        Get_Import_Cache() - The cache of imported files in the settings folder
+        @return: None if the cache is disabled
+        """
+        size = g.config.vars.Import_Parameters['import_cache_size']
+        if size <= 0:
+            return None
+        return ImportCacheClass(os.path.join(g.config.folder, 'import_cache'), size * 1024 * 1024)
+
+    def Set_Cached_Values(self, values):
+        """
+        Set_Cached_Values() - Use the values of the import cache instead of
+        reading the file
+        """
+        g.config.metric, self.layers, self.blocks, self.entities = values
+
+        self.update_tool_values()
+
+        self.layer_nrs = {}
+        for layer in self.layers:
+            self.layer_nrs.setdefault(layer.name, layer.Nr)
+        self.block_nrs = {}
+        for block_nr, block in enumerate(self.blocks.Entities):
+            self.block_nrs.setdefault(block.Name, block_nr)
+
     def Read_File(self, filename):
         """
         Read_File() - Load the selected DXF files
+        The file is mapped into memory instead of being read as a list of
+        strings, so that large files do not need to be copied.
         @param: filename: name of the file to load
-        @return: file contents as a list of strings
+        @return: file contents as a read-only buffer
         """
-        file_ = open(filename, 'r')
-        str_ = file_.readlines()
-        file_.close()
-        return str_
-
-    def Get_Unit(self, str):
+        with open(filename, 'rb') as file_:
+            try:
+                buffer_ = mmap.mmap(file_.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, EnvironmentError):
+                # Empty files (and some special files) cannot be mapped
+                buffer_ = file_.read()
+        return buffer_
+
+    def Get_Unit(self, line_pairs):
         """
         Get_Unit() - Get unit of measure English (Imperial) or Metric from DXF file
         """
@@ -127,10 +215,8 @@ class ReadDXF(QtCore.QObject):
 
         metric = 1  # default: metric
         try:
-            line = 0
-            while not str[line].startswith("$MEASUREMENT"):
-                line += 1
-            metric = int(str[line + 2].strip())
+            line = line_pairs.index_both(9, "$MEASUREMENT")
+            metric = int(line_pairs.line_pair[line + 1].value)
         except:  # $MEASUREMENT not found or is incorrect
             pass
 
@@ -142,13 +228,11 @@ class ReadDXF(QtCore.QObject):
         # 16 = Hectometers; 17 = Gigameters; 18 = Astronomical units;
         # 19 = Light years; 20 = Parsecs
         try:
-            line = 0
-            while not str[line].startswith("$INSUNITS"):
-                line += 1
-            line += 2
-            if int(str[line].stip()) == 1:
+            line = line_pairs.index_both(9, "$INSUNITS")
+            line += 1
+            if int(line_pairs.line_pair[line].value.stip()) == 1:
                 metric = 0
-            elif int(str[line].strip()) == 4:
+            elif int(line_pairs.line_pair[line].value.strip()) == 4:
                 metric = 1
         except:  # $INSUNITS not found or is incorrect
             pass
@@ -171,28 +255,57 @@ class ReadDXF(QtCore.QObject):
             g.config.tool_units_metric = g.config.metric
 
     # Convert the uploaded file into line pairs (code & Value).
-    def Get_Line_Pairs(self, string):
-        line = 0
-        line_pairs = dxflinepairsClass([])
-
-        # Start at the first SECTION
-        while not string[line].startswith("SECTION"):
-            line += 1
-        line -= 1
+    def Get_Line_Pairs(self, buffer_):
+        """
+        Get_Line_Pairs() - Tokenize the file contents in a single pass
+        Only the codes and the positions of the values are stored, the values
+        are decoded when they are accessed.
+        @param: buffer_: file contents as returned by Read_File()
+        @return: the line pairs of the file
+        """
+        line_pairs = dxflinepairsClass(buffer_)
+
+        # Files with old Mac line endings have no "\n" at all
+        eol = b'\n' if buffer_.find(b'\n') != -1 else b'\r'
+        find = buffer_.find
+        size = len(buffer_)
+
+        # Start at the first SECTION (the line pair starts one line before)
+        line = find(b'SECTION')
+        while line > 0 and buffer_[line - 1:line] not in (b'\n', b'\r'):
+            line = find(b'SECTION', line + 1)
+        if line == -1:
+            line = size
+        elif line > 0:
+            line = buffer_.rfind(eol, 0, line - 1) + 1
+
+        codes_append = line_pairs.codes.append
+        begins_append = line_pairs.value_begins.append
+        ends_append = line_pairs.value_ends.append
 
         # Continue to the end if no error occurs. Otherwise abort with error
         try:
-            while line + 1 < len(string):
-                line_pairs.line_pair.append(dxflinepairClass(int(string[line].strip()), string[line + 1].strip()))
-                line += 2
+            while line < size:
+                code_end = find(eol, line)
+                if code_end == -1 or code_end + 1 >= size:
+                    break
+                value_end = find(eol, code_end + 1)
+                if value_end == -1:
+                    value_end = size
+                codes_append(int(buffer_[line:code_end]))
+                begins_append(code_end + 1)
+                ends_append(value_end)
+                line = value_end + 1
 
         except ValueError:
             message = self.tr('Reading stopped at line %i.\n "%s" is not a valid code (number) - please, check/correct dxf file')\
-                      % (line + 1, string[line].strip())
+                      % (buffer_[:line].count(eol) + 1,
+                         line_pairs.decode(buffer_[line:code_end].strip()))
             logger.warning(message)
             QMessageBox.warning(g.window, self.tr("Warning reading linepairs"), message)
 
-        line_pairs.nrs = len(line_pairs.line_pair)
+        line_pairs.nrs = len(line_pairs.codes)
+        line_pairs.make_index()
         logger.debug(self.tr('Did read %i of linepairs from DXF') % line_pairs.nrs)
         return line_pairs
 
@@ -242,6 +355,8 @@ class ReadDXF(QtCore.QObject):
 
         # If the DXF blocks has, read this???
         layers = []
+        # Layer name -> number of the first layer with this name
+        self.layer_nrs = {}
         if 'tables_section' in vars():
             tables_section = section[sect_nr]
             start = tables_section.begin
@@ -252,6 +367,7 @@ class ReadDXF(QtCore.QObject):
                     start = self.line_pairs.index_code(2, start + 1)
                     layers.append(LayerClass(len(layers)))
                     layers[-1].name = self.line_pairs.line_pair[start].value
+                    self.layer_nrs.setdefault(layers[-1].name, layers[-1].Nr)
 
         # g.logger.logger.info(("Layers found:"), 1)
         # for lay in layers:
@@ -295,10 +411,13 @@ class ReadDXF(QtCore.QObject):
         Read_Blocks() - Read the block geometries
         """
         blocks = BlocksClass([])
+        # Block name -> number of the first block with this name
+        self.block_nrs = {}
         for block_nr in range(len(blocks_pos)):
             logger.info("Reading Block %s; Nr: %i" % (blocks_pos[block_nr].name, block_nr))
 
             blocks.Entities.append(EntitiesClass(block_nr, blocks_pos[block_nr].name, []))
+            self.block_nrs.setdefault(blocks_pos[block_nr].name, block_nr)
             # Read the Baseline values for the block
             s = blocks_pos[block_nr].begin + 1
             e = blocks_pos[block_nr].end - 1
@@ -422,26 +541,23 @@ class ReadDXF(QtCore.QObject):
     def Get_Layer_Nr(self, Layer_Name):
         """
         Get_Layer_Nr() - Find the number of geometry layers
+        Unknown layers are appended to the layers
         """
-        for i in range(len(self.layers)):
-            if self.layers[i].name == Layer_Name:
-                layer_nr = i
-                return layer_nr
-        layer_nr = len(self.layers)
-        self.layers.append(LayerClass(layer_nr))
-        self.layers[-1].name = Layer_Name
-        return layer_nr
+        try:
+            return self.layer_nrs[Layer_Name]
+        except KeyError:
+            layer_nr = len(self.layers)
+            self.layers.append(LayerClass(layer_nr))
+            self.layers[-1].name = Layer_Name
+            self.layer_nrs[Layer_Name] = layer_nr
+            return layer_nr
 
     def Get_Block_Nr(self, Block_Name):
         """
         Get_Block_Nr() - Find the number of blocks
+        @return: the number of the block, -1 if there is no such block
         """
-        block_nr = -1
-        for i in range(len(self.blocks.Entities)):
-            if self.blocks.Entities[i].Name == Block_Name:
-                block_nr = i
-                break
-        return block_nr
+        return self.block_nrs.get(Block_Name, -1)
 
     def Get_Contour(self, entities=None):
         """
@@ -450,13 +566,78 @@ class ReadDXF(QtCore.QObject):
         cont = []
 
         points = self.App_Cont_or_Calc_IntPts(entities.geo, cont)
-        points = self.Find_Common_Points(points)
+
+        return self.Find_Contours(entities.geo, points, cont,
+                                  g.config.point_tolerance,
+                                  g.config.vars.Import_Parameters['contour_search'],
+                                  g.config.vars.Import_Parameters['contour_search_max_paths'])
+
+    def Find_Contours(self, geo, points, cont, tol, contour_search, max_paths=0):
+        """
+        Find_Contours() - Connect the points of the open geometries to contours
+        @param tol: the tolerance of common points
+        @param contour_search: 'graph' or 'recursive', see the config
+        @param max_paths: the maximum number of paths the graph search compares
+        for a single contour, 0 for no limit
+        @return: cont with the contours found appended
+        """
+        points = self.Find_Common_Points(points, tol)
         # points = self.Remove_Redundant_Geos(points)
 
-        cont = self.Search_Contours(entities.geo, points, cont)
+        if contour_search == 'recursive':
+            cont = self.Search_Contours(geo, points, cont)
+        else:
+            cont = self.Search_Contours_Graph(geo, points, cont, max_paths)
 
         return cont
 
+    def Get_Contours_Parallel(self, entities_list, processes=None):
+        """
+        Get_Contours_Parallel() - Same as Get_Contour for each of the entities,
+        but the contour search runs in worker processes. The geometries are
+        analysed here, the workers only get a light record of their points.
+        @param entities_list: the blocks and entities to search the contours of
+        @param processes: number of worker processes, None for one per CPU
+        """
+        conts = []
+        records = []
+        for entities in entities_list:
+            cont = []
+            points = self.App_Cont_or_Calc_IntPts(entities.geo, cont)
+            conts.append(cont)
+            records.append(self.Get_Contour_Record(entities.geo, points, cont))
+
+        logger.info(self.tr("Creating Contours of %i Blocks and the Entities in parallel")
+                    % (len(entities_list) - 1))
+        try:
+            executor = ProcessPoolExecutor(processes)
+            try:
+                # Many small blocks are sent in chunks, map keeps the order
+                chunksize = max(1, len(records) // (4 * (processes or cpu_count())))
+                found = list(executor.map(Get_Contour_Worker, records, chunksize=chunksize))
+            finally:
+                executor.shutdown()
+        except Exception as e:
+            logger.warning(self.tr("Parallel contour search failed (%s), searching serially") % e)
+            found = [Get_Contour_Worker(record, self) for record in records]
+
+        for entities, cont, new_cont in zip(entities_list, conts, found):
+            entities.cont = cont + new_cont
+
+    def Get_Contour_Record(self, geo, points, cont):
+        """
+        Get_Contour_Record() - Everything the contour search needs to know,
+        as picklable tuples for Get_Contour_Worker
+        """
+        point_records = [(p.point_nr, p.geo_nr, p.Layer_Nr,
+                          p.be.x, p.be.y, p.en.x, p.en.y) for p in points]
+        return (g.config.point_tolerance,
+                g.config.vars.Import_Parameters['contour_search'],
+                g.config.vars.Import_Parameters['contour_search_max_paths'],
+                len(cont),
+                [geo_i.length for geo_i in geo],
+                point_records)
+
     def App_Cont_or_Calc_IntPts(self, geo=None, cont=None):
         """
         App_Cont_or_Calc_IntPts()
@@ -478,78 +659,72 @@ class ReadDXF(QtCore.QObject):
 
         return points
 
-    def Find_Common_Points(self, points=None):
+    def Find_Common_Points(self, points=None, tol=None):
         """
         Find_Common_Points() - Find common points
+        The end points are hashed into a grid per layer, so only the points
+        of the neighbouring cells need to be compared.
         """
         # tol = self.config.points_tolerance.get()
-        tol = g.config.point_tolerance
+        if tol is None:
+            tol = g.config.point_tolerance
 
-        p_list = []
+        # With a cell size of twice the tolerance points within the tolerance
+        # are always in the same or in a directly neighbouring cell
+        cell = 2 * tol if tol > 0 else 1.0
 
-        # Einen List aus allen Punkten generieren
-        # Generate list of all points
-        for p in points:
-            p_list.append([p.Layer_Nr, p.be.x, p.be.y, p.point_nr, 0])
-            p_list.append([p.Layer_Nr, p.en.x, p.en.y, p.point_nr, 1])
+        start_time = time.time()
 
-        # Sort the list
-        p_list.sort()
-        # print p_list
-
-        # Loop for number of list items
-        # Start = where to begin the search of the same elements
-        anf = []
+        # Generate list of all points and sort them into the grid
+        p_list = []
+        grid = {}
+        for p in points:
+            for end, pt in ((0, p.be), (1, p.en)):
+                entry = (p.Layer_Nr, pt.x, pt.y, p.point_nr, end)
+                p_list.append(entry)
+                key = (p.Layer_Nr, int(floor(pt.x / cell)), int(floor(pt.y / cell)))
+                try:
+                    grid[key].append(entry)
+                except KeyError:
+                    grid[key] = [entry]
+
+        grid_time = time.time()
+
+        compared = 0
+        found = 0
+        for entry in p_list:
+            Layer_Nr, x, y = entry[0:3]
+            cx = int(floor(x / cell))
+            cy = int(floor(y / cell))
 
-        for l_nr in range(len(p_list)):
             inter = []
-            # print ("Suche Starten f�r Geometrie Nr: %i, Punkt %i" % (p_list[l_nr][3], l_nr))
-
-            if isinstance(anf, list):
-                c_nr = 0
-            else:
-                c_nr = anf
-
-            anf = []
-
-            # Schleife bis n�chster X Wert Gr��er ist als selbst +tol und Layer Gr��er gleich
-            # Loop until the next X value is greater than yourself and layer Gr + tol he same ???
-            while p_list[c_nr][0] < p_list[l_nr][0] or \
-                  p_list[c_nr][1] <= (p_list[l_nr][1] + tol):
-                # print ("Suche Punkt %i" % (c_nr))
-
-                # Erstes das �bereinstimmt is der n�chste Anfang
-                # First, the match is the next start
-                if isinstance(anf, list) and\
-                   p_list[c_nr][0] == p_list[l_nr][0] and\
-                   abs(p_list[c_nr][1] - p_list[l_nr][1]) <= tol:
-                    anf = c_nr
-                    # print ("N�chste Suche starten bei" +str(anf))
-
-                # Falls gleich anh�ngen
-                # Attach if equal ???
-                if p_list[c_nr][0] == p_list[l_nr][0] and \
-                   abs(p_list[c_nr][1] - p_list[l_nr][1]) <= tol and\
-                   abs(p_list[c_nr][2] - p_list[l_nr][2]) <= tol and\
-                   c_nr != l_nr:
-                    inter.append(c_nr)
-                    # print ("Gefunden" +str(inter))
-                c_nr += 1
-
-                if c_nr == len(p_list):
-                    break
-
-            # Anh�ngen der gefundenen Punkte an points
-            # Append the found points
+            for key in ((Layer_Nr, cx - 1, cy - 1), (Layer_Nr, cx - 1, cy), (Layer_Nr, cx - 1, cy + 1),
+                        (Layer_Nr, cx, cy - 1), (Layer_Nr, cx, cy), (Layer_Nr, cx, cy + 1),
+                        (Layer_Nr, cx + 1, cy - 1), (Layer_Nr, cx + 1, cy), (Layer_Nr, cx + 1, cy + 1)):
+                for other in grid.get(key, ()):
+                    compared += 1
+                    if abs(other[1] - x) <= tol and\
+                       abs(other[2] - y) <= tol and\
+                       other is not entry:
+                        inter.append(other)
+
+            # Append the found points in the same order as the sorted list
+            # of all points would give them
+            inter.sort()
+            found += len(inter)
             for int_p in inter:
-                # Common Anfangspunkt
                 # Common starting point
-                if p_list[l_nr][-1] == 0:
-                    points[p_list[l_nr][-2]].be_cp.append(p_list[int_p][3:5])
-                # Common Endpunkt
+                if entry[4] == 0:
+                    points[entry[3]].be_cp.append(list(int_p[3:5]))
                 # Common end point
                 else:
-                    points[p_list[l_nr][-2]].en_cp.append(p_list[int_p][3:5])
+                    points[entry[3]].en_cp.append(list(int_p[3:5]))
+
+        end_time = time.time()
+        logger.debug("Find_Common_Points: %i end points in %i cells, %i compared, %i common; "
+                     "hashing %0.3fs, matching %0.3fs"
+                     % (len(p_list), len(grid), compared, found,
+                        grid_time - start_time, end_time - grid_time))
 
         return points
 
@@ -653,9 +828,11 @@ class ReadDXF(QtCore.QObject):
         for i in range(len(weiter)):
             # Wenn es die erste M�glichkeit ist Hinzuf�gen zur aktuellen Kontur
             # If it is the first possibility to add to the current contour
+            # The common points are copied, since the contours are reversed
+            # and renumbered in place
             if i == 0:
                 if not(c[c_nr].is_contour_closed()):
-                    c[c_nr].order.append(weiter[0])
+                    c[c_nr].order.append(weiter[0][:])
 
             # There is a branch.  It is copied to the current contour and the
             # other branches follow
@@ -664,7 +841,7 @@ class ReadDXF(QtCore.QObject):
                     # print 'Abzweig ist m�glich'
                     c.append(deepcopy(c[c_nr]))
                     del c[-1].order[-1]
-                    c[-1].order.append(weiter[i])
+                    c[-1].order.append(weiter[i][:])
 
         for i in range(len(weiter)):
             # print 'I ist: ' +str(i)
@@ -754,6 +931,283 @@ class ReadDXF(QtCore.QObject):
         # Return to the contour ???
         return points
 
+    def Search_Contours_Graph(self, geo=None, all_points=None, cont=None, max_paths=0):
+        """
+        Search_Contours_Graph() - Find the best continuous contours
+        Same search as Search_Contours(), but the common points are used as a
+        graph of the end points. The paths share their common elements
+        instead of being copied at every branch, and used points are flagged
+        instead of removing them from a copy of all points.
+        @param max_paths: see Search_Paths_Graph()
+        """
+        used = bytearray(len(all_points))
+
+        # The common points of each point by direction, like en_cp and be_cp
+        # in Search_Contours() they lose their references to used points
+        adjacency = [(list(point.en_cp), list(point.be_cp)) for point in all_points]
+
+        # The geometries and their lengths by point number
+        point_geos = [geo[point.geo_nr] for point in all_points]
+        lengths = [geo_i.length for geo_i in point_geos]
+
+        # Like Search_Contours() the search starts again at the first unused
+        # point, the contour found does not need to contain it
+        p_nr = 0
+        while p_nr < len(all_points):
+            if used[p_nr]:
+                p_nr += 1
+                continue
+
+            en_cp, be_cp = adjacency[p_nr]
+
+            # If nothing found then count up the contour
+            if len(be_cp) == 0 and len(en_cp) == 0:
+                cont.append(ContourClass(len(cont), 0, [[p_nr, 0]], 0))
+            elif len(be_cp) == 0:
+                paths = self.Search_Paths_Graph([[p_nr, 0]], adjacency, used, lengths, max_paths)
+                cont.append(self.Get_Path_Contour(len(cont), paths[self.Get_Best_Path(paths)], point_geos))
+            elif len(en_cp) == 0:
+                paths = self.Search_Paths_Graph([[p_nr, 1]], adjacency, used, lengths, max_paths)
+                cont.append(self.Get_Path_Contour(len(cont), paths[self.Get_Best_Path(paths)], point_geos))
+            else:
+                paths = self.Search_Paths_Graph([[p_nr, 1]], adjacency, used, lengths, max_paths)
+                best = self.Get_Best_Path(paths)
+                cont.append(self.Get_Path_Contour(len(cont), paths[best], point_geos))
+
+                # If the path is not closed by the first point
+                if cont[-1].closed == 0:
+                    cont[-1].reverse()
+                    # Search_Contours() continues the best path itself, so
+                    # it is not compared again with its old length
+                    paths = self.Search_Paths_Graph(cont[-1].order, adjacency, used, lengths, max_paths) +\
+                        paths[:best] + paths[best + 1:]
+                    cont[-1] = self.Get_Path_Contour(len(cont) - 1, paths[self.Get_Best_Path(paths)],
+                                                     point_geos)
+
+            self.Remove_Used_Points_Graph(cont[-1], all_points, adjacency, used)
+
+            cont[-1] = self.Contours_Points2Geo(cont[-1], all_points)
+        return cont
+
+    def Remove_Used_Points_Graph(self, cont, all_points, adjacency, used):
+        """
+        Remove_Used_Points_Graph() - Flag the points of a contour as used and
+        remove them from the common points of the others. As in
+        Remove_Used_Points() only the first reference to a point is removed
+        from the be_cp and en_cp of each point, but only the points which
+        have common points with it are looked at.
+        """
+        for element in cont.order:
+            used[element[0]] = 1
+
+        for element in cont.order:
+            p_nr = element[0]
+            point = all_points[p_nr]
+            for nr in set(cp[0] for cp in point.be_cp + point.en_cp):
+                if used[nr]:
+                    continue
+                for common_points in adjacency[nr]:
+                    for i in range(len(common_points)):
+                        if common_points[i][0] == p_nr:
+                            del common_points[i]
+                            break
+
+    def Get_Next_Elements(self, element, adjacency, used):
+        """
+        Get_Next_Elements() - The elements which can follow an element
+        References to used points, which the removal rule of
+        Remove_Used_Points() can leave, are not followed.
+        @param element: [point_nr, dir] of the element
+        @return: list of new [point_nr, dir] elements
+        """
+        return [[p_nr, dir] for p_nr, dir in adjacency[element[0]][element[1]]
+                if not used[p_nr]]
+
+    def Search_Paths_Graph(self, order, adjacency, used, lengths, max_paths=0):
+        """
+        Search_Paths_Graph() - Search the paths through the Contour
+        Iterative version of Search_Paths(), the branches are followed in the
+        same order. A path is stored as its last PathElementClass, so the
+        paths share their common elements and a branch only adds one
+        element. The positions of the points are kept for the path which is
+        continued, so it is known immediately whether a path is closed.
+        @param order: the elements of the contour to continue
+        @param lengths: the lengths of the geometries by point number
+        @param max_paths: stop the search when more paths were found, 0 for
+        no limit. The number of paths grows exponentially with the branches.
+        @return: list of the found paths as [last element, closed, element],
+        the element is the first one of a path closed by its first point and
+        the last one kept of a path closed by another point
+        """
+        # The elements of the path which is continued and the position of
+        # the first element of each point within it
+        active = []
+        positions = {}
+        node = None
+        for element in order:
+            node = PathElementClass(element[:], node, lengths[element[0]])
+            positions.setdefault(element[0], node.depth)
+            active.append(node)
+        c = [[node, 0, None]]
+
+        # Each entry of the stack is [c_nr, number of branches, next branch].
+        # Negative path numbers are kept, as in Search_Paths() they count from
+        # the end of the paths when they are used.
+        stack = []
+        c_nr = 0
+        while True:
+            if c_nr is not None:
+                last = c[c_nr][0]
+                self.Set_Active_Path(last, active, positions)
+
+                # Next point depending on the direction
+                weiter = self.Get_Next_Elements(last.element, adjacency, used)
+
+                for i in range(len(weiter)):
+                    if c[c_nr][1]:
+                        break
+                    node = PathElementClass(weiter[i], last, lengths[weiter[i][0]])
+                    position = positions.get(weiter[i][0])
+                    if i == 0:
+                        # If it is the first possibility add it to the current path
+                        c[c_nr][0] = node
+                        self.Set_Path_Closed(c[c_nr], position, active)
+                        active.append(node)
+                        positions.setdefault(weiter[i][0], node.depth)
+                    else:
+                        # There is a branch, the other possibilities start
+                        # new paths after the current one
+                        if position == node.depth:
+                            # The position of the first possibility
+                            position = None
+                        c.append([node, 0, None])
+                        self.Set_Path_Closed(c[-1], position, active)
+
+                stack.append([c_nr, len(weiter), 0])
+
+                if max_paths and len(c) > max_paths:
+                    logger.warning(self.tr("Contour search stopped after %i paths, "
+                                           "the best contour found so far is used") % len(c))
+                    break
+
+            # Continue with the next branch of the last element
+            while stack and stack[-1][2] == stack[-1][1]:
+                del stack[-1]
+            if not stack:
+                break
+
+            c_nr, nr_weiter, i = stack[-1]
+            stack[-1][2] += 1
+
+            # The paths are taken from the end of the list like in
+            # Search_Paths(), even if the first branch added new ones
+            if i > 0:
+                c_nr = len(c) - nr_weiter + i
+                if not -len(c) <= c_nr < len(c):
+                    c_nr = None
+                    continue
+
+            if c[c_nr][1]:
+                c_nr = None
+
+        return c
+
+    def Set_Active_Path(self, node, active, positions):
+        """
+        Set_Active_Path() - Make the path ending with node the one whose
+        positions are known. Only the elements after the common elements of
+        both paths are changed.
+        """
+        new = []
+        while node is not None and not (node.depth < len(active) and active[node.depth] is node):
+            new.append(node)
+            node = node.parent
+
+        keep = 0 if node is None else node.depth + 1
+        while len(active) > keep:
+            old = active.pop()
+            if positions.get(old.element[0]) == old.depth:
+                del positions[old.element[0]]
+
+        for node in reversed(new):
+            positions.setdefault(node.element[0], node.depth)
+            active.append(node)
+
+    def Set_Path_Closed(self, path, position, active):
+        """
+        Set_Path_Closed() - Set closed like ContourClass.is_contour_closed()
+        does, if the last element of a path is at position in the path
+        """
+        if position is None:
+            return
+        elif position == 0:
+            path[1] = 1
+            path[2] = active[0]
+        else:
+            path[1] = 2
+            path[2] = active[position - 1]
+
+    def Get_Path_Length(self, path):
+        """
+        Get_Path_Length() - The length of a path as Get_Best_Contour()
+        calculates it
+        @return: (closed, length), closed is 0 for paths closed by another
+        point, since the loop is removed
+        """
+        node, closed, element = path
+        if closed == 1:
+            # The first element is only counted once
+            if node.element == element.element:
+                return 1, node.parent.length
+            return 1, node.length
+        elif closed == 2:
+            return 0, element.length
+        return 0, node.length
+
+    def Get_Best_Path(self, paths):
+        """
+        Get_Best_Path() - Same choice as Get_Best_Contour(), the longest closed
+        path, if there is none the longest open one
+        @return: the number of the best path
+        """
+        best = None
+        best_open = None
+        for i, path in enumerate(paths):
+            closed, length = self.Get_Path_Length(path)
+            if closed:
+                if best is None or best_length < length:
+                    best = i
+                    best_length = length
+            else:
+                if best_open is None or best_open_length < length:
+                    best_open = i
+                    best_open_length = length
+
+        if best is None:
+            best = best_open
+        return best
+
+    def Get_Path_Contour(self, c_nr, path, geo):
+        """
+        Get_Path_Contour() - The contour of a path, with the loop removed if
+        it is closed by another point
+        """
+        node, closed, element = path
+        if closed == 2:
+            node = element
+            closed = 0
+
+        # The elements are copied, the contour is reversed in place
+        order = []
+        while node is not None:
+            order.append(node.element[:])
+            node = node.parent
+        order.reverse()
+
+        contour = ContourClass(cont_nr=c_nr, closed=closed, order=order)
+        contour.calc_length(geo)
+        return contour
+
     # All the points in the path from Point Clear to accelerate nights Search ???
     def Contours_Points2Geo(self, cont=None, points=None):
         """
@@ -773,32 +1227,106 @@ class dxflinepairClass:
         return 'Code ->' + str(self.code) + '\nvalue ->' + self.value
 
 class dxflinepairsClass:
-    def __init__(self, line_pair):
+    """
+    The line pairs of a DXF file. The codes and the positions of the values
+    within the file contents are stored in flat arrays, line_pair[i] creates
+    the dxflinepairClass of a pair when it is accessed.
+    """
+    def __init__(self, buffer_=b''):
         self.nrs = 0
-        self.line_pair = line_pair
+        self.buffer = buffer_
+        self.encoding = locale.getpreferredencoding(False)
+        self.codes = array('i')
+        self.value_begins = array('l')
+        self.value_ends = array('l')
+        self.line_pair = dxflinepairsView(self)
+        self.code_index = {}
+        self.value_index = {}
 
     def __str__(self):
         return 'Number of Line Pairs: ' + str(self.nrs)
 
-    # Search for information in the line pairs (both code & value)
-    # Optional start and end values for the search
-    def index_both(self, code=0, value=0, start=0, stop= -1):
+    def __len__(self):
+        return len(self.codes)
+
+    def close(self):
         """
-        index_both()
+        close() - Release the file contents, the pairs can not be read anymore
+        """
+        if hasattr(self.buffer, 'close'):
+            self.buffer.close()
+        self.buffer = b''
+
+    def decode(self, raw):
+        """
+        decode() - Convert the raw bytes of a line to a string
+        """
+        if PY2:
+            return raw
+        try:
+            return raw.decode(self.encoding)
+        except UnicodeDecodeError:
+            # Older DXF files are written in the ANSI code page of the writer
+            return raw.decode('latin-1')
+
+    def value(self, i):
+        """
+        value() - Decode the value of line pair i
         """
+        return self.decode(self.buffer[self.value_begins[i]:self.value_ends[i]].strip())
 
-        # If stop==-1 then stop at the end of the pairs
+    def make_index(self):
+        """
+        make_index() - Collect the positions of the line pairs for each code
+        The positions are sorted, so index_code() and index_both() can find
+        the next occurrence of a code with a binary search.
+        """
+        self.code_index = {}
+        self.value_index = {}
+        code_index = self.code_index
+        for i, code in enumerate(self.codes):
+            try:
+                code_index[code].append(i)
+            except KeyError:
+                code_index[code] = array('l', [i])
+
+    def get_value_index(self, code):
+        """
+        get_value_index() - Positions of the line pairs of code for each value
+        The values of a code are decoded the first time they are searched for.
+        """
+        try:
+            return self.value_index[code]
+        except KeyError:
+            values = {}
+            for i in self.code_index.get(code, ()):
+                values.setdefault(self.value(i), array('l')).append(i)
+            self.value_index[code] = values
+            return values
+
+    def find_next(self, positions, start, stop):
+        """
+        find_next() - First of the sorted positions within [start, stop)
+        """
+        # If stop == -1 then stop at the end of the pairs
         if stop == -1:
-            stop = len(self.line_pair)
+            stop = self.nrs
 
-        # Start the search within the specified parameters
-        for i in range(start, stop):
-            if self.line_pair[i].code == code and self.line_pair[i].value == value:
-                return i
+        i = bisect_left(positions, start)
+        if i < len(positions) and positions[i] < stop:
+            return positions[i]
 
-        #If nothing found return "None"
+        # If nothing found return "None"
         return None
 
+    # Search for information in the line pairs (both code & value)
+    # Optional start and end values for the search
+    def index_both(self, code=0, value=0, start=0, stop= -1):
+        """
+        index_both()
+        """
+        return self.find_next(self.get_value_index(code).get(value, ()), start, stop)
+
     #Sucht nach Code Angaben in den Line Pairs code & value
     #optional mit start und endwert f�r die Suche
     #Search for information in the Line Pairs (both code & value)
@@ -807,18 +1335,65 @@ class dxflinepairsClass:
         """
         index_code()
         """
+        return self.find_next(self.code_index.get(code, ()), start, stop)
 
-        # If stop == -1 then stop at the end of the pairs
-        if stop == -1:
-            stop = len(self.line_pair)
+class dxflinepairsView:
+    """
+    Sequence of the dxflinepairClass objects of a dxflinepairsClass
+    """
+    def __init__(self, line_pairs):
+        self.line_pairs = line_pairs
 
-        # Start the search within the specified parameters
-        for i in range(start, stop):
-            if self.line_pair[i].code == code:
-                return i
+    def __len__(self):
+        return len(self.line_pairs.codes)
+
+    def __getitem__(self, i):
+        return dxflinepairClass(self.line_pairs.codes[i], self.line_pairs.value(i))
+
+def Get_Contour_Worker(record, importer=None):
+    """
+    Get_Contour_Worker() - Search the contours of one block in a worker process
+    @param record: as returned by ReadDXF.Get_Contour_Record()
+    @return: the contours which were found, numbered after the closed ones
+    """
+    tol, contour_search, max_paths, nr_closed, lengths, point_records = record
+
+    if importer is None:
+        importer = ReadDXF()
+
+    geo = [GeoLengthClass(length) for length in lengths]
+    points = [PointsClass(point_nr=point_nr, geo_nr=geo_nr, Layer_Nr=Layer_Nr,
+                          be=Point(bx, by), en=Point(ex, ey), be_cp=[], en_cp=[])
+              for point_nr, geo_nr, Layer_Nr, bx, by, ex, ey in point_records]
+
+    # The closed contours stay in the main process, the placeholders only
+    # keep the numbering of the new contours the same
+    cont = importer.Find_Contours(geo, points, [None] * nr_closed, tol, contour_search, max_paths)
+    return cont[nr_closed:]
+
+
+class PathElementClass(object):
+    """
+    An element of a path of Search_Paths_Graph(), the path consists of this
+    element and the ones before
+    """
+    __slots__ = ('element', 'parent', 'depth', 'length')
+
+    def __init__(self, element, parent, length):
+        self.element = element
+        self.parent = parent
+        if parent is None:
+            self.depth = 0
+            self.length = length
+        else:
+            self.depth = parent.depth + 1
+            self.length = parent.length + length
+
+
+class GeoLengthClass:
+    def __init__(self, length=0.0):
+        self.length = length
 
-        # If nothing found return "None"
-        return None
 
 class LayerClass:
     def __init__(self, Nr=0, name=''):
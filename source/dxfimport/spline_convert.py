@@ -26,9 +26,18 @@
 from __future__ import absolute_import
 from __future__ import division
 
-from math import atan2
+from math import atan2, pi
 import logging
 
+try:
+    import numpy as np
+except ImportError:
+    # Without NumPy the batches are evaluated point by point
+    np = None
+
+# Smaller batches are faster evaluated point by point, even with NumPy
+NUMPY_MIN_BATCH = 8
+
 from core.point import Point
 from core.arcgeo import ArcGeo
 from core.linegeo import LineGeo
@@ -39,11 +48,13 @@ logger = logging.getLogger("DxfImport.SplineConvert")
 debug_on = False
 
 class Spline2Arcs:
-    def __init__(self, degree=0, Knots=[], Weights=[], CPoints=[], tol=0.01, check=1):
+    def __init__(self, degree=0, Knots=[], Weights=[], CPoints=[], tol=0.01, check=1, fitting='adaptive'):
         # Max Abweichung f�r die Biarc Kurve
         self.epsilon = tol
         self.epsilon_high = self.epsilon * 0.1
         self.segments = 50
+        # 'stepwise' walks along the spline, 'adaptive' splits it where the curvature changes
+        self.fitting = fitting
 
         # NURBS Klasse initialisieren
         self.NURBS = NURBSClass(degree=degree, Knots=Knots,
@@ -366,7 +377,10 @@ class Spline2Arcs:
         for u_sect in u_sections:
             if debug_on:
                 logger.debug("Calculation Biarc Section: %s" % u_sect)
-            BiarcCurve, PtsVec = self.calc_Biarc_section(u_sect, self.epsilon, self.epsilon_high)
+            if self.fitting == 'adaptive':
+                BiarcCurve, PtsVec = self.calc_Biarc_section_adaptive(u_sect, self.epsilon, self.epsilon_high)
+            else:
+                BiarcCurve, PtsVec = self.calc_Biarc_section(u_sect, self.epsilon, self.epsilon_high)
             BiarcCurves.append(BiarcCurve)
             PtsVecs.append(PtsVec)
         return BiarcCurves, PtsVecs
@@ -466,19 +480,97 @@ class Spline2Arcs:
 
         return BiarcCurve, PtsVec
 
-    def check_biarc_fitting_tolerance(self, Biarc, epsilon, u0, u1):
+    def calc_Biarc_section_adaptive(self, u_sect, nom_tol, max_tol):
         """
-        check_biarc_fitting_tolerance()
+        calc_Biarc_section_adaptive() - Same as calc_Biarc_section, but the
+        points and tangents of the whole section are sampled at once first.
+        The section is split where the sense of rotation of the tangent
+        changes or the tangent turned by more than max_turn; only the
+        intervals whose biarc (or line) is not within the tolerance are
+        bisected.
+        """
+        min_u = 1e-12
+        max_turn = pi / 8
+        u_beg = u_sect[0] + min_u
+        u_end = u_sect[-1] - min_u
+
+        # Sample the section, more densely if it has more knot spans
+        Knots = self.NURBS.Knots
+        spans = len([knot for knot in set(Knots) if u_beg < knot < u_end]) + 1
+        samples = max(8, int(4 * self.segments * (u_end - u_beg) / (Knots[-1] - Knots[0])), 4 * spans)
+        us = [u_beg + (u_end - u_beg) * i / samples for i in range(samples)] + [u_end]
+        Points, tangents = self.NURBS.NURBS_evaluate_batch(n=1, us=us)
+
+        # Split points where the curvature changes
+        splits = [0]
+        turned = 0.0
+        prv_turn = 0.0
+        for i in range(1, samples):
+            turn = (tangents[i + 1] - tangents[i] + pi) % (2 * pi) - pi
+            turned += (tangents[i] - tangents[i - 1] + pi) % (2 * pi) - pi
+            if abs(turned) > max_turn or turn * prv_turn < 0.0:
+                splits.append(i)
+                turned = 0.0
+            # Straight parts do not change the sense of rotation
+            if abs(turn) > 1e-9:
+                prv_turn = turn
+        splits.append(samples)
+
+        BiarcCurve = []
+        PtsVec = [[Points[0], tangents[0]]]
+
+        # Intervals still to fit, the next one is at the end
+        intervals = [(us[splits[i - 1]], [Points[splits[i - 1]], tangents[splits[i - 1]]],
+                      us[splits[i]], [Points[splits[i]], tangents[splits[i]]])
+                     for i in range(len(splits) - 1, 0, -1)]
+
+        # The points the intervals are checked at are evaluated at once
+        check_us = [u for interval in intervals for u in self.get_check_us(interval[0], interval[2])]
+        check_Pts = self.NURBS.NURBS_evaluate_batch(n=0, us=check_us)
+        intervals = [interval + (check_Pts[4 * nr:4 * nr + 4],) for nr, interval in enumerate(intervals)]
+
+        while intervals:
+            u0, PtVec0, u1, PtVec1, check_Pts = intervals.pop()
+            Biarc = BiarcClass(PtsVec[-1][0], PtsVec[-1][1], PtVec1[0], PtVec1[1], nom_tol * 0.5)
+
+            if Biarc.shape == "Zero":
+                continue
+            elif u1 - u0 < min_u or\
+                    self.check_biarc_fitting_tolerance(Biarc, max_tol, u0, u1, check_Pts):
+                BiarcCurve.append(Biarc)
+                PtsVec.append(PtVec1)
+            else:
+                # Bisect the interval, the points both halves are checked
+                # at are evaluated at once
+                u = (u0 + u1) / 2
+                PtVec = list(self.NURBS.NURBS_evaluate(n=1, u=u))
+                check_Pts = self.NURBS.NURBS_evaluate_batch(
+                    n=0, us=self.get_check_us(u0, u) + self.get_check_us(u, u1))
+                intervals.append((u, PtVec, u1, PtVec1, check_Pts[4:]))
+                intervals.append((u0, PtVec0, u, PtVec, check_Pts[:4]))
+
+        return BiarcCurve, PtsVec
+
+    def get_check_us(self, u0, u1):
+        """
+        get_check_us() - The u's the fitting of a biarc from u0 to u1 is
+        checked at
         """
         check_step = (u1 - u0) / 5
-        check_u = []
-        check_Pts = []
+        return [u0 + check_step * i for i in range(1, 5)]
+
+    def check_biarc_fitting_tolerance(self, Biarc, epsilon, u0, u1, check_Pts=None):
+        """
+        check_biarc_fitting_tolerance()
+        @param check_Pts: the points at get_check_us(u0, u1), if they are
+        already evaluated
+        """
         fit_error = []
 
-        for i in range(1, 5):
-            check_u.append(u0 + check_step * i)
-            check_Pts.append(self.NURBS.NURBS_evaluate(n=0, u=check_u[-1]))
-            fit_error.append(Biarc.get_biarc_fitting_error(check_Pts[-1]))
+        if check_Pts is None:
+            check_Pts = [self.NURBS.NURBS_evaluate(n=0, u=u) for u in self.get_check_us(u0, u1)]
+        for check_Pt in check_Pts:
+            fit_error.append(Biarc.get_biarc_fitting_error(check_Pt))
 
         # if debug_on:
         if 0:
@@ -643,6 +735,39 @@ class NURBSClass:
         else:
             return Point
 
+    def NURBS_evaluate_batch(self, n=0, us=()):
+        """
+        Same as NURBS_evaluate for a list of u's. With NumPy all of them are
+        calculated at once.
+        @return: list of Points, for n > 0 also the list of the tangents
+        """
+        if np is None or len(us) < NUMPY_MIN_BATCH:
+            if n > 0:
+                Points = []
+                tangents = []
+                for u in us:
+                    Pt, tangent = self.NURBS_evaluate(n=n, u=u)
+                    Points.append(Pt)
+                    tangents.append(tangent)
+                return Points, tangents
+            else:
+                return [self.NURBS_evaluate(n=0, u=u) for u in us]
+
+        HPts = self.BSpline.bspline_ders_evaluate_batch(n=min(n, 1), us=us)
+
+        # The rest is done per point as in NURBS_evaluate, NumPy's atan2 and
+        # pow may differ in the last bit
+        Points = [self.HPt_2_Pt(HPt) for HPt in HPts[0].tolist()]
+        if n > 0:
+            tangents = []
+            for HPt0, HPt1 in zip(HPts[0].tolist(), HPts[1].tolist()):
+                dPt = [(HPt0[-1] * HPt1[j] - HPt1[-1] * HPt0[j]) / pow(HPt0[-1], 2)
+                       for j in range(len(HPt0) - 1)]
+                tangents.append(atan2(dPt[1], dPt[0]))
+            return Points, tangents
+        else:
+            return Points
+
     def CPts_2_HCPts(self):
         """
         Umwandeln der NURBS Kontrollpunkte und Weight in einen Homogenen Vektor
@@ -678,6 +803,11 @@ class BSplineClass:
             logger.error("is: %s" % self.Knots_len)
             raise ValueError("Knot/Control Point/degree number error.")
 
+        if np is not None:
+            # Knots and control points for bspline_ders_evaluate_batch
+            self.Knots_array = np.array(self.Knots, dtype=float)
+            self.CPts_array = np.array(self.CPts, dtype=float)
+
     def calc_curve(self, n=0, cpts_nr=20):
         """
         Berechnen von eine Anzahl gleichm�ssig verteilter Punkte bis zur n-ten Ableitung
@@ -720,17 +850,72 @@ class BSplineClass:
 
         # logger.debug(du)
 
-        CK = []
-        dPts = []
-        for i in range(self.CPt_len):
-            dPts.append(0.0)
-        for k in range(n + 1):
-            CK.append(dPts[:])
+        CK = [[0.0] * self.CPt_len for k in range(n + 1)]
 
         for k in range(du + 1):
+            CKk = CK[k]
             for j in range(p + 1):
+                dNkj = dN[k][j]
+                CPt = self.CPts[span - p + j]
                 for i in range(self.CPt_len):
-                    CK[k][i] += dN[k][j] * self.CPts[span - p + j][i]
+                    CKk[i] += dNkj * CPt[i]
+
+        return CK
+
+    def bspline_ders_evaluate_batch(self, n=0, us=()):
+        """
+        bspline_ders_evaluate() for an array of u's at once, up to the first
+        derivative. Needs NumPy. The basis functions are calculated as in
+        ders_basis_functions(), with the same operations in the same order.
+        @return: list of the arrays of the points and of their derivatives
+        """
+        us = np.asarray(us, dtype=float)
+        m = len(us)
+        d = self.degree
+        Knots = self.Knots_array
+
+        # Span of each u, the same as findspan() gives
+        spans = np.searchsorted(Knots, us, side='right') - 1
+        spans[us == self.Knots[-1]] = self.Knots_len - d - 2
+        spans = np.clip(spans, d, self.Knots_len - d - 2)
+
+        ndu = np.zeros((d + 1, d + 1, m))
+        ndu[0][0] = 1.0
+        left = [None]
+        right = [None]
+
+        for j in range(1, d + 1):
+            left.append(us - Knots[spans + 1 - j])
+            right.append(Knots[spans + j] - us)
+            saved = 0.0
+            for r in range(j):
+                # Lower Triangle
+                ndu[j][r] = right[r + 1] + left[j - r]
+                temp = ndu[r][j - 1] / ndu[j][r]
+                # Upper Triangle
+                ndu[r][j] = saved + right[r + 1] * temp
+                saved = left[j - r] * temp
+            ndu[j][j] = saved
+
+        ders = [ndu[:, d]]
+
+        # First derivative (Eq. [2.9])
+        if n > 0:
+            ders.append(np.zeros((d + 1, m)))
+            for r in range(d + 1):
+                der = np.zeros(m)
+                if r >= 1:
+                    der = (1.0 / ndu[d][r - 1]) * ndu[r - 1][d - 1]
+                if r <= d - 1:
+                    der = der + (-1.0 / ndu[d][r]) * ndu[r][d - 1]
+                ders[1][r] = der * d
+
+        CK = []
+        for k in range(n + 1):
+            ck = np.zeros((m, self.CPt_len))
+            for j in range(d + 1):
+                ck += ders[k][j][:, None] * self.CPts_array[spans - d + j]
+            CK.append(ck)
 
         return CK
 
@@ -779,27 +964,13 @@ class BSplineClass:
         d = self.degree
 
         # initialisation of the a Matrix
-        a = []
-        zeile = []
-        for j in range(d + 1):
-            zeile.append(0.0)
-        a.append(zeile[:]); a.append(zeile[:])
+        a = [[0.0] * (d + 1) for j in range(2)]
 
         # initialisation of the ndu Matrix
-        ndu = []
-        zeile = []
-        for i in range(d + 1):
-            zeile.append(0.0)
-        for j in range(d + 1):
-            ndu.append(zeile[:])
+        ndu = [[0.0] * (d + 1) for j in range(d + 1)]
 
         # initialisation of the ders Matrix
-        ders = []
-        zeile = []
-        for i in range(d + 1):
-            zeile.append(0.0)
-        for j in range(n + 1):
-            ders.append(zeile[:])
+        ders = [[0.0] * (d + 1) for j in range(n + 1)]
 
         ndu[0][0] = 1.0
         left = [0]
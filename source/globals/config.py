@@ -43,7 +43,7 @@ else:
 
 logger = logging.getLogger("Core.Config")
 
-CONFIG_VERSION = "9.7"
+CONFIG_VERSION = "9.23"
 """
 version tag - increment this each time you edit CONFIG_SPEC
 
@@ -95,6 +95,8 @@ CONFIG_SPEC = str('''
     [General]
     mode3d = boolean(default = False)
     write_to_stdout = boolean(default = False)
+    # processes generating the code of the shapes on export: 1 = no extra processes, 0 = one per CPU. They are forked from the GUI, which is not safe on every platform
+    export_processes = integer(min = 0, default = 1)
     show_disabled_paths = boolean(default = True)
     live_update_export_route = boolean(default = False)
     split_line_segments = boolean(default = False)
@@ -131,14 +133,40 @@ CONFIG_SPEC = str('''
     mutation_rate = float(default = 0.95)
     max_population = integer(default = 20)
     max_iterations = integer(default = 300)
+    # time in seconds to optimise the route of each layer; if larger than 0, it replaces max_iterations
+    max_time = float(min = 0, default = 0)
+    # stop when the route did not get shorter for this many iterations (0: never stop early)
+    max_stall_iterations = integer(min = 0, default = 0)
+    # worker processes optimising the layers in the background: 0 = one per CPU
+    processes = integer(min = 0, default = 0)
     begin_art = option('ordered', 'random', 'heuristic', default = 'heuristic')
+    # distance matrix if NumPy is available: float32 needs half the memory, but the route may differ slightly
+    distance_matrix = option('float64', 'float32', default = 'float64')
+    # route engine: genetic algorithm, or local search (2-opt and Or-opt moves applied to a start tour)
+    route_engine = option('genetic', 'local_search', default = 'genetic')
+    # start tour of the local search
+    local_search_begin = option('nearest_neighbour', 'greedy', default = 'nearest_neighbour')
+    # number of nearest shapes the local search tries as new neighbours of a shape
+    local_search_neighbours = integer(min = 1, default = 10)
 
     [Import_Parameters]
     point_tolerance = float(default = 0.001)
     spline_check = integer(default = 3)
+    # spline fitting: adaptive splits the spline where the curvature changes and evaluates it in batches, stepwise walks along it point by point
+    spline_fitting = option('stepwise', 'adaptive', default = 'adaptive')
     fitting_tolerance = float(default = 0.001)
+    # ellipse fitting: uniform refits the whole ellipse with more arcs, subdivide only splits the arcs out of tolerance
+    ellipse_fitting = option('uniform', 'subdivide', default = 'uniform')
     # insert elements (which are part of a block) to layer where the block is inserted
     insert_at_block_layer = boolean(default = False)
+    # contour search: graph walks the common points iteratively, recursive is the former search
+    contour_search = option('graph', 'recursive', default = 'graph')
+    # processes searching the contours of the blocks: 1 = no extra processes, 0 = one per CPU
+    contour_search_processes = integer(min = 0, default = 1)
+    # maximum number of paths the graph search compares for a contour, 0 = no limit
+    contour_search_max_paths = integer(min = 0, default = 100000)
+    # size of the cache of imported files in MB, 0 disables the cache
+    import_cache_size = integer(min = 0, default = 0)
 
     [Layer_Options]
     id_float_separator = string(default = ":")
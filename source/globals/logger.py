@@ -113,6 +113,30 @@ class LoggerClass(object):
             return level
 
 
+class RecordingHandler(logging.Handler):
+    """
+    Keeps the log records of a worker process, so that they can be logged by
+    the main process with handle_records(), in the order of the results.
+    """
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        self.records.append(record)
+
+
+def handle_records(records):
+    """
+    Log the records kept by the RecordingHandler of a worker process
+    """
+    for record in records:
+        logging.getLogger(record.name).handle(record)
+
+
 class FilterModule(logging.Filter):
     def filter(self, record):
         """A dedicated filter may be added here for debug use
@@ -33,8 +33,10 @@ from __future__ import absolute_import
 from __future__ import division
 
 import logging
+from math import sin, cos
 
 from core.point import Point
+from core.holegeo import HoleGeo
 from core.shape import Shape
 from core.stmove import StMove
 from gui.wpzero import WpZero
@@ -48,11 +50,11 @@ from globals.six import text_type
 import globals.constants as c
 if c.PYQT5notPYQT4:
     from PyQt5.QtWidgets import QGraphicsItem, QGraphicsView, QRubberBand, QGraphicsScene, QGraphicsLineItem
-    from PyQt5.QtGui import QPainterPath, QPen, QColor, QPainterPathStroker
+    from PyQt5.QtGui import QPainterPath, QPen, QColor, QPainterPathStroker, QTransform
     from PyQt5 import QtCore
 else:
     from PyQt4.QtGui import QPainterPath, QGraphicsItem, QPen, QColor, QGraphicsView, QRubberBand,\
-        QGraphicsScene, QPainterPathStroker, QGraphicsLineItem
+        QGraphicsScene, QPainterPathStroker, QGraphicsLineItem, QTransform
     from PyQt4 import QtCore
 
 logger = logging.getLogger("DxfImport.myCanvasClass")
@@ -297,12 +299,26 @@ class MyGraphicsScene(QGraphicsScene):
         used to scale or offset the base geometry (by Menu in GUI).
         """
         for shape in shapes:
+            if shape.stmove is not None:
+                # The shape was kept by a reload, hide the parts of its previous plot
+                shape.stmove.hide()
+                shape.starrow.hide()
+                shape.enarrow.hide()
             self.paint_shape(shape)
             self.addItem(shape)
             self.shapes.append(shape)
         self.draw_wp_zero()
         self.update()
 
+    def releaseShapes(self):
+        """
+        Remove the shapes from the scene, so that they are not deleted
+        together with it. A reload may plot them again in a new scene.
+        """
+        for shape in self.shapes:
+            self.removeItem(shape)
+        self.shapes = []
+
     def repaint_shape(self, shape):
         # setParentItem(None) might let it crash, hence we rely on the garbage collector
         shape.stmove.hide()
@@ -322,12 +338,27 @@ class MyGraphicsScene(QGraphicsScene):
         Create all plotting related parts of one shape.
         @param shape: The shape to be plotted.
         """
-        start, start_ang = shape.get_start_end_points(True, True)
         shape.path = QPainterPath()
-        shape.path.moveTo(start.x, -start.y)
         drawHorLine = lambda caller, start, end: shape.path.lineTo(end.x, -end.y)
         drawVerLine = lambda caller, start: None  # Not used in 2D mode
-        shape.make_path(drawHorLine, drawVerLine)
+
+        transform = self.getEntityTransform(shape.parentEntity)
+        if transform is None or any(isinstance(geo, HoleGeo) for geo in shape.geos):
+            # Mirrored or distorted arcs and the holes, which are drawn with
+            # the tool diameter, are drawn from their absolute geometries
+            start = shape.get_start_end_points(True)
+            shape.path.moveTo(start.x, -start.y)
+            shape.make_path(drawHorLine, drawVerLine)
+        else:
+            # The geometries of the block are drawn and moved to the insert,
+            # so that their absolute geometries are not made
+            start = shape.geos[0].get_start_end_points(True)
+            shape.path.moveTo(start.x, -start.y)
+            shape.make_block_path(drawHorLine)
+            shape.path = transform.map(shape.path)
+            rect = shape.path.boundingRect()
+            shape.topLeft = Point(rect.left(), -rect.top())
+            shape.bottomRight = Point(rect.right(), -rect.bottom())
 
         self.topLeft.detTopLeft(shape.topLeft)
         self.bottomRight.detBottomRight(shape.bottomRight)
@@ -339,6 +370,32 @@ class MyGraphicsScene(QGraphicsScene):
         shape.starrow.setParentItem(shape)
         shape.enarrow.setParentItem(shape)
 
+    def getEntityTransform(self, entity):
+        """
+        The transform of the drawing of geometries in the coordinates of the
+        entity to the scene, as Point.rot_sca_abs transforms the points.
+        @param entity: the parent entity of the geometries
+        @return: the QTransform, None if the entity or its parents mirror or
+        distort the geometries
+        """
+        if not entity.isUniformlyScaled():
+            return None
+
+        transform = QTransform()
+        while entity is not None:
+            m11 = entity.sca[0] * cos(entity.rot)
+            m21 = -entity.sca[0] * sin(entity.rot)
+            m12 = entity.sca[1] * sin(entity.rot)
+            m22 = entity.sca[1] * cos(entity.rot)
+            transform *= QTransform(m11, m12, m21, m22,
+                                    entity.p0.x - m11 * entity.pb.x - m21 * entity.pb.y,
+                                    entity.p0.y - m12 * entity.pb.x - m22 * entity.pb.y)
+            entity = entity.parent
+
+        # The scene has the y axis downwards
+        flip = QTransform(1, 0, 0, -1, 0, 0)
+        return flip * transform * flip
+
     def draw_wp_zero(self):
         """
         This function is called while the drawing of all items is done. It plots
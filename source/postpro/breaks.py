@@ -31,6 +31,7 @@ from core.arcgeo import ArcGeo
 from core.breakgeo import BreakGeo
 from core.point import Point
 from core.shape import Geos
+from core.boxindex import BoxIndex, getBoundingBox
 
 import globals.constants as c
 if c.PYQT5notPYQT4:
@@ -56,7 +57,26 @@ class Breaks(object):
         for layerContent in self.layerContents.break_layer_iter():
             self.breakLayers.append(layerContent)
 
-        logger.debug("Found %d break layers" % len(self.breakLayers))
+        # The break shapes with their lines (only lines break geometries),
+        # in the order they are tried
+        self.breakShapes = []
+        boxes = []
+        for breakLayer in self.breakLayers:
+            for breakShape in breakLayer.shapes.not_disabled_iter():
+                breakGeos = [geo for geo in breakShape.geos.abs_iter() if isinstance(geo, LineGeo)]
+                if breakGeos:
+                    self.breakShapes.append((breakShape, breakGeos))
+                    boxes.append(getBoundingBox([point for geo in breakGeos for point in (geo.Ps, geo.Pe)]))
+        self.breakIndex = BoxIndex(boxes)
+
+        logger.debug("Found %d break layers with %d break shapes" % (len(self.breakLayers), len(self.breakShapes)))
+
+    def getBreakShapes(self, box):
+        """
+        The break shapes which may intersect the given bounding box, in the
+        order they are tried
+        """
+        return [self.breakShapes[nr] for nr in self.breakIndex.query(box)]
 
     def getNewGeos(self, geos):
         # TODO use intersect class and update_start_end_points
@@ -77,16 +97,15 @@ class Breaks(object):
         @return: The list of geometries after breaking (lineGeo itself if no breaking happened)
         """
         newGeos = Geos([])
-        for breakLayer in self.breakLayers:
-            for breakShape in breakLayer.shapes.not_disabled_iter():
-                intersections = self.intersectLineGeometry(lineGeo, breakShape)
-                if len(intersections) == 2:
-                    (near, far) = self.classifyIntersections(lineGeo, intersections)
-                    logger.debug("Line %s broken from (%f, %f) to (%f, %f)" % (lineGeo.to_short_string(), near.x, near.y, far.x, far.y))
-                    newGeos.extend(self.breakLineGeo(LineGeo(lineGeo.Ps, near)))
-                    newGeos.append(BreakGeo(near, far, breakShape.axis3_mill_depth, breakShape.f_g1_plane, breakShape.f_g1_depth))
-                    newGeos.extend(self.breakLineGeo(LineGeo(far, lineGeo.Pe)))
-                    return newGeos
+        for breakShape, breakGeos in self.getBreakShapes(getBoundingBox([lineGeo.Ps, lineGeo.Pe])):
+            intersections = self.intersectLineGeometry(lineGeo, breakGeos)
+            if len(intersections) == 2:
+                (near, far) = self.classifyIntersections(lineGeo, intersections)
+                logger.debug("Line %s broken from (%f, %f) to (%f, %f)" % (lineGeo.to_short_string(), near.x, near.y, far.x, far.y))
+                newGeos.extend(self.breakLineGeo(LineGeo(lineGeo.Ps, near)))
+                newGeos.append(BreakGeo(near, far, breakShape.axis3_mill_depth, breakShape.f_g1_plane, breakShape.f_g1_depth))
+                newGeos.extend(self.breakLineGeo(LineGeo(far, lineGeo.Pe)))
+                return newGeos
         return [lineGeo]
 
     def breakArcGeo(self, arcGeo):
@@ -96,68 +115,65 @@ class Breaks(object):
         @return: The list of geometries after breaking (arcGeo itself if no breaking happened)
         """
         newGeos = Geos([])
-        for breakLayer in self.breakLayers:
-            for breakShape in breakLayer.shapes.not_disabled_iter():
-                intersections = self.intersectArcGeometry(arcGeo, breakShape)
-                if len(intersections) == 2:
-                    (near, far) = self.classifyIntersections(arcGeo, intersections)
-                    logger.debug("Arc %s broken from (%f, %f) to (%f, %f)" % (arcGeo.toShortString(), near.x, near.y, far.x, far.y))
-                    newGeos.extend(self.breakArcGeo(ArcGeo(Ps=arcGeo.Ps, Pe=near, O=arcGeo.O, r=arcGeo.r, s_ang=arcGeo.s_ang, direction=arcGeo.ext)))
-                    newGeos.append(BreakGeo(near, far, breakShape.axis3_mill_depth, breakShape.f_g1_plane, breakShape.f_g1_depth))
-                    newGeos.extend(self.breakArcGeo(ArcGeo(Ps=far, Pe=arcGeo.Pe, O=arcGeo.O, r=arcGeo.r, e_ang=arcGeo.e_ang, direction=arcGeo.ext)))
-                    return newGeos
+        # The bounding box of the full circle
+        circleBox = getBoundingBox([arcGeo.O - Point(arcGeo.r, arcGeo.r), arcGeo.O + Point(arcGeo.r, arcGeo.r)])
+        for breakShape, breakGeos in self.getBreakShapes(circleBox):
+            intersections = self.intersectArcGeometry(arcGeo, breakGeos)
+            if len(intersections) == 2:
+                (near, far) = self.classifyIntersections(arcGeo, intersections)
+                logger.debug("Arc %s broken from (%f, %f) to (%f, %f)" % (arcGeo.toShortString(), near.x, near.y, far.x, far.y))
+                newGeos.extend(self.breakArcGeo(ArcGeo(Ps=arcGeo.Ps, Pe=near, O=arcGeo.O, r=arcGeo.r, s_ang=arcGeo.s_ang, direction=arcGeo.ext)))
+                newGeos.append(BreakGeo(near, far, breakShape.axis3_mill_depth, breakShape.f_g1_plane, breakShape.f_g1_depth))
+                newGeos.extend(self.breakArcGeo(ArcGeo(Ps=far, Pe=arcGeo.Pe, O=arcGeo.O, r=arcGeo.r, e_ang=arcGeo.e_ang, direction=arcGeo.ext)))
+                return newGeos
         return [arcGeo]
 
-    def intersectLineGeometry(self, lineGeo, breakShape):
+    def intersectLineGeometry(self, lineGeo, breakGeos):
         """
-        Try to break lineGeo with the given breakShape. Will return the intersection points of lineGeo with breakShape.
+        Try to break lineGeo with the given lines of a break shape. Will return the intersection points of lineGeo with them.
         """
-        # TODO geos should be abs
         intersections = []
         line = QLineF(lineGeo.Ps.x, lineGeo.Ps.y, lineGeo.Pe.x, lineGeo.Pe.y)
-        for breakGeo in breakShape.geos.abs_iter():
-            if isinstance(breakGeo, LineGeo):
-                breakLine = QLineF(breakGeo.Ps.x, breakGeo.Ps.y, breakGeo.Pe.x, breakGeo.Pe.y)
-                intersection = QPointF(0, 0)  # values do not matter
-                res = line.intersect(breakLine, intersection)
-                if res == QLineF.BoundedIntersection:
-                    intersections.append(Point(intersection.x(), intersection.y()))
+        for breakGeo in breakGeos:
+            breakLine = QLineF(breakGeo.Ps.x, breakGeo.Ps.y, breakGeo.Pe.x, breakGeo.Pe.y)
+            intersection = QPointF(0, 0)  # values do not matter
+            res = line.intersect(breakLine, intersection)
+            if res == QLineF.BoundedIntersection:
+                intersections.append(Point(intersection.x(), intersection.y()))
         return intersections
 
-    def intersectArcGeometry(self, arcGeo, breakShape):
+    def intersectArcGeometry(self, arcGeo, breakGeos):
         """
-        Get the intersections between the finite line and arc.
+        Get the intersections between the arc and the given lines of a break shape.
         Algorithm based on http://vvvv.org/contribution/2d-circle-line-intersections
         """
-        # TODO geos should be abs
         intersections = []
-        for breakGeo in breakShape.geos.abs_iter():
-            if isinstance(breakGeo, LineGeo):
-                dxy = breakGeo.Pe - breakGeo.Ps
-                a = dxy.x**2 + dxy.y**2
-                b = 2 * (dxy.x * (breakGeo.Ps.x - arcGeo.O.x) + dxy.y * (breakGeo.Ps.y - arcGeo.O.y))
-                c = breakGeo.Ps.x**2 + breakGeo.Ps.y**2 + arcGeo.O.x**2 + arcGeo.O.y**2\
-                    - 2 * (arcGeo.O.x * breakGeo.Ps.x + arcGeo.O.y * breakGeo.Ps.y)\
-                    - arcGeo.r**2
-                bb4ac = b * b - 4 * a * c
-
-                if bb4ac > 0:
-                    mu1 = (-b + sqrt(bb4ac)) / (2*a)
-                    mu2 = (-b - sqrt(bb4ac)) / (2*a)
-                    p1 = breakGeo.Ps + mu1 * dxy
-                    p2 = breakGeo.Ps + mu2 * dxy
-
-                    # Points belong to the finite line?
-                    if not\
-                        (p1.x < breakGeo.Ps.x and p2.x < breakGeo.Ps.x and p1.x < breakGeo.Pe.x and p2.x < breakGeo.Pe.x or
-                         p1.y < breakGeo.Ps.y and p2.y < breakGeo.Ps.y and p1.y < breakGeo.Pe.y and p2.y < breakGeo.Pe.y or
-                         p1.x > breakGeo.Ps.x and p2.x > breakGeo.Ps.x and p1.x > breakGeo.Pe.x and p2.x > breakGeo.Pe.x or
-                         p1.y > breakGeo.Ps.y and p2.y > breakGeo.Ps.y and p1.y > breakGeo.Pe.y and p2.y > breakGeo.Pe.y):
-
-                        if arcGeo.O.distance(breakGeo.Ps) >= arcGeo.r and self.point_belongs_to_arc(p2, arcGeo):
-                            intersections.append(p2)
-                        if arcGeo.O.distance(breakGeo.Pe) >= arcGeo.r and self.point_belongs_to_arc(p1, arcGeo):
-                            intersections.append(p1)
+        for breakGeo in breakGeos:
+            dxy = breakGeo.Pe - breakGeo.Ps
+            a = dxy.x**2 + dxy.y**2
+            b = 2 * (dxy.x * (breakGeo.Ps.x - arcGeo.O.x) + dxy.y * (breakGeo.Ps.y - arcGeo.O.y))
+            c = breakGeo.Ps.x**2 + breakGeo.Ps.y**2 + arcGeo.O.x**2 + arcGeo.O.y**2\
+                - 2 * (arcGeo.O.x * breakGeo.Ps.x + arcGeo.O.y * breakGeo.Ps.y)\
+                - arcGeo.r**2
+            bb4ac = b * b - 4 * a * c
+
+            if bb4ac > 0:
+                mu1 = (-b + sqrt(bb4ac)) / (2*a)
+                mu2 = (-b - sqrt(bb4ac)) / (2*a)
+                p1 = breakGeo.Ps + mu1 * dxy
+                p2 = breakGeo.Ps + mu2 * dxy
+
+                # Points belong to the finite line?
+                if not\
+                    (p1.x < breakGeo.Ps.x and p2.x < breakGeo.Ps.x and p1.x < breakGeo.Pe.x and p2.x < breakGeo.Pe.x or
+                     p1.y < breakGeo.Ps.y and p2.y < breakGeo.Ps.y and p1.y < breakGeo.Pe.y and p2.y < breakGeo.Pe.y or
+                     p1.x > breakGeo.Ps.x and p2.x > breakGeo.Ps.x and p1.x > breakGeo.Pe.x and p2.x > breakGeo.Pe.x or
+                     p1.y > breakGeo.Ps.y and p2.y > breakGeo.Ps.y and p1.y > breakGeo.Pe.y and p2.y > breakGeo.Pe.y):
+
+                    if arcGeo.O.distance(breakGeo.Ps) >= arcGeo.r and self.point_belongs_to_arc(p2, arcGeo):
+                        intersections.append(p2)
+                    if arcGeo.O.distance(breakGeo.Pe) >= arcGeo.r and self.point_belongs_to_arc(p1, arcGeo):
+                        intersections.append(p1)
         return intersections
 
     def point_belongs_to_arc(self, point, arcGeo):
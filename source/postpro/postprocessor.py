@@ -25,14 +25,19 @@
 ############################################################################
 
 import os
+import sys
 import time
 import re
 from math import degrees
 import logging
+import multiprocessing
+from multiprocessing import cpu_count
 
 import globals.globals as g
 
 from core.point import Point
+from core.customgcode import CustomGCode
+from globals.logger import RecordingHandler, handle_records
 from postpro.postprocessorconfig import MyPostProConfig
 from postpro.breaks import Breaks
 
@@ -53,6 +58,141 @@ else:
 logger = logging.getLogger("PostPro.PostProcessor")
 
 
+def make_number_formatter(number_format):
+    """
+    Builds the function which returns real values in the format defined in
+    the Number_Format section of a postprocessor file.
+    @param number_format: The Number_Format section of the postprocessor vars
+    @return: The function, which returns the formatted string of a number.
+    """
+    pre_dec = number_format["pre_decimals"]
+    post_dec = number_format["post_decimals"]
+    dec_sep = number_format["decimal_separator"]
+    pre_dec_z_pad = number_format["pre_decimal_zero_padding"]
+    post_dec_z_pad = number_format["post_decimal_zero_padding"]
+    signed_val = number_format["signed_values"]
+
+    # + or - sign if required. Also used for Leading Zeros
+    numfmt = '%'
+    if signed_val:
+        numfmt += '+'
+    if pre_dec_z_pad:
+        numfmt += '0'
+
+    if post_dec == 0:
+        # There are no decimals, and no separator
+        numfmt += str(pre_dec) + '.0f'
+
+        def fnprint(number):
+            return numfmt % number
+        return fnprint
+
+    numfmt += str(pre_dec + post_dec + 1) + '.' + str(post_dec) + 'f'
+
+    # Gives the required decimal format.
+    pre_end = -(post_dec + 1)
+    post_start = -post_dec
+
+    if post_dec_z_pad:
+        def fnprint(number):
+            numstr = numfmt % number
+            return numstr[:pre_end] + dec_sep + numstr[post_start:]
+    else:
+        # Removes the Zero's (and the separator) at the end
+        if len(dec_sep) == 1:
+            strip_chars = '0' + dec_sep
+        else:
+            strip_chars = '0'
+
+        def fnprint(number):
+            numstr = numfmt % number
+            return numstr[:pre_end] + (dec_sep + numstr[post_start:]).rstrip(strip_chars)
+
+    return fnprint
+
+
+class GCodeWriter(object):
+    """
+    Writes the exported code to a file (or stdout) while it is generated and
+    adds the line numbers on the way, if they are used.
+    """
+    def __init__(self, file_, line_numbers, encode=None):
+        """
+        @param file_: the file object to write to
+        @param line_numbers: the Line_Numbers section of the postprocessor vars
+        @param encode: function to apply to the strings before writing them
+        """
+        self.file = file_
+        self.encode = encode
+        self.use_line_nrs = line_numbers["use_line_nrs"]
+        self.line_nr = line_numbers["line_nrs_begin"]
+        self.line_nrs_step = line_numbers["line_nrs_step"]
+        # True if the next string starts a new line, which needs its number
+        self.line_start = True
+        # The first error while writing; the remaining code is dropped then
+        self.error = None
+
+    def write(self, exstr):
+        """
+        Write a piece of the exported code.
+        @param exstr: The string to write, it may contain several lines.
+        """
+        if not exstr:
+            return
+        if self.use_line_nrs:
+            exstr = self.make_line_numbers(exstr)
+        self.write_raw(exstr)
+
+    def finish(self, end=''):
+        """
+        Write the number of the last line (which is empty, if the code ends
+        with a new line) and flush the file.
+        @param end: String to write after the code, it gets no line number.
+        """
+        if self.use_line_nrs and self.line_start:
+            self.write_raw(self.next_line_nr())
+        self.write_raw(end)
+        try:
+            self.file.flush()
+        except IOError as e:
+            self.error = self.error or e
+
+    def make_line_numbers(self, exstr):
+        """
+        Adds the Line Numbers to the lines which start in exstr.
+        @param exstr: The string to add the line numbers to.
+        @return: It returns the string with line numbers added to it.
+        """
+        lines = exstr.split('\n')
+        for nr, line in enumerate(lines):
+            if nr > 0:
+                self.line_start = True
+            # The number of a line at the end is written with the next string
+            if self.line_start and (line or nr < len(lines) - 1):
+                lines[nr] = self.next_line_nr() + line
+                self.line_start = False
+        return '\n'.join(lines)
+
+    def next_line_nr(self):
+        line_nr = 'N%i ' % self.line_nr
+        self.line_nr += self.line_nrs_step
+        return line_nr
+
+    def write_raw(self, exstr):
+        if self.error is not None or not exstr:
+            return
+        if self.encode is not None:
+            exstr = self.encode(exstr)
+        try:
+            self.file.write(exstr)
+        except IOError as e:
+            self.error = e
+
+
+def shape_comment(shape):
+    return "* SHAPE Nr: %i *" % shape.nr
+
+
 class MyPostProcessor(object):
     """
     The PostProcessor Class includes the functions for getting the output
@@ -155,13 +295,94 @@ class MyPostProcessor(object):
         self.breaks = Breaks(LayerContents)
         self.initialize_export_vars()
 
-        exstr = self.write_gcode_be(load_filename)
+        # If the String shall be given to STDOUT
+        if g.config.vars.General['write_to_stdout']:
+            writer = GCodeWriter(sys.stdout, self.vars.Line_Numbers)
+            for exstr in self.export_fragments(load_filename, LayerContents):
+                writer.write(exstr)
+            writer.finish('\n')
+            logger.info(self.tr("Export to STDOUT was successful"))
+            # self.close
+        else:
+            # Export Data to file
+            try:
+                # The code is written to a temporary file, which replaces the
+                # file only when the export succeeded
+                temp_filename = save_filename + '.tmp'
+                f = open(temp_filename, "w")
+                try:
+                    try:
+                        writer = GCodeWriter(f, self.vars.Line_Numbers, str_encode)
+                        for exstr in self.export_fragments(load_filename, LayerContents):
+                            writer.write(exstr)
+                        writer.finish()
+                    finally:
+                        f.close()
+                    if writer.error is not None:
+                        raise writer.error
+                    if os.path.exists(save_filename):
+                        os.remove(save_filename)
+                    os.rename(temp_filename, save_filename)
+                except:
+                    os.remove(temp_filename)
+                    raise
+                logger.info(self.tr("Export to FILE was successful"))
+            except IOError:
+                QMessageBox.warning(g.window,
+                                    self.tr("Warning during Export"),
+                                    self.tr("Cannot Save the File"))
+
+    def export_fragments(self, load_filename, LayerContents):
+        """
+        This function yields the exported code piece by piece, so that it can
+        be written while the shapes are exported.
+        @param load_filename: The name of the loaded dxf file.
+        @param LayerContents: The LayerContents to export, see exportShapes.
+        """
+        yield self.write_gcode_be(load_filename)
 
         # Move Machine to retraction Area before continuing anything.
         # Note: none of the changes done in the GUI can affect this height,
         #       only the config file can do so (intended)
-        exstr += self.rap_pos_z(g.config.vars.Depth_Coordinates['axis3_retract'])
+        yield self.rap_pos_z(g.config.vars.Depth_Coordinates['axis3_retract'])
+
+        processes = g.config.vars.General['export_processes']
+        pool = None
+        if processes != 1:
+            if hasattr(os, 'fork'):
+                pool = ShapeExportPool(self, LayerContents, processes or None)
+            else:
+                logger.info(self.tr("Parallel export needs fork, exporting serially"))
 
+        try:
+            for exstr in self.export_layers(LayerContents, pool):
+                yield exstr
+        finally:
+            if pool is not None:
+                pool.close()
+            # The absolute geometries made for the export and the breaks are
+            # not kept for every insert of a block
+            for LayerContent in LayerContents:
+                for shape in LayerContent.shapes:
+                    if not isinstance(shape, CustomGCode):
+                        shape.geos.clear_abs_geos()
+
+        # Move machine to the Final Position
+        EndPosition = Point(g.config.vars.Plane_Coordinates['axis1_start_end'],
+                            g.config.vars.Plane_Coordinates['axis2_start_end'])
+
+        yield self.rap_pos_xy(EndPosition)
+
+        # Write the end G-Code at the end
+        yield self.write_gcode_en()
+
+    def export_layers(self, LayerContents, pool=None):
+        """
+        This function yields the exported code of the layers and their shapes.
+        @param LayerContents: The LayerContents to export, see exportShapes.
+        @param pool: The ShapeExportPool which generates the code of the
+        shapes in advance, None if the shapes are exported here.
+        """
         previous_tool = None
         # Do the export for each LayerContent in LayerContents List
         for LayerContent in LayerContents.non_break_layer_iter():
@@ -172,49 +393,27 @@ class MyPostProcessor(object):
 
             # Perform export only for Layers which have at least 1 Shape to export
             if len(LayerContent.exp_order_complete):
-                exstr += self.commentprint("*** LAYER: %s ***" % LayerContent.name)
+                yield self.commentprint("*** LAYER: %s ***" % LayerContent.name)
 
                 # If tool has changed for this LayerContent, add it
                 if LayerContent.tool_nr != previous_tool:
-                    exstr += self.chg_tool(LayerContent.tool_nr, LayerContent.speed)
+                    yield self.chg_tool(LayerContent.tool_nr, LayerContent.speed)
                     previous_tool = LayerContent.tool_nr
 
                 for shape_nr in LayerContent.exp_order_complete:
                     shape = LayerContent.shapes[shape_nr]
                     logger.debug(self.tr("Beginning export of Shape Nr: %s") % shape.nr)
 
-                    exstr += self.commentprint("* SHAPE Nr: %i *" % shape.nr)
-
-                    exstr += shape.Write_GCode(self)
-
-        # Move machine to the Final Position
-        EndPosition = Point(g.config.vars.Plane_Coordinates['axis1_start_end'],
-                            g.config.vars.Plane_Coordinates['axis2_start_end'])
-
-        exstr += self.rap_pos_xy(EndPosition)
-
-        # Write the end G-Code at the end
-        exstr += self.write_gcode_en()
-
-        exstr = self.make_line_numbers(exstr)
+                    yield self.commentprint(shape_comment(shape))
 
-        # If the String shall be given to STDOUT
-        if g.config.vars.General['write_to_stdout']:
-            print(exstr)
-            logger.info(self.tr("Export to STDOUT was successful"))
-            # self.close
-        else:
-            # Export Data to file
-            try:
-                # File open and write
-                f = open(save_filename, "w")
-                f.write(str_encode(exstr))
-                f.close()
-                logger.info(self.tr("Export to FILE was successful"))
-            except IOError:
-                QMessageBox.warning(g.window,
-                                    self.tr("Warning during Export"),
-                                    self.tr("Cannot Save the File"))
+                    exstr = None
+                    if pool is not None:
+                        exstr = pool.get_gcode(self)
+                    if exstr is not None:
+                        yield exstr
+                    else:
+                        for exstr in shape.Write_GCode_Fragments(self):
+                            yield exstr
 
     def initialize_export_vars(self):
         """
@@ -247,34 +446,47 @@ class MyPostProcessor(object):
         self.ze = g.config.vars.Depth_Coordinates['axis3_retract']
         self.lz = self.ze
 
-        self.keyvars = {"%feed": 'self.iprint(self.feed)',
-                        "%speed": 'self.iprint(self.speed)',
-                        "%tool_nr": 'self.iprint(self.tool_nr)',
-                        "%nl": 'self.nlprint()',
-                        "%XE": 'self.fnprint(self.Pe.x)',
-                        "%-XE": 'self.fnprint(-self.Pe.x)',
-                        "%XS": 'self.fnprint(self.Ps.x)',
-                        "%-XS": 'self.fnprint(-self.Ps.x)',
-                        "%YE": 'self.fnprint(self.Pe.y*fac)',
-                        "%-YE": 'self.fnprint(-self.Pe.y*fac)',
-                        "%YS": 'self.fnprint(self.Ps.y*fac)',
-                        "%-YS": 'self.fnprint(-self.Ps.y*fac)',
-                        "%ZE": 'self.fnprint(self.ze)',
-                        "%-ZE": 'self.fnprint(-self.ze)',
-                        "%I": 'self.fnprint(self.IJ.x)',
-                        "%-I": 'self.fnprint(-self.IJ.x)',
-                        "%J": 'self.fnprint(self.IJ.y*fac)',
-                        "%-J": 'self.fnprint(-self.IJ.y*fac)',
-                        "%XO": 'self.fnprint(self.O.x)',
-                        "%-XO": 'self.fnprint(-self.O.x)',
-                        "%YO": 'self.fnprint(self.O.y*fac)',
-                        "%-YO": 'self.fnprint(-self.O.y*fac)',
-                        "%R": 'self.fnprint(self.r)',
-                        "%AngS": 'self.fnprint(degrees(self.s_ang))',
-                        "%-AngS": 'self.fnprint(degrees(-self.s_ang))',
-                        "%AngE": 'self.fnprint(degrees(self.e_ang))',
-                        "%-AngE": 'self.fnprint(degrees(-self.e_ang))',
-                        "%comment": 'self.sprint(self.comment)'}
+        if g.config.vars.General['machine_type'] == 'lathe':
+            fac = 2
+        else:
+            fac = 1
+
+        self.number_formatter = make_number_formatter(self.vars.Number_Format)
+        fnprint = self.number_formatter
+
+        self.keyvars = {"%feed": lambda: self.iprint(self.feed),
+                        "%speed": lambda: self.iprint(self.speed),
+                        "%tool_nr": lambda: self.iprint(self.tool_nr),
+                        "%nl": lambda: self.nlprint(),
+                        "%XE": lambda: fnprint(self.Pe.x),
+                        "%-XE": lambda: fnprint(-self.Pe.x),
+                        "%XS": lambda: fnprint(self.Ps.x),
+                        "%-XS": lambda: fnprint(-self.Ps.x),
+                        "%YE": lambda: fnprint(self.Pe.y*fac),
+                        "%-YE": lambda: fnprint(-self.Pe.y*fac),
+                        "%YS": lambda: fnprint(self.Ps.y*fac),
+                        "%-YS": lambda: fnprint(-self.Ps.y*fac),
+                        "%ZE": lambda: fnprint(self.ze),
+                        "%-ZE": lambda: fnprint(-self.ze),
+                        "%I": lambda: fnprint(self.IJ.x),
+                        "%-I": lambda: fnprint(-self.IJ.x),
+                        "%J": lambda: fnprint(self.IJ.y*fac),
+                        "%-J": lambda: fnprint(-self.IJ.y*fac),
+                        "%XO": lambda: fnprint(self.O.x),
+                        "%-XO": lambda: fnprint(-self.O.x),
+                        "%YO": lambda: fnprint(self.O.y*fac),
+                        "%-YO": lambda: fnprint(-self.O.y*fac),
+                        "%R": lambda: fnprint(self.r),
+                        "%AngS": lambda: fnprint(degrees(self.s_ang)),
+                        "%-AngS": lambda: fnprint(degrees(-self.s_ang)),
+                        "%AngE": lambda: fnprint(degrees(self.e_ang)),
+                        "%-AngE": lambda: fnprint(degrees(-self.e_ang)),
+                        "%comment": lambda: self.sprint(self.comment)}
+
+        # Longest keys first, in case a key starts with another one
+        self.keyvars_re = re.compile('|'.join(re.escape(key) for key in
+                                              sorted(self.keyvars, key=len, reverse=True)))
+        self.templates = {}
 
     def write_gcode_be(self, load_filename):
         """
@@ -317,33 +529,6 @@ class MyPostProcessor(object):
         """
         return self.make_print_str(self.vars.General["code_end"])
 
-    def make_line_numbers(self, exstr):
-        """
-        This Method adds Line Numbers to the existing exstr when required for export.
-        @param exstr: This is the string which shall be exported where the line
-        numbers are added.
-        @return: It returns the string with line numbers added to it.
-        """
-        use_line_nrs = self.vars.Line_Numbers["use_line_nrs"]
-        line_nrs_begin = self.vars.Line_Numbers["line_nrs_begin"]
-        line_nrs_step = self.vars.Line_Numbers["line_nrs_step"]
-
-        line_format = 'N%i '
-        if use_line_nrs:
-            nr = 0
-            line_nr = line_nrs_begin
-            exstr = ((line_format + '%s') % (line_nr, exstr))
-            nr = exstr.find('\n', nr)
-            while not nr == -1:
-                line_nr += line_nrs_step
-                exstr = (('%s' + line_format + '%s') % (exstr[0:nr + 1],
-                                                        line_nr,
-                                                        exstr[nr + 1:len(exstr)]))
-
-                nr = exstr.find('\n', nr + len(line_format % line_nr) + 2)
-
-        return exstr
-
     def chg_tool(self, tool_nr, speed):
         """
         This Method is called to change the tool.  It can change the tool or
@@ -507,15 +692,34 @@ class MyPostProcessor(object):
         @return: Returns the string with replaced keyvars (e.g. %Z is replaced
         by the real Z value in the defined Number Format.
         """
-        if g.config.vars.General['machine_type']=='lathe':
-            fac = 2
-        else:
-            fac = 1
-
-        exstr = keystr
-        for key, value in self.keyvars.items():
-            exstr = exstr.replace(key, eval(value))
-        return exstr
+        try:
+            texts, formatters = self.templates[keystr]
+        except KeyError:
+            texts, formatters = self.templates[keystr] = self.compile_template(keystr)
+
+        exstr = [texts[0]]
+        for formatter, text in zip(formatters, texts[1:]):
+            exstr.append(formatter())
+            exstr.append(text)
+        return ''.join(exstr)
+
+    def compile_template(self, keystr):
+        """
+        Splits a string of the Postprocessor Configuration at the keywords, so
+        that make_print_str only needs to format the keywords it contains.
+        @param keystr: String with the keywords
+        @return: Returns the texts between the keywords and the formatters
+        of the keywords. There is one more text than formatters.
+        """
+        texts = []
+        formatters = []
+        pos = 0
+        for match in self.keyvars_re.finditer(keystr):
+            texts.append(keystr[pos:match.start()])
+            formatters.append(self.keyvars[match.group()])
+            pos = match.end()
+        texts.append(keystr[pos:])
+        return texts, formatters
 
     # Function which returns the given value as a formatted integer
     def iprint(self, integer):
@@ -548,40 +752,7 @@ class MyPostProcessor(object):
         @param number: The number which shall be returned in a formatted string
         @return: The formatted string of the number.
         """
-        pre_dec = self.vars.Number_Format["pre_decimals"]
-        post_dec = self.vars.Number_Format["post_decimals"]
-        dec_sep = self.vars.Number_Format["decimal_separator"]
-        pre_dec_z_pad = self.vars.Number_Format["pre_decimal_zero_padding"]
-        post_dec_z_pad = self.vars.Number_Format["post_decimal_zero_padding"]
-        signed_val = self.vars.Number_Format["signed_values"]
-
-        exstr = ''
-
-        # + or - sign if required. Also used for Leading Zeros
-        if signed_val and pre_dec_z_pad:
-            numstr = ('%+0' + str(pre_dec + post_dec + 1) +
-                      '.' + str(post_dec) + 'f') % number
-        elif signed_val == 0 and pre_dec_z_pad:
-            numstr = ('%0' + str(pre_dec + post_dec + 1) +
-                      '.' + str(post_dec) + 'f') % number
-        elif signed_val and pre_dec_z_pad == 0:
-            numstr = ('%+' + str(pre_dec + post_dec + 1) +
-                      '.' + str(post_dec) + 'f') % number
-        elif signed_val == 0 and pre_dec_z_pad == 0:
-            numstr = ('%' + str(pre_dec + post_dec + 1) +
-                      '.' + str(post_dec) + 'f') % number
-
-        # Gives the required decimal format.
-        exstr += numstr[0:-(post_dec + 1)]
-
-        exstr_end = dec_sep
-        exstr_end += numstr[-post_dec:]
-
-        # Add's Zero's to the end if required
-        if not post_dec_z_pad:
-            while len(exstr_end) > 0 and (exstr_end[-1] == '0' or exstr_end[-1] == dec_sep):
-                exstr_end = exstr_end[0:-1]
-        return exstr + exstr_end
+        return self.number_formatter(number)
 
 #    def __str__(self):
 #
@@ -591,3 +762,201 @@ class MyPostProcessor(object):
 #            for option in self.parser.options(section):
 #                str = str + "\n   -> %s=%s" % (option, self.parser.get(section, option))
 #        return str
+
+
+MODAL_VARS = ('feed', 'speed', 'tool_nr', 'comment', 'cut_cor',
+              'Pe', 'Ps', 'lPe', 'IJ', 'O', 'r', 's_ang', 'e_ang', 'ze', 'lz')
+"""
+variables of MyPostProcessor which are kept from one command to the next one,
+and thus from one shape to the next one
+"""
+
+
+def pack_modal_value(value):
+    """
+    Returns a picklable value, which is unpacked by unpack_modal_value
+    """
+    if isinstance(value, Point):
+        return value.x, value.y
+    return value
+
+
+def unpack_modal_value(value):
+    if isinstance(value, tuple):
+        return Point(*value)
+    return value
+
+
+def modal_property(name):
+    """
+    Returns the property of RecordingPostProcessor for the modal variable name
+    """
+    def get_value(self):
+        if name not in self.modal_written:
+            self.modal_read.setdefault(name, self.modal[name])
+        return self.modal[name]
+
+    def set_value(self, value):
+        self.modal_written.add(name)
+        self.modal[name] = value
+
+    return property(get_value, set_value)
+
+
+class RecordingPostProcessor(MyPostProcessor):
+    """
+    The postprocessor of the export worker processes. It records which of the
+    modal variables the code of a shape depends on (the ones which are read
+    before the shape sets them) and which of them the shape sets.
+    """
+    def start_recording(self, state):
+        """
+        Starts the export of a shape
+        @param state: dict with the values of the MODAL_VARS to start with
+        """
+        self.modal = dict(state)
+        self.modal_read = {}
+        self.modal_written = set()
+
+
+for name in MODAL_VARS:
+    setattr(RecordingPostProcessor, name, modal_property(name))
+
+
+# The export job (postprocessor, shapes and their start states and the log
+# handler) of the worker processes. These are forked from the exporting
+# process and so inherit it; shapes can not be pickled. Forking the GUI is
+# not safe on every platform, so the workers are only used if the option
+# export_processes asks for them.
+export_job = None
+
+
+def Write_GCode_Init():
+    postpro = export_job[0]
+    postpro.__class__ = RecordingPostProcessor
+    for name in MODAL_VARS:
+        postpro.__dict__.pop(name, None)
+    logging.getLogger().handlers = [export_job[2]]
+
+
+def Write_GCode_Worker(index):
+    """
+    Generates the code of a shape in a worker process
+    @param index: The number of the shape in the job
+    @return: The code, the modal variables read and set by it (packed) and
+    the log records.
+    """
+    postpro, jobs, handler = export_job
+    shape, state = jobs[index]
+    handler.records = []
+    postpro.start_recording(state)
+
+    exstr = shape.Write_GCode(postpro)
+
+    read = dict((name, pack_modal_value(value))
+                for name, value in postpro.modal_read.items())
+    written = dict((name, pack_modal_value(postpro.modal[name]))
+                   for name in postpro.modal_written)
+    return exstr, read, written, handler.records
+
+
+class ShapeExportPool(object):
+    """
+    Generates the code of the shapes in worker processes while the export
+    runs. Each shape starts from the modal state (feed, last position, ...)
+    the export is expected to have at that point. The code of a shape is only
+    used if it did not read any modal variable which differs from the actual
+    state, otherwise the shape is exported again. So the exported code is
+    the same as without workers.
+
+    The workers are forks of the exporting process. If they can't be
+    started, or a shape fails in them, the shapes are exported serially.
+    """
+    def __init__(self, postpro, LayerContents, processes=None):
+        """
+        @param postpro: The MyPostProcessor which performs the export
+        @param LayerContents: The LayerContents to export
+        @param processes: number of worker processes, None for one per CPU
+        """
+        global export_job
+        jobs = self.make_jobs(postpro, LayerContents)
+        self.pool = None
+        self.results = None
+        if len(jobs) < 2:
+            return
+
+        try:
+            export_job = (postpro, jobs, RecordingHandler())
+            try:
+                context = multiprocessing.get_context('fork')
+            except AttributeError:
+                # Python 2 always forks
+                context = multiprocessing
+            self.pool = context.Pool(processes, Write_GCode_Init)
+            chunksize = max(1, len(jobs) // (4 * (processes or cpu_count())))
+            self.results = self.pool.imap(Write_GCode_Worker, range(len(jobs)), chunksize)
+        except Exception as e:
+            logger.warning(postpro.tr("Parallel export failed (%s), exporting serially") % e)
+            self.close()
+        finally:
+            export_job = None
+
+    def make_jobs(self, postpro, LayerContents):
+        """
+        Lists the shapes in the order of the export (see export_layers), with
+        the modal state expected at their start.
+        """
+        state = dict((name, getattr(postpro, name, None)) for name in MODAL_VARS)
+        jobs = []
+        previous_tool = None
+        for LayerContent in LayerContents.non_break_layer_iter():
+            if len(LayerContent.exp_order_complete):
+                if LayerContent.tool_nr != previous_tool:
+                    state['tool_nr'] = LayerContent.tool_nr
+                    state['speed'] = LayerContent.speed
+                    previous_tool = LayerContent.tool_nr
+
+                for shape_nr in LayerContent.exp_order_complete:
+                    shape = LayerContent.shapes[shape_nr]
+                    state['comment'] = shape_comment(shape)
+                    jobs.append((shape, dict(state)))
+
+                    # Every shape ends with the feed rate of the depth and the
+                    # retraction of its layer
+                    state['feed'] = shape.f_g1_depth
+                    if not postpro.abs_export:
+                        state['lz'] = shape.parentLayer.axis3_retract
+        return jobs
+
+    def get_gcode(self, postpro):
+        """
+        Returns the code of the next shape, if it was generated from the
+        actual modal state of postpro, and sets postpro to the state after
+        the shape.
+        @return: The code or None, if the shape must be exported again.
+        """
+        if self.results is None:
+            return None
+
+        try:
+            exstr, read, written, records = next(self.results)
+        except Exception as e:
+            logger.warning(postpro.tr("Parallel export of a shape failed: %s") % e)
+            return None
+
+        for name, value in read.items():
+            # repr distinguishes e.g. -0.0 and 0.0, which are printed differently
+            if repr(pack_modal_value(getattr(postpro, name, None))) != repr(value):
+                return None
+
+        for name, value in written.items():
+            setattr(postpro, name, unpack_modal_value(value))
+        handle_records(records)
+        return exstr
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+        self.results = None
@@ -29,8 +29,25 @@ from __future__ import division
 
 from random import random, shuffle
 from math import floor, ceil
+from time import time
+from collections import deque
+import heapq
+import multiprocessing
+from multiprocessing import cpu_count
+try:
+    from queue import Empty
+except ImportError:
+    from Queue import Empty
 
 import globals.globals as g
+from core.point import Point
+from globals.logger import RecordingHandler, handle_records
+
+try:
+    import numpy as np
+except ImportError:
+    # Without NumPy the distance matrix is a list of lists
+    np = None
 
 from globals.six import text_type
 import globals.constants as c
@@ -42,29 +59,61 @@ else:
 import logging
 logger = logging.getLogger("PostPro.TSP")
 
+PROGRESS_INTERVAL = 0.1
+"""
+seconds between the calls of the progress function in TspOptimization.optimize
+"""
+
+ROUTE_REPORT_INTERVAL = 0.5
+"""
+minimum seconds between two reports of a better route of a layer by TspPool
+"""
+
 
 class TspOptimization(object):
     """
     Optimization using the Travelling Salesman Problem (TSP) algorithim
     """
-    def __init__(self, st_end_points, order):
+    def __init__(self, st_end_points, order, settings=None):
+        """
+        @param st_end_points: the start and end points of the shapes, the
+        last point is the start and end point of the machine
+        @param order: the shapes with a fixed order
+        @param settings: the Route_Optimisation options, by default those
+        of the config
+        """
+        if settings is None:
+            settings = g.config.vars.Route_Optimisation
         self.shape_nrs = len(st_end_points)
         self.iterations = int(self.shape_nrs) * 10
         self.pop_nr = min(int(ceil(self.shape_nrs / 8.0) * 8.0),
-                          g.config.vars.Route_Optimisation['max_population'])
-        self.mutate_rate = g.config.vars.Route_Optimisation['mutation_rate']
+                          settings['max_population'])
+        self.mutate_rate = settings['mutation_rate']
         self.opt_route = []
         self.order = order
         self.st_end_points = st_end_points
+        self.engine = settings['route_engine']
 
         # Generate the Distance Matrix
         self.DistanceMatrix = DistanceMatrixClass()
-        self.DistanceMatrix.generate_matrix(st_end_points)
+        self.DistanceMatrix.generate_matrix(st_end_points,
+                                            settings['distance_matrix'])
+
+        if self.engine == 'local_search':
+            self.start_length = calc_tour_length(self.DistanceMatrix.matrix,
+                                                 list(range(self.shape_nrs)))
+            self.LocalSearch = LocalSearchClass(self.DistanceMatrix.matrix,
+                                                self.order,
+                                                settings['local_search_neighbours'],
+                                                settings['local_search_begin'])
+            self.opt_route = self.LocalSearch.tour
+            return
 
         # Generation Population
         self.Population = PopulationClass([self.shape_nrs, self.pop_nr],
                                           self.DistanceMatrix.matrix,
-                                          self.mutate_rate)
+                                          self.mutate_rate,
+                                          settings['begin_art'])
 
         # Initialise the Result Class
         self.Fittness = FittnessClass(self.Population,
@@ -96,6 +145,13 @@ class TspOptimization(object):
         """
         calc_next_iteration()
         """
+        if self.engine == 'local_search':
+            # The local search stops at the first call, when no move
+            # improves the route any more
+            self.LocalSearch.improve()
+            self.opt_route = self.LocalSearch.tour
+            return
+
         # Algorithmus ausfürhen
         self.Population.genetic_algorithm(self.Fittness, self.mutate_rate)
         # Für die Anzahl der Tours die Tours nach dem 2-opt Verfahren optimieren
@@ -120,19 +176,103 @@ class TspOptimization(object):
         self.opt_route = self.Population.pop[self.Fittness.best_route]
         # logger.debug('Calculation next iteration of TSP: %s' %self)
 
+    def optimize(self, max_iterations, max_time=0, max_stall=0, progress=None):
+        """
+        optimize() - Calculate iterations until max_iterations are done, or
+        if max_time is given, until max_time seconds passed. The iterations
+        per second and the improvements of the route are logged.
+        @param max_iterations: the number of iterations if there is no max_time
+        @param max_time: the time in seconds to spend, 0 for no limit
+        @param max_stall: stop if the route did not get shorter for this many
+        iterations, 0 to never stop for this reason
+        @param progress: function called every PROGRESS_INTERVAL seconds,
+        e.g. to keep the GUI responsive. If it returns True, the optimisation
+        is cancelled.
+        @return: the number of iterations done
+        """
+        start_time = time()
+        progress_time = None
+        best_length = self.get_lengths()[1]
+        best_route = list(self.opt_route)
+        # Iteration, time and length of each improvement
+        curve = [(0, 0.0, best_length)]
+        it_nr = 0
+        stall_nr = 0
+
+        while not self.is_converged():
+            now = time()
+            if max_time > 0:
+                if now - start_time >= max_time:
+                    break
+            elif it_nr >= max_iterations:
+                break
+            if max_stall > 0 and stall_nr >= max_stall:
+                break
+            if progress is not None and (progress_time is None or
+                                         now - progress_time >= PROGRESS_INTERVAL):
+                progress_time = now
+                if progress():
+                    logger.info("TSP cancelled")
+                    break
+
+            self.calc_next_iteration()
+            it_nr += 1
+            length = self.get_lengths()[1]
+            if length < best_length:
+                best_length = length
+                best_route = list(self.opt_route)
+                stall_nr = 0
+                curve.append((it_nr, time() - start_time, length))
+            else:
+                stall_nr += 1
+
+        if self.get_lengths()[1] > best_length:
+            # The genetic algorithm may lose the best route again
+            self.opt_route = best_route
+            self.Fittness.best_fittness.append(best_length)
+
+        duration = time() - start_time
+        logger.info("TSP: %i iterations in %0.2f s (%0.1f iterations/s)"
+                    % (it_nr, duration, it_nr / duration if duration > 0 else 0.0))
+        logger.debug("TSP improvements (iteration, time, length): %s"
+                     % ", ".join("(%i, %0.2f s, %0.1f)" % point for point in curve))
+        return it_nr
+
+    def is_converged(self):
+        """
+        is_converged() - True if further iterations won't change the route
+        """
+        return self.engine == 'local_search' and not self.LocalSearch.queue
+
+    def get_lengths(self):
+        """
+        get_lengths() - The length of the route in the original order and of
+        the optimised route
+        @return: tuple (start length, opt. length)
+        """
+        if self.engine == 'local_search':
+            return self.start_length, self.LocalSearch.length
+        return self.Fittness.best_fittness[0], self.Fittness.best_fittness[-1]
+
     def __str__(self):
         #res = self.Population.pop
-        return "Iteration nrs:    %i" % (self.iterations * 10) +\
-               "\nShape nrs:      %i" % self.shape_nrs +\
-               "\nPopulation:     %i" % self.pop_nr +\
-               "\nMutate rate:    %0.2f" % self.mutate_rate +\
+        start_length, opt_length = self.get_lengths()
+        if self.engine == 'local_search':
+            engine_str = "Engine:         local search (%s)" % self.LocalSearch +\
+                         "\nShape nrs:      %i" % self.shape_nrs
+        else:
+            engine_str = "Iteration nrs:    %i" % (self.iterations * 10) +\
+                         "\nShape nrs:      %i" % self.shape_nrs +\
+                         "\nPopulation:     %i" % self.pop_nr +\
+                         "\nMutate rate:    %0.2f" % self.mutate_rate
+        return engine_str +\
                "\norder:          %s" % self.order +\
-               "\nStart length:   %0.1f" % self.Fittness.best_fittness[0] +\
-               "\nOpt. length:    %0.1f" % self.Fittness.best_fittness[-1] +\
+               "\nStart length:   %0.1f" % start_length +\
+               "\nOpt. length:    %0.1f" % opt_length +\
                "\nOpt. route:     %s" % self.opt_route
 
 class PopulationClass:
-    def __init__(self, size, dmatrix, mutate_rate):
+    def __init__(self, size, dmatrix, mutate_rate, begin_art):
         self.size = size
         self.mutate_rate = mutate_rate
         self.pop = []
@@ -143,11 +283,11 @@ class PopulationClass:
         for pop_nr in range(self.size[1]):
             # logger.debug("======= TSP initializing population nr %i =======" % pop_nr)
 
-            if g.config.vars.Route_Optimisation['begin_art'] == 'ordered':
+            if begin_art == 'ordered':
                 self.pop.append(list(range(size[0])))
-            elif g.config.vars.Route_Optimisation['begin_art'] == 'random':
+            elif begin_art == 'random':
                 self.pop.append(self.random_begin(size[0]))
-            elif g.config.vars.Route_Optimisation['begin_art'] == 'heuristic':
+            elif begin_art == 'heuristic':
                 self.pop.append(self.heuristic_begin(dmatrix[:]))
             else:
                 logger.error(self.tr('Wrong begin art of TSP chosen'))
@@ -191,6 +331,9 @@ class PopulationClass:
         # Hinzufügen der Nr und entfernen aus possibilies
         # Add and remove the number of possibilities
         tour.append(start_nr)
+        if np is not None and isinstance(dmatrix, np.ndarray):
+            return self.heuristic_continue_array(tour, dmatrix)
+
         possibilities.pop(possibilities.index(tour[-1]))
         counter = 0
 
@@ -203,6 +346,20 @@ class PopulationClass:
             #     logger.debug("TSP heuristic searching nr %i" % counter)
         return tour
 
+    def heuristic_continue_array(self, tour, dmatrix):
+        """
+        Same as heuristic_begin for a distance matrix which is a NumPy array
+        """
+        possible = np.ones(len(dmatrix), dtype=bool)
+        possible[tour[-1]] = False
+        for counter in range(len(dmatrix) - 1):
+            # argmin returns the first of equally distant points, as
+            # heuristic_find_next does
+            darray = np.where(possible, dmatrix[tour[-1]], np.inf)
+            tour.append(int(darray.argmin()))
+            possible[tour[-1]] = False
+        return tour
+
     def heuristic_find_next(self, start, possibilities, dmatrix):
         """
         heuristic_find_next() for TSP
@@ -331,11 +488,37 @@ class DistanceMatrixClass:
                 string += "%8.2f" % x_vals
         return string
 
-    def generate_matrix(self, st_end_points):
-        self.matrix = [[st_end_y[1].distance(st_end_x[0]) for st_end_x in st_end_points]
-                       for st_end_y in st_end_points]
+    def generate_matrix(self, st_end_points, dtype='float64'):
+        """
+        Calculates the distances from the end of each shape to the start of
+        each shape.
+        @param st_end_points: start and end point of each shape
+        @param dtype: 'float64' or 'float32' (half the memory, less exact)
+        for the array used if NumPy is available.
+        """
+        if np is None:
+            self.matrix = [[st_end_y[1].distance(st_end_x[0]) for st_end_x in st_end_points]
+                           for st_end_y in st_end_points]
+        else:
+            self.matrix = self.generate_array(st_end_points, dtype)
         self.size = [len(st_end_points), len(st_end_points)]
 
+    def generate_array(self, st_end_points, dtype='float64'):
+        """
+        Same as the matrix of generate_matrix as NumPy array, calculated at
+        once by broadcasting the end points against the start points. The
+        distances are calculated like Point.distance, so that they are equal
+        to the last bit.
+        """
+        starts_x = np.array([st_end[0].x for st_end in st_end_points], dtype=np.float64)
+        starts_y = np.array([st_end[0].y for st_end in st_end_points], dtype=np.float64)
+        ends_x = np.array([st_end[1].x for st_end in st_end_points], dtype=np.float64)
+        ends_y = np.array([st_end[1].y for st_end in st_end_points], dtype=np.float64)
+
+        dx = ends_x[:, None] - starts_x
+        dy = ends_y[:, None] - starts_y
+        return np.sqrt(dx * dx + dy * dy).astype(dtype, copy=False)
+
 class FittnessClass:
     def __init__(self, population, cur_fittness, order):
         self.population = population
@@ -349,6 +532,10 @@ class FittnessClass:
                % (self.best_fittness[-1], self.best_route, self.population.pop[self.best_route])
 
     def calc_st_fittness(self, matrix, st_pop):
+        if np is not None and isinstance(matrix, np.ndarray):
+            self.best_fittness.append(self.calc_tour_lengths(matrix, [list(st_pop)])[0])
+            return
+
         dis = matrix[st_pop[-1]][st_pop[0]]
         for nr in range(1, len(st_pop)):
             dis += matrix[st_pop[nr - 1]][st_pop[nr]]
@@ -360,6 +547,10 @@ class FittnessClass:
         #              % len(self.population.pop))
         # logger.debug("Length of self.cur_fittness: %s" %(len(self.cur_fittness)))
 
+        if np is not None and isinstance(matrix, np.ndarray):
+            self.cur_fittness[:] = self.calc_tour_lengths(matrix, self.population.pop)
+            return
+
         for pop_nr in range(len(self.population.pop)):
             pop = self.population.pop[pop_nr]
             # logger.debug("pop_nr: %s" %pop_nr)
@@ -368,6 +559,22 @@ class FittnessClass:
                 dis += matrix[pop[nr - 1]][pop[nr]]
             self.cur_fittness[pop_nr] = dis
 
+    def calc_tour_lengths(self, matrix, pops):
+        """
+        Calculates the lengths of all tours at once, for a distance matrix
+        which is a NumPy array. The distances are added up in the same order
+        as calc_cur_fittness does, so that the lengths are equal.
+        @param matrix: the distance matrix
+        @param pops: the tours
+        @return: list with the length of each tour
+        """
+        pops = np.array(pops)
+        dis = np.empty(pops.shape, dtype=np.float64)
+        dis[:, 0] = matrix[pops[:, -1], pops[:, 0]]
+        dis[:, 1:] = matrix[pops[:, :-1], pops[:, 1:]]
+        # accumulate adds from left to right (unlike sum)
+        return np.add.accumulate(dis, axis=1)[:, -1].tolist()
+
     # 2te Möglichkeit die Reihenfolge festzulegen (Korrekturfunktion=Aktiv)
     # Second option set the order (correction function = Active)
     def correct_constrain_order(self):
@@ -376,14 +583,7 @@ class FittnessClass:
         an additional option in the config file?"""
 
         for pop in self.population.pop:
-            # Search the current order
-            order_index = self.get_pop_index_list(pop)
-            # Momentane Reihenfolge der indexe sortieren
-            # Current sort order of the index ???
-            order_index.sort()
-            # Indices according to correct order
-            for ind_nr in range(len(order_index)):
-                pop[order_index[ind_nr]] = self.order[ind_nr]
+            correct_constrain_order(pop, self.order)
 
     def set_startpoint(self):
         n_pts = len(self.population.pop[-1])
@@ -392,9 +592,558 @@ class FittnessClass:
             # Contour with the starting point at the beginning
             pop[:] = pop[st_pt_nr:n_pts] + pop[0:st_pt_nr]
 
-    def get_pop_index_list(self, pop):
-        return [pop.index(order) for order in self.order]
-
     def select_best_fittness(self):
         self.best_fittness.append(min(self.cur_fittness))
         self.best_route = self.cur_fittness.index(self.best_fittness[-1])
+
+
+def correct_constrain_order(tour, order):
+    """
+    correct_constrain_order() - Put the shapes with a fixed order into this
+    order. They are placed at the positions the fixed shapes have in the tour.
+    @param tour: the tour, which is changed
+    @param order: the shapes with a fixed order
+    """
+    # Search the current order
+    order_index = [tour.index(order_nr) for order_nr in order]
+    # Current sort order of the index
+    order_index.sort()
+    # Indices according to correct order
+    for ind_nr in range(len(order_index)):
+        tour[order_index[ind_nr]] = order[ind_nr]
+
+
+def calc_tour_length(matrix, tour):
+    """
+    calc_tour_length() - The length of a closed tour, added up like
+    FittnessClass.calc_cur_fittness does
+    """
+    dis = matrix[tour[-1]][tour[0]]
+    for nr in range(1, len(tour)):
+        dis += matrix[tour[nr - 1]][tour[nr]]
+    return float(dis)
+
+
+class LocalSearchClass(object):
+    """
+    Route optimisation by local search. A start tour is built with the
+    nearest neighbour or the greedy heuristic and then improved with 2-opt
+    moves (reversing a part of the tour) and Or-opt moves (moving up to
+    three consecutive shapes to another place) until no move shortens it
+    any more.
+
+    Only the nearest shapes of a shape (its candidate list) are tried as
+    its new neighbours, and a shape is only searched again when one of its
+    neighbours in the tour changed (don't look bits).
+
+    The tour always starts with the last point (start and end point of the
+    machine), and the shapes with a fixed order keep their order, as with
+    FittnessClass.correct_constrain_order.
+    """
+    # Moves must shorten the tour by more than this, so that rounding
+    # errors can't make the search go round in circles
+    EPSILON = 1e-6
+    # Longest sequence of shapes an Or-opt move moves
+    OR_OPT_LENGTH = 3
+
+    def __init__(self, dmatrix, order, neighbours, begin='nearest_neighbour'):
+        """
+        @param dmatrix: the distance matrix
+        @param order: the shapes with a fixed order
+        @param neighbours: the length of the candidate lists
+        @param begin: 'nearest_neighbour' or 'greedy' start tour
+        """
+        self.size = len(dmatrix)
+        self.depot = self.size - 1
+        self.order = order
+        self.dmatrix = dmatrix
+        self.moves = [0, 0]
+        self.is_array = np is not None and isinstance(dmatrix, np.ndarray)
+        if self.is_array:
+            self.dist = dmatrix.item
+        else:
+            self.dist = lambda start, end: dmatrix[start][end]
+
+        self.fixed = [False] * self.size
+        for shape_nr in order:
+            self.fixed[shape_nr] = True
+
+        self.neighbours = self.make_neighbour_lists(min(neighbours, self.size - 1))
+
+        if begin == 'greedy':
+            tour = self.greedy_begin()
+        else:
+            tour = self.nearest_neighbour_begin()
+        correct_constrain_order(tour, order)
+
+        self.tour = tour
+        self.pos = [0] * self.size
+        # Lengths of the tour up to each position, forwards and backwards,
+        # and the number of fixed shapes before each position
+        self.forward = [0.0] * self.size
+        self.backward = [0.0] * self.size
+        self.fixed_before = [0] * (self.size + 1)
+        self.update(0)
+
+        self.length = calc_tour_length(dmatrix, tour)
+        self.begin_length = self.length
+        logger.debug("TSP local search %s start tour length: %0.1f" % (begin, self.length))
+
+        # All shapes are searched at first
+        self.queue = deque(tour)
+        self.queued = [True] * self.size
+
+    def __str__(self):
+        return "start tour %0.1f, %i 2-opt and %i Or-opt moves"\
+               % (self.begin_length, self.moves[0], self.moves[1])
+
+    def make_neighbour_lists(self, count):
+        """
+        make_neighbour_lists() - The nearest shapes of each shape, nearest
+        first
+        @param count: the number of shapes in each list
+        """
+        if count < 1:
+            return [[] for nr in range(self.size)]
+
+        if not self.is_array:
+            return [heapq.nsmallest(count, [nr2 for nr2 in range(self.size) if nr2 != nr],
+                                    key=self.dmatrix[nr].__getitem__)
+                    for nr in range(self.size)]
+
+        neighbours = []
+        for nr in range(self.size):
+            row = np.array(self.dmatrix[nr], dtype=np.float64)
+            row[nr] = np.inf
+            nearest = np.argpartition(row, count - 1)[:count]
+            nearest = nearest[np.argsort(row[nearest], kind='mergesort')]
+            neighbours.append(nearest.tolist())
+        return neighbours
+
+    def nearest_neighbour_begin(self):
+        """
+        nearest_neighbour_begin() - Start tour, beginning at the start point
+        and always going to the nearest shape left
+        """
+        tour = [self.depot]
+        visited = [False] * self.size
+        visited[self.depot] = True
+        for counter in range(self.size - 1):
+            current = tour[-1]
+            # The first shape left in the candidate list is the nearest one
+            for next_nr in self.neighbours[current]:
+                if not visited[next_nr]:
+                    break
+            else:
+                next_nr = min([nr for nr in range(self.size) if not visited[nr]],
+                              key=lambda nr: self.dist(current, nr))
+            visited[next_nr] = True
+            tour.append(next_nr)
+        return tour
+
+    def greedy_begin(self):
+        """
+        greedy_begin() - Start tour of the shortest connections. The
+        connections of the candidate lists are added shortest first, if they
+        don't close a loop. The resulting paths are joined, always
+        continuing with the nearest one.
+        """
+        edges = sorted((self.dist(start, end), start, end)
+                       for start in range(self.size)
+                       for end in self.neighbours[start])
+
+        succ = [None] * self.size
+        pred = [None] * self.size
+        # Union find of the paths
+        path = list(range(self.size))
+
+        def find_path(nr):
+            while path[nr] != nr:
+                path[nr] = path[path[nr]]
+                nr = path[nr]
+            return nr
+
+        for dist, start, end in edges:
+            if succ[start] is None and pred[end] is None:
+                start_path = find_path(start)
+                end_path = find_path(end)
+                if start_path != end_path:
+                    succ[start] = end
+                    pred[end] = start
+                    path[start_path] = end_path
+
+        heads = [nr for nr in range(self.size) if pred[nr] is None]
+        head = self.depot
+        while pred[head] is not None:
+            head = pred[head]
+        heads.remove(head)
+
+        tour = []
+        while True:
+            nr = head
+            while nr is not None:
+                tour.append(nr)
+                nr = succ[nr]
+            if not heads:
+                break
+            head = min(heads, key=lambda nr: self.dist(tour[-1], nr))
+            heads.remove(head)
+
+        depot_nr = tour.index(self.depot)
+        return tour[depot_nr:] + tour[:depot_nr]
+
+    def update(self, first):
+        """
+        update() - Recalculate the positions and lengths after the tour
+        changed from position first on
+        """
+        tour = self.tour
+        dist = self.dist
+        for pos_nr in range(first, self.size):
+            self.pos[tour[pos_nr]] = pos_nr
+            self.fixed_before[pos_nr + 1] = self.fixed_before[pos_nr] + self.fixed[tour[pos_nr]]
+        for pos_nr in range(max(first, 1), self.size):
+            self.forward[pos_nr] = self.forward[pos_nr - 1] + dist(tour[pos_nr - 1], tour[pos_nr])
+            self.backward[pos_nr] = self.backward[pos_nr - 1] + dist(tour[pos_nr], tour[pos_nr - 1])
+
+    def push(self, shape_nr):
+        if not self.queued[shape_nr]:
+            self.queued[shape_nr] = True
+            self.queue.append(shape_nr)
+
+    def improve(self):
+        """
+        improve() - Apply improving moves until there are none left
+        """
+        while self.queue:
+            shape_nr = self.queue.popleft()
+            self.queued[shape_nr] = False
+            changed = self.improve_2opt(shape_nr)
+            if changed is None:
+                changed = self.improve_or_opt(shape_nr)
+            if changed is not None:
+                for changed_nr in changed:
+                    self.push(changed_nr)
+
+        self.length = calc_tour_length(self.dmatrix, self.tour)
+
+    def improve_2opt(self, shape_nr):
+        """
+        improve_2opt() - Search a 2-opt move which connects the shape to one
+        of its candidates and apply it
+        @return: the shapes whose neighbours changed, None if there was no
+        improving move
+        """
+        tour = self.tour
+        dist = self.dist
+        size = self.size
+        pos_nr = self.pos[shape_nr]
+
+        for cand_nr in self.neighbours[shape_nr]:
+            cand_pos = self.pos[cand_nr]
+            # Reverse the part between the shape and the candidate, so that
+            # the connection after or before the shape is replaced
+            if cand_pos > pos_nr:
+                reversals = ((pos_nr + 1, cand_pos), (pos_nr, cand_pos - 1))
+            else:
+                reversals = ((cand_pos + 1, pos_nr), (cand_pos, pos_nr - 1))
+
+            for first, last in reversals:
+                # The start point stays in front, and the reversed part may
+                # contain one fixed shape at most
+                if first < 1 or first >= last or\
+                        self.fixed_before[last + 1] - self.fixed_before[first] > 1:
+                    continue
+
+                before = tour[first - 1]
+                after = tour[(last + 1) % size]
+                delta = dist(before, tour[last]) + dist(tour[first], after) -\
+                    dist(before, tour[first]) - dist(tour[last], after) +\
+                    self.backward[last] - self.backward[first] -\
+                    self.forward[last] + self.forward[first]
+                if delta < -self.EPSILON:
+                    changed = [before, tour[first], tour[last], after]
+                    tour[first:last + 1] = tour[last:first - 1:-1]
+                    self.update(first)
+                    self.moves[0] += 1
+                    return changed
+        return None
+
+    def improve_or_opt(self, shape_nr):
+        """
+        improve_or_opt() - Search an Or-opt move of the shapes beginning with
+        the shape to a place next to a candidate, in the same or in reversed
+        direction, and apply it
+        @return: the shapes whose neighbours changed, None if there was no
+        improving move
+        """
+        tour = self.tour
+        dist = self.dist
+        size = self.size
+        first = self.pos[shape_nr]
+        if first == 0:
+            return None
+
+        for seg_len in range(1, min(self.OR_OPT_LENGTH, size - first) + 1):
+            end = first + seg_len
+            prev = tour[first - 1]
+            next_ = tour[end % size]
+            seg_first = tour[first]
+            seg_last = tour[end - 1]
+            remove_gain = dist(prev, seg_first) + dist(seg_last, next_) - dist(prev, next_)
+            seg_fixed = self.fixed_before[end] - self.fixed_before[first]
+            reverse_cost = self.backward[end - 1] - self.backward[first] -\
+                self.forward[end - 1] + self.forward[first]
+
+            # Places next to the candidates of the first and the last shape
+            places = set()
+            for cand_nr in self.neighbours[seg_first] + self.neighbours[seg_last]:
+                places.add(self.pos[cand_nr] or size)
+                places.add(self.pos[cand_nr] + 1)
+
+            for place in sorted(places):
+                if first <= place <= end:
+                    continue
+                if seg_fixed:
+                    if place > end:
+                        passed = self.fixed_before[place] - self.fixed_before[end]
+                    else:
+                        passed = self.fixed_before[first] - self.fixed_before[place]
+                    if passed:
+                        continue
+
+                before = tour[place - 1]
+                after = tour[place % size]
+                delta = dist(before, seg_first) + dist(seg_last, after) -\
+                    dist(before, after) - remove_gain
+                reverse = False
+                if seg_len > 1 and seg_fixed < 2:
+                    reverse_delta = dist(before, seg_last) + dist(seg_first, after) -\
+                        dist(before, after) - remove_gain + reverse_cost
+                    if reverse_delta < delta:
+                        delta = reverse_delta
+                        reverse = True
+
+                if delta < -self.EPSILON:
+                    segment = tour[first:end]
+                    if reverse:
+                        segment.reverse()
+                    if place > end:
+                        tour[first:place] = tour[end:place] + segment
+                        self.update(first)
+                    else:
+                        tour[place:end] = segment + tour[place:first]
+                        self.update(place)
+                    self.moves[1] += 1
+                    return [prev, next_, seg_first, seg_last, before, after]
+        return None
+
+
+def optimize_layer(job, report=None, cancelled=None):
+    """
+    optimize_layer() - Optimise the route of a layer
+    @param job: tuple of the start and end points of the shapes as
+    coordinate tuples ((x, y), (x, y)), the last ones are those of the
+    machine, the fixed order, the max. number of iterations and the
+    Route_Optimisation options. It can be pickled for a worker process.
+    @param report: function called with a better route and its length, at
+    most every ROUTE_REPORT_INTERVAL seconds
+    @param cancelled: function returning True to stop the optimisation
+    @return: the TspOptimization
+    """
+    coordinates, order, max_iterations, settings = job
+    st_end_points = [[Point(*start), Point(*end)] for start, end in coordinates]
+    TSPs = TspOptimization(st_end_points, order, settings)
+    last_report = [time(), TSPs.get_lengths()[1]]
+
+    def progress():
+        length = TSPs.get_lengths()[1]
+        now = time()
+        if report is not None and length < last_report[1] and\
+                now - last_report[0] >= ROUTE_REPORT_INTERVAL:
+            last_report[:] = [now, length]
+            report(list(TSPs.opt_route), length)
+        return cancelled is not None and cancelled()
+
+    TSPs.optimize(max_iterations,
+                  settings['max_time'],
+                  settings['max_stall_iterations'],
+                  progress)
+    logger.debug("TSP done with result: %s" % TSPs)
+    return TSPs
+
+
+# The queue for the better routes, the event to cancel and the log handler
+# of a worker process, set by optimize_layer_init()
+tsp_worker = None
+
+
+def optimize_layer_init(queue, cancel_event):
+    global tsp_worker
+    handler = RecordingHandler()
+    root_logger = logging.getLogger()
+    root_logger.handlers = [handler]
+    root_logger.setLevel(logging.DEBUG)
+    tsp_worker = (queue, cancel_event, handler)
+
+
+def optimize_layer_worker(index, job):
+    """
+    Optimises the route of a layer in a worker process
+    @param index: The number of the layer
+    @param job: The job of the layer, see optimize_layer()
+    @return: The number of the layer, the route, the lengths before and
+    after and the log records.
+    """
+    queue, cancel_event, handler = tsp_worker
+    handler.records = []
+
+    TSPs = optimize_layer(job,
+                          lambda route, length: queue.put((index, route, length)),
+                          cancel_event.is_set)
+    return index, list(TSPs.opt_route), TSPs.get_lengths(), handler.records
+
+
+class TspPool(QtCore.QObject):
+    """
+    Optimises the routes of the layers in the background. Each layer is a
+    task of a pool of worker processes, so independent layers are optimised
+    in parallel. The workers are new processes (spawned), not forks of the
+    GUI, so the jobs only contain coordinates and options. A timer in the
+    GUI thread collects the better routes and the results.
+
+    If the workers can't be started, the layers are optimised one after
+    another in the foreground, processing the GUI events in between.
+    """
+    # Number of the layer, a better route and its length
+    routeFound = QtCore.pyqtSignal(int, object, float)
+    # Number of the layer, its route and the lengths before and after
+    layerFinished = QtCore.pyqtSignal(int, object, object)
+    finished = QtCore.pyqtSignal()
+
+    def __init__(self, jobs, processes=0):
+        """
+        @param jobs: list of the jobs of the layers, see optimize_layer()
+        @param processes: number of worker processes, 0 for one per CPU
+        """
+        QtCore.QObject.__init__(self)
+        self.jobs = jobs
+        self.processes = processes
+        self.pool = None
+        self.results = []
+        self.done = set()
+        self.cancelled = False
+        self.closed = False
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.timeout.connect(self.collect)
+
+    def tr(self, string_to_translate):
+        """
+        Translate a string using the QCoreApplication translation framework
+        @param: string_to_translate: a unicode string
+        @return: the translated unicode string if it was possible to translate
+        """
+        return text_type(QtCore.QCoreApplication.translate("TspPool",
+                                                           string_to_translate))
+
+    def start(self):
+        """
+        start() - Start the optimisation. The signals are emitted until
+        finished, or until the pool is closed.
+        """
+        if self.jobs:
+            try:
+                # Python 2 has no spawn context, and forking the GUI is not
+                # safe on every platform
+                context = multiprocessing.get_context('spawn')
+                self.queue = context.Queue()
+                self.cancel_event = context.Event()
+                processes = min(self.processes or cpu_count(), len(self.jobs))
+                self.pool = context.Pool(processes, optimize_layer_init,
+                                         (self.queue, self.cancel_event))
+                self.results = [self.pool.apply_async(optimize_layer_worker, (index, job))
+                                for index, job in enumerate(self.jobs)]
+            except Exception as e:
+                logger.warning(self.tr("Route optimisation in the background failed (%s), "
+                                       "optimising in the foreground") % e)
+                self.close_pool()
+
+        if self.pool is not None:
+            self.timer.start(int(PROGRESS_INTERVAL * 1000))
+        else:
+            self.run()
+
+    def run(self):
+        """
+        run() - Optimise the layers one after another in the foreground, if
+        the worker processes can't be started
+        """
+        def cancelled():
+            QtCore.QCoreApplication.processEvents()
+            return self.cancelled
+
+        for index, job in enumerate(self.jobs):
+            TSPs = optimize_layer(job,
+                                  lambda route, length: self.routeFound.emit(index, route, length),
+                                  cancelled)
+            if self.closed:
+                return
+            self.layerFinished.emit(index, TSPs.opt_route, TSPs.get_lengths())
+        self.finished.emit()
+
+    def collect(self):
+        """
+        collect() - Emit the better routes and the results of the workers
+        """
+        try:
+            while True:
+                index, route, length = self.queue.get_nowait()
+                # A better route may arrive after the result of the layer
+                if index not in self.done:
+                    self.routeFound.emit(index, route, length)
+        except Empty:
+            pass
+
+        for result_nr, result in enumerate(self.results):
+            if result is None or not result.ready():
+                continue
+            self.results[result_nr] = None
+            self.done.add(result_nr)
+            try:
+                index, route, lengths, records = result.get()
+            except Exception as e:
+                logger.error(self.tr("Route optimisation of a layer failed: %s") % e)
+                continue
+            handle_records(records)
+            self.layerFinished.emit(index, route, lengths)
+            if self.closed:
+                return
+
+        if len(self.done) == len(self.jobs):
+            self.close_pool()
+            self.finished.emit()
+
+    def cancel(self):
+        """
+        cancel() - Stop the optimisation. The layers keep the best route
+        found so far, the finished signal is emitted as usual.
+        """
+        self.cancelled = True
+        if self.pool is not None:
+            self.cancel_event.set()
+
+    def close(self):
+        """
+        close() - Stop the optimisation, without emitting any more signals
+        """
+        self.cancelled = True
+        self.closed = True
+        self.close_pool()
+
+    def close_pool(self):
+        self.timer.stop()
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+"""
+Common fixtures of the tests, they are run from the source folder with
+python -m pytest tests
+The benchmarks are only run with python -m pytest tests --benchmark
+"""
+
+import os
+import sys
+
+import pytest
+
+SOURCE_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DXF_FOLDER = os.path.join(os.path.dirname(SOURCE_FOLDER), 'dxf')
+
+if SOURCE_FOLDER not in sys.path:
+    sys.path.insert(0, SOURCE_FOLDER)
+
+import globals.globals as g
+from globals.config import MyConfig
+
+
+def pytest_addoption(parser):
+    parser.addoption('--benchmark', action='store_true',
+                     help='also run the benchmarks, which compare timings')
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'benchmark: compares timings, only run with --benchmark')
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption('--benchmark'):
+        return
+    skip = pytest.mark.skip(reason='benchmark, run with --benchmark')
+    for item in items:
+        if 'benchmark' in item.keywords:
+            item.add_marker(skip)
+
+
+@pytest.fixture(autouse=True)
+def config(tmpdir):
+    """
+    A default configuration in a temporary settings folder
+    """
+    g.folder = str(tmpdir)
+    g.config = MyConfig()
+    return g.config
+
+
+def dxf_files():
+    """
+    The example drawings of the repository
+    """
+    if not os.path.isdir(DXF_FOLDER):
+        return []
+    return sorted(os.path.join(DXF_FOLDER, name) for name in os.listdir(DXF_FOLDER)
+                  if name.lower().endswith('.dxf'))
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+
+"""
+Tests of the nesting of the shapes of a layer, which decides the automatic
+cutter compensation and the export order
+"""
+
+import random
+
+import pytest
+
+from core.arcgeo import ArcGeo
+from core.containmenttree import ContainmentTree
+from core.customgcode import CustomGCode
+from core.entitycontent import EntityContent
+from core.holegeo import HoleGeo
+from core.linegeo import LineGeo
+from core.point import Point
+from core.shape import Shape
+
+
+class Layer(object):
+    tool_diameter = 2.0
+
+
+def make_shape(nr, points, closed=True):
+    root = EntityContent(nr=0, name='Entities', parent=None, p0=Point(), pb=Point(),
+                         sca=[1, 1, 1], rot=0)
+    shape = Shape(nr, closed, root)
+    shape.parentLayer = Layer()
+    points = [Point(x, y) for x, y in points]
+    if closed and points:
+        points.append(points[0])
+    for Ps, Pe in zip(points, points[1:]):
+        shape.append(LineGeo(Ps, Pe))
+    return shape
+
+
+def rectangle(nr, x0, y0, x1, y1, cw=False):
+    points = [(x0, y0), (x1, y0), (x1, y1), (x0, y1)]
+    return make_shape(nr, points[::-1] if cw else points)
+
+
+def circle(nr, x, y, r):
+    shape = make_shape(nr, [])
+    O = Point(x, y)
+    shape.append(ArcGeo(Ps=O.get_arc_point(0, r), Pe=O.get_arc_point(3.14159, r), O=O, r=r, direction=1))
+    shape.append(ArcGeo(Ps=O.get_arc_point(3.14159, r), Pe=O.get_arc_point(0, r), O=O, r=r, direction=1))
+    return shape
+
+
+def hole(nr, x, y):
+    shape = make_shape(nr, [])
+    shape.append(HoleGeo(Point(x, y)))
+    shape.type = 'Hole'
+    return shape
+
+
+def box_nested(rnd, x0, y0, x1, y1, shapes, level=0):
+    """
+    Shapes nested by their bounding boxes, inside the rectangle
+    """
+    shapes.append(rectangle(len(shapes), x0, y0, x1, y1, rnd.random() < 0.5))
+    if level == 3:
+        return
+    columns = rnd.randint(1, 3)
+    rows = rnd.randint(1, 3)
+    width = (x1 - x0) / columns
+    height = (y1 - y0) / rows
+    for column in range(columns):
+        for row in range(rows):
+            cx0 = x0 + column * width + width / 10
+            cy0 = y0 + row * height + height / 10
+            cx1 = cx0 + width * 0.8
+            cy1 = cy0 + height * 0.8
+            kind = rnd.random()
+            if kind < 0.5:
+                box_nested(rnd, cx0, cy0, cx1, cy1, shapes, level + 1)
+            elif kind < 0.7:
+                shapes.append(circle(len(shapes), (cx0 + cx1) / 2, (cy0 + cy1) / 2,
+                                     min(cx1 - cx0, cy1 - cy0) / 2))
+            elif kind < 0.8 and min(cx1 - cx0, cy1 - cy0) > 3:
+                shapes.append(hole(len(shapes), (cx0 + cx1) / 2, (cy0 + cy1) / 2))
+
+
+def peeling(shapes):
+    """
+    The nesting by bounding boxes, removing the outer shapes round by round,
+    as the automatic cutter compensation did before the containment tree
+    @return: tuple (depths, export order)
+    """
+    def isShapeContained(shape, outerShape):
+        return shape != outerShape and not isinstance(outerShape, CustomGCode) and\
+            outerShape.topLeft.x < shape.topLeft.x and shape.bottomRight.x < outerShape.bottomRight.x and\
+            outerShape.bottomRight.y < shape.bottomRight.y and shape.topLeft.y < outerShape.topLeft.y
+
+    for shape in shapes:
+        if not isinstance(shape, CustomGCode):
+            shape.make_path(lambda *args: None, lambda *args: None)
+    depths = {}
+    new_exp_order = []
+    depth = 0
+    shapes_left = shapes
+    while len(shapes_left) > 0:
+        contained = []
+        for shape in shapes_left:
+            if not isinstance(shape, CustomGCode) and\
+               any(isShapeContained(shape, outerShape) for outerShape in shapes_left):
+                contained.append(shape)
+            else:
+                depths[shape] = depth
+                new_exp_order.append(shape.nr)
+        shapes_left = contained
+        depth += 1
+    return depths, list(reversed(new_exp_order))
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_box_nested_shapes_as_peeled(seed):
+    rnd = random.Random(seed)
+    shapes = []
+    for i in range(rnd.randint(1, 3)):
+        box_nested(rnd, i * 200, 0, i * 200 + 150, 100, shapes)
+    shapes.append(CustomGCode('Custom', len(shapes), 'M5', None))
+    rnd.shuffle(shapes)
+
+    tree = ContainmentTree(shapes)
+    depths, exp_order = peeling(shapes)
+
+    assert [tree.getDepth(shape) for shape in shapes] == [depths[shape] for shape in shapes]
+    assert [shape.nr for shape in tree.getExportOrder()] == exp_order
+    for shape in shapes:
+        parent = tree.getParent(shape)
+        assert (parent is None) == (depths[shape] == 0)
+        if parent is not None:
+            assert depths[parent] == depths[shape] - 1
+            assert shape in tree.getChildren(parent)
+
+
+def test_shape_in_bounding_box_outside_contour():
+    part = make_shape(0, [(0, 0), (100, 0), (100, 20), (20, 20), (20, 100), (0, 100)])
+    outside = rectangle(1, 40, 40, 80, 80)
+    inside = rectangle(2, 5, 5, 15, 90)
+    tree = ContainmentTree([part, outside, inside])
+
+    assert tree.getDepth(outside) == 0
+    assert tree.getDepth(inside) == 1
+    assert tree.getChildren(part) == [inside]
+
+
+def test_shape_crossing_contour():
+    # Most of the points of the rectangle are inside the part, one corner is not
+    part = make_shape(0, [(0, 0), (100, 0), (100, 20), (20, 20), (20, 100), (0, 100)])
+    crossing = make_shape(1, [(5, 5), (10, 5), (15, 5), (30, 5), (30, 30), (15, 30), (10, 30), (5, 30),
+                              (5, 25), (5, 15), (5, 10)])
+    tree = ContainmentTree([part, crossing])
+
+    assert tree.getDepth(crossing) == 0
+
+
+def test_interlocking_parts():
+    # A U shaped part and a hook reaching into it, which goes around the
+    # bounding box of the part
+    part = make_shape(0, [(0, 0), (100, 0), (100, 60), (80, 60), (80, 20), (20, 20), (20, 60), (0, 60)])
+    hook = make_shape(1, [(30, 30), (70, 30), (70, 65), (110, 65), (110, 75), (-10, 75), (-10, -5),
+                          (-5, -5), (-5, 65), (30, 65)])
+    between = rectangle(2, 25, 22, 28, 58)
+    tree = ContainmentTree([part, hook, between])
+
+    assert tree.getDepth(part) == 0
+    assert tree.getDepth(hook) == 0
+    assert tree.getDepth(between) == 0
+
+
+def test_shapes_touching_from_inside():
+    outer = rectangle(0, 0, 0, 100, 100)
+    touching = rectangle(1, 0, 10, 50, 50)
+    ring = circle(2, 50, 50, 40)
+    tangent = circle(3, 70, 50, 20)
+    tree = ContainmentTree([outer, touching, ring, tangent])
+
+    # The rectangle shares an edge with the outer one, its bounding box is
+    # not inside the outer one
+    assert tree.getDepth(touching) == 0
+    assert tree.getParent(tangent) is ring
+    assert tree.getDepth(tangent) == 2
+
+
+def test_open_shapes():
+    outer = rectangle(0, 0, 0, 100, 100)
+    line = make_shape(1, [(10, 10), (50, 90), (90, 10)], closed=False)
+    leaving = make_shape(2, [(10, 50), (50, 50), (50, 150)], closed=False)
+    inside_open = rectangle(3, 40, 20, 60, 30)
+    tree = ContainmentTree([outer, line, leaving, inside_open])
+
+    assert tree.getDepth(line) == 1
+    assert tree.getDepth(leaving) == 0
+    # Open shapes contain nothing
+    assert tree.getParent(inside_open) is outer
+
+
+def test_holes():
+    outer = rectangle(0, 0, 0, 100, 100)
+    part = make_shape(1, [(10, 10), (90, 10), (90, 30), (30, 30), (30, 90), (10, 90)])
+    holes = [hole(2, 20, 20), hole(3, 60, 60), hole(4, 150, 50)]
+    tree = ContainmentTree([outer, part] + holes)
+
+    assert [tree.getDepth(shape) for shape in holes] == [2, 1, 0]
+    assert tree.getChildren(part) == holes[:1]
+
+
+def test_custom_gcode():
+    outer = rectangle(0, 0, 0, 100, 100)
+    custom = CustomGCode('Custom', 1, 'M5', None)
+    inner = rectangle(2, 10, 10, 20, 20)
+    tree = ContainmentTree([custom, outer, inner])
+
+    assert tree.getDepth(custom) == 0
+    assert tree.getChildren(custom) == []
+    assert tree.getExportOrder() == [inner, outer, custom]
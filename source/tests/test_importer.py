@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+
+"""
+Tests of the DXF importer, the results are compared with straightforward
+versions of the algorithms the importer used before
+"""
+
+import random
+
+import pytest
+
+from conftest import dxf_files
+
+import globals.globals as g
+
+from core.point import Point
+from dxfimport.classes import PointsClass
+from dxfimport.importer import ReadDXF, GeoLengthClass
+
+
+def reference_line_pairs(data, decode):
+    """
+    The (code, value) pairs as the readlines() based tokenizer found them
+    """
+    lines = data.splitlines()
+    line = 0
+    while line < len(lines) and not lines[line].startswith(b'SECTION'):
+        line += 1
+    line -= 1
+
+    pairs = []
+    try:
+        while line + 1 < len(lines):
+            pairs.append((int(lines[line].strip()), decode(lines[line + 1].strip())))
+            line += 2
+    except ValueError:
+        pass
+    return pairs
+
+
+def tokenize(data):
+    line_pairs = ReadDXF().Get_Line_Pairs(data)
+    return line_pairs, [(line_pair.code, line_pair.value) for line_pair in
+                        (line_pairs.line_pair[i] for i in range(len(line_pairs)))]
+
+
+def random_dxf(rnd, eol):
+    """
+    A file with random pairs, some of them with padded codes and values
+    """
+    lines = [b'999', b'header comment', b'  0', b'SECTION']
+    for i in range(rnd.randint(0, 300)):
+        code = rnd.choice((0, 2, 8, 10, 20, 40, 70, 999))
+        lines.append((b' ' * rnd.randint(0, 2)) + str(code).encode('ascii'))
+        value = rnd.choice((b'LINE', b'ARC', b'0', b'ENDSEC', b'SECTION', b'La yer',
+                            str(rnd.uniform(-1000, 1000)).encode('ascii')))
+        lines.append(value + (b' ' * rnd.randint(0, 2)))
+    lines += [b'  0', b'EOF']
+    return eol.join(lines) + (eol if rnd.random() < 0.5 else b'')
+
+
+@pytest.mark.parametrize('filename', dxf_files())
+def test_line_pairs_of_example_files(filename):
+    with open(filename, 'rb') as file_:
+        data = file_.read()
+
+    line_pairs, pairs = tokenize(data)
+
+    assert pairs == reference_line_pairs(data, line_pairs.decode)
+
+
+@pytest.mark.parametrize('eol', [b'\n', b'\r\n', b'\r'])
+def test_line_pairs_of_random_files(eol):
+    rnd = random.Random(1)
+    for i in range(50):
+        data = random_dxf(rnd, eol)
+        line_pairs, pairs = tokenize(data)
+
+        assert pairs == reference_line_pairs(data, line_pairs.decode)
+
+
+def test_line_pairs_of_memory_mapped_file(tmpdir):
+    rnd = random.Random(2)
+    data = random_dxf(rnd, b'\r\n')
+    filename = str(tmpdir.join('random.dxf'))
+    with open(filename, 'wb') as file_:
+        file_.write(data)
+
+    importer = ReadDXF()
+    buffer_ = importer.Read_File(filename)
+    try:
+        line_pairs = importer.Get_Line_Pairs(buffer_)
+        pairs = [(line_pairs.line_pair[i].code, line_pairs.line_pair[i].value)
+                 for i in range(len(line_pairs))]
+    finally:
+        buffer_.close()
+
+    assert pairs == reference_line_pairs(data, line_pairs.decode)
+
+
+def reference_index(pairs, code, value=None, start=0, stop=-1):
+    """
+    Linear search of index_both() / index_code()
+    """
+    if stop == -1:
+        stop = len(pairs)
+    for i in range(start, stop):
+        if pairs[i][0] == code and (value is None or pairs[i][1] == value):
+            return i
+    return None
+
+
+@pytest.mark.parametrize('filename', dxf_files()[:10])
+def test_index_of_example_files(filename):
+    with open(filename, 'rb') as file_:
+        line_pairs, pairs = tokenize(file_.read())
+
+    rnd = random.Random(3)
+    codes = sorted(set(code for code, value in pairs))
+    values = sorted(set(value for code, value in pairs if code in (0, 2, 8)))
+    for i in range(500):
+        code = rnd.choice(codes + [1234])
+        start = rnd.randint(0, len(pairs))
+        stop = rnd.choice((-1, rnd.randint(start, len(pairs))))
+        assert line_pairs.index_code(code, start, stop) ==\
+            reference_index(pairs, code, None, start, stop)
+
+        value = rnd.choice(values + ['missing'])
+        assert line_pairs.index_both(code, value, start, stop) ==\
+            reference_index(pairs, code, value, start, stop)
+
+
+def reference_common_points(points, tol):
+    """
+    Find_Common_Points() as it was, with a sorted list of the end points
+    """
+    p_list = []
+    for p in points:
+        p_list.append([p.Layer_Nr, p.be.x, p.be.y, p.point_nr, 0])
+        p_list.append([p.Layer_Nr, p.en.x, p.en.y, p.point_nr, 1])
+    p_list.sort()
+
+    anf = []
+    for l_nr in range(len(p_list)):
+        inter = []
+        if isinstance(anf, list):
+            c_nr = 0
+        else:
+            c_nr = anf
+        anf = []
+
+        while p_list[c_nr][0] < p_list[l_nr][0] or \
+                p_list[c_nr][1] <= (p_list[l_nr][1] + tol):
+            if isinstance(anf, list) and\
+               p_list[c_nr][0] == p_list[l_nr][0] and\
+               abs(p_list[c_nr][1] - p_list[l_nr][1]) <= tol:
+                anf = c_nr
+            if p_list[c_nr][0] == p_list[l_nr][0] and \
+               abs(p_list[c_nr][1] - p_list[l_nr][1]) <= tol and\
+               abs(p_list[c_nr][2] - p_list[l_nr][2]) <= tol and\
+               c_nr != l_nr:
+                inter.append(c_nr)
+            c_nr += 1
+            if c_nr == len(p_list):
+                break
+
+        for int_p in inter:
+            if p_list[l_nr][-1] == 0:
+                points[p_list[l_nr][-2]].be_cp.append(p_list[int_p][3:5])
+            else:
+                points[p_list[l_nr][-2]].en_cp.append(p_list[int_p][3:5])
+
+    return points
+
+
+def random_points(rnd, nr, tol):
+    """
+    End points of segments on a coarse grid, so that many of them are common,
+    with some vertical segments sharing their x values
+    """
+    step = 5 * (tol or 0.01)
+
+    def coordinate():
+        return rnd.randint(0, 10) * step + rnd.choice((0, 0, rnd.uniform(-tol, tol), 1.5 * tol))
+
+    points = []
+    for point_nr in range(nr):
+        be = Point(coordinate(), coordinate())
+        if rnd.random() < 0.3:
+            en = Point(be.x, coordinate())
+        else:
+            en = Point(coordinate(), coordinate())
+        points.append(PointsClass(point_nr=point_nr, geo_nr=point_nr, Layer_Nr=rnd.randint(0, 2),
+                                  be=be, en=en, be_cp=[], en_cp=[]))
+    return points
+
+
+@pytest.mark.parametrize('tol', [0.01, 0.5, 0.0])
+def test_common_points(tol):
+    rnd = random.Random(4)
+    for i in range(30):
+        state = rnd.getstate()
+        points = ReadDXF().Find_Common_Points(random_points(rnd, 200, tol), tol)
+        rnd.setstate(state)
+        expected = reference_common_points(random_points(rnd, 200, tol), tol)
+
+        assert [(p.be_cp, p.en_cp) for p in points] == [(p.be_cp, p.en_cp) for p in expected]
+
+
+def random_segments(rnd, nr, size):
+    """
+    Segments between the points of a small grid, so that there are many
+    branches. Segments of zero length are left out, like the importer does.
+    """
+    geo = []
+    points = []
+    while len(points) < nr:
+        be = Point(rnd.randint(0, size), rnd.randint(0, size))
+        en = Point(rnd.randint(0, size), rnd.randint(0, size))
+        if be == en:
+            continue
+        points.append(PointsClass(point_nr=len(points), geo_nr=len(geo), Layer_Nr=0,
+                                  be=be, en=en, be_cp=[], en_cp=[]))
+        geo.append(GeoLengthClass(be.distance(en)))
+    return geo, points
+
+
+def find_contours(geo, points, contour_search):
+    cont = ReadDXF().Find_Contours(geo, points, [], 0.01, contour_search)
+    return [(contour.closed, contour.order, contour.length) for contour in cont]
+
+
+@pytest.mark.parametrize('size', [1, 2, 3])
+def test_graph_contour_search(size):
+    rnd = random.Random(5)
+    for i in range(300):
+        state = rnd.getstate()
+        nr = rnd.randint(1, 12)
+        contours = find_contours(*random_segments(rnd, nr, size), contour_search='graph')
+        rnd.setstate(state)
+        nr = rnd.randint(1, 12)
+        try:
+            expected = find_contours(*random_segments(rnd, nr, size), contour_search='recursive')
+        except IndexError:
+            # Search_Paths() fails when a branch added paths and the paths it
+            # takes from the end of the list do not exist
+            continue
+
+        assert contours == expected
+
+
+def test_graph_contour_search_of_long_chain():
+    nr = 5000
+    geo = [GeoLengthClass(1.0) for i in range(nr)]
+    points = [PointsClass(point_nr=i, geo_nr=i, Layer_Nr=0,
+                          be=Point(i, 0), en=Point(i + 1, 0), be_cp=[], en_cp=[])
+              for i in range(nr)]
+
+    contours = find_contours(geo, points, contour_search='graph')
+
+    assert contours == [(0, [[i, 0] for i in range(nr)], nr)]
+
+
+def grid_segments(size):
+    """
+    The lines of a grid, all inner end points have four branches
+    """
+    geo = []
+    points = []
+    for i in range(size + 1):
+        for j in range(size):
+            for be, en in ((Point(j, i), Point(j + 1, i)), (Point(i, j), Point(i, j + 1))):
+                points.append(PointsClass(point_nr=len(points), geo_nr=len(geo), Layer_Nr=0,
+                                          be=be, en=en, be_cp=[], en_cp=[]))
+                geo.append(GeoLengthClass(1.0))
+    return geo, points
+
+
+def test_graph_contour_search_of_grid():
+    contours = find_contours(*grid_segments(8), contour_search='graph')
+
+    assert contours == find_contours(*grid_segments(8), contour_search='recursive')
+
+
+def test_contour_search_below_the_path_limit(caplog):
+    geo, points = grid_segments(5)
+    importer = ReadDXF()
+    search_paths = importer.Search_Paths_Graph
+    numbers = []
+
+    def counting_search_paths(*args):
+        paths = search_paths(*args)
+        numbers.append(len(paths))
+        return paths
+
+    importer.Search_Paths_Graph = counting_search_paths
+    expected = importer.Find_Contours(geo, points, [], 0.01, 'graph')
+    max_paths = max(numbers)
+    assert max_paths > 1
+
+    geo, points = grid_segments(5)
+    contours = ReadDXF().Find_Contours(geo, points, [], 0.01, 'graph', max_paths)
+    assert [(contour.closed, contour.order, contour.length) for contour in contours] ==\
+        [(contour.closed, contour.order, contour.length) for contour in expected]
+    assert 'Contour search stopped' not in caplog.text
+
+    geo, points = grid_segments(5)
+    ReadDXF().Find_Contours(geo, points, [], 0.01, 'graph', max_paths - 1)
+    assert 'Contour search stopped' in caplog.text
+
+
+def test_import_cache_is_disabled_by_default():
+    assert ReadDXF().Get_Import_Cache() is None
+
+
+def test_import_cache_key_depends_on_the_version(monkeypatch):
+    import globals.constants as c
+
+    g.config.vars.Import_Parameters['import_cache_size'] = 1
+    import_cache = ReadDXF().Get_Import_Cache()
+    key = import_cache.make_key(b'0\nSECTION\n0\nEOF\n')
+    monkeypatch.setattr(c, 'VERSION', c.VERSION + ' next')
+
+    assert import_cache.make_key(b'0\nSECTION\n0\nEOF\n') != key
+
+
+def test_import_cache_of_example_file(monkeypatch):
+    g.config.vars.Import_Parameters['import_cache_size'] = 1
+    filename = dxf_files()[0]
+    expected = ReadDXF(filename)
+
+    def fail(*args):
+        raise AssertionError("The file was read again")
+    monkeypatch.setattr(ReadDXF, 'Get_Line_Pairs', fail)
+    cached = ReadDXF(filename)
+
+    assert [(c.closed, c.order, c.length) for c in cached.entities.cont] ==\
+        [(c.closed, c.order, c.length) for c in expected.entities.cont]
@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+
+"""
+Tests of the postprocessor, the results are compared with straightforward
+versions of the functions it used before
+"""
+
+import random
+import timeit
+
+import pytest
+
+import globals.globals as g
+
+from core.arcgeo import ArcGeo
+from core.entitycontent import EntityContent
+from core.layercontent import LayerContent, Layers
+from core.linegeo import LineGeo
+from core.point import Point
+from core.shape import Shape
+from core.stmove import StMove
+from postpro import postprocessor
+from postpro.postprocessor import MyPostProcessor, make_number_formatter
+
+
+@pytest.fixture
+def postpro():
+    postpro = MyPostProcessor()
+    postpro.getPostProVars(0)
+    postpro.initialize_export_vars()
+    return postpro
+
+
+def reference_print_str(postpro, keystr):
+    """
+    make_print_str() as it was, replacing all keywords one after the other
+    """
+    exstr = keystr
+    for key, value in postpro.keyvars.items():
+        exstr = exstr.replace(key, value())
+    return exstr
+
+
+def set_random_values(postpro, rnd):
+    def point():
+        return Point(rnd.uniform(-1000, 1000), rnd.uniform(-1000, 1000))
+
+    postpro.Ps, postpro.Pe, postpro.IJ, postpro.O = point(), point(), point(), point()
+    postpro.ze = rnd.uniform(-10, 10)
+    postpro.r = rnd.uniform(0, 1000)
+    postpro.s_ang = rnd.uniform(-7, 7)
+    postpro.e_ang = rnd.uniform(-7, 7)
+    postpro.feed = rnd.randint(0, 5000)
+    postpro.speed = rnd.randint(0, 30000)
+    postpro.tool_nr = rnd.randint(0, 99)
+    postpro.comment = rnd.choice(('', 'Shape 1', 'comment with %nl inside'))
+
+
+def test_default_templates(postpro):
+    rnd = random.Random(7)
+    for i in range(20):
+        set_random_values(postpro, rnd)
+        for keystr in vars(postpro.vars.Program).values():
+            assert postpro.make_print_str(keystr) == reference_print_str(postpro, keystr)
+
+
+def test_random_templates(postpro):
+    rnd = random.Random(8)
+    keys = sorted(postpro.keyvars)
+    for i in range(500):
+        set_random_values(postpro, rnd)
+        parts = []
+        for j in range(rnd.randint(0, 8)):
+            parts.append(rnd.choice(keys))
+            parts.append(''.join(rnd.choice('GXYZ01 -(%') for k in range(rnd.randint(0, 3))))
+        keystr = ''.join(parts)
+
+        assert postpro.make_print_str(keystr) == reference_print_str(postpro, keystr)
+
+
+def reference_fnprint(number_format, number):
+    """
+    fnprint() as it was, which read the Number_Format for every number
+    """
+    pre_dec = number_format["pre_decimals"]
+    post_dec = number_format["post_decimals"]
+    dec_sep = number_format["decimal_separator"]
+    pre_dec_z_pad = number_format["pre_decimal_zero_padding"]
+    post_dec_z_pad = number_format["post_decimal_zero_padding"]
+    signed_val = number_format["signed_values"]
+
+    exstr = ''
+
+    # + or - sign if required. Also used for Leading Zeros
+    if signed_val and pre_dec_z_pad:
+        numstr = ('%+0' + str(pre_dec + post_dec + 1) +
+                  '.' + str(post_dec) + 'f') % number
+    elif signed_val == 0 and pre_dec_z_pad:
+        numstr = ('%0' + str(pre_dec + post_dec + 1) +
+                  '.' + str(post_dec) + 'f') % number
+    elif signed_val and pre_dec_z_pad == 0:
+        numstr = ('%+' + str(pre_dec + post_dec + 1) +
+                  '.' + str(post_dec) + 'f') % number
+    elif signed_val == 0 and pre_dec_z_pad == 0:
+        numstr = ('%' + str(pre_dec + post_dec + 1) +
+                  '.' + str(post_dec) + 'f') % number
+
+    # Gives the required decimal format.
+    exstr += numstr[0:-(post_dec + 1)]
+
+    exstr_end = dec_sep
+    exstr_end += numstr[-post_dec:]
+
+    # Add's Zero's to the end if required
+    if not post_dec_z_pad:
+        while len(exstr_end) > 0 and (exstr_end[-1] == '0' or exstr_end[-1] == dec_sep):
+            exstr_end = exstr_end[0:-1]
+    return exstr + exstr_end
+
+
+def number_formats(post_decimals):
+    for pre_decimals in (1, 4):
+        for decimal_separator in ('.', ',', '::'):
+            for pre_decimal_zero_padding in (False, True):
+                for post_decimal_zero_padding in (False, True):
+                    for signed_values in (False, True):
+                        yield {"pre_decimals": pre_decimals,
+                               "post_decimals": post_decimals,
+                               "decimal_separator": decimal_separator,
+                               "pre_decimal_zero_padding": pre_decimal_zero_padding,
+                               "post_decimal_zero_padding": post_decimal_zero_padding,
+                               "signed_values": signed_values}
+
+
+def random_numbers(rnd, post_decimals):
+    numbers = [0.0, -0.0, 1.0, -1.0, 10.0, 0.5 * 0.1 ** post_decimals, -1e-10, 123456789.125]
+    for i in range(300):
+        numbers.append(rnd.choice((rnd.uniform(-1, 1), rnd.uniform(-10000, 10000),
+                                   round(rnd.uniform(-100, 100), rnd.randint(0, 4)),
+                                   rnd.randint(-1000, 1000) + 0.5 * 0.1 ** post_decimals)))
+    return numbers
+
+
+@pytest.mark.parametrize('post_decimals', [1, 2, 3, 5])
+def test_number_formatter(post_decimals):
+    rnd = random.Random(post_decimals)
+    numbers = random_numbers(rnd, post_decimals)
+    for number_format in number_formats(post_decimals):
+        fnprint = make_number_formatter(number_format)
+        for number in numbers:
+            assert fnprint(number) == reference_fnprint(number_format, number)
+
+
+def test_number_formatter_without_decimals():
+    # The former fnprint() cut off the last digit, and added the whole number
+    # after the separator again
+    assert reference_fnprint(next(number_formats(0)), 123.0) == '12.123'
+
+    rnd = random.Random(0)
+    numbers = random_numbers(rnd, 0)
+    for number_format in number_formats(0):
+        fnprint = make_number_formatter(number_format)
+        numfmt = '%' + ('+' if number_format["signed_values"] else '') +\
+            ('0' if number_format["pre_decimal_zero_padding"] else '') +\
+            str(number_format["pre_decimals"]) + '.0f'
+        for number in numbers:
+            assert fnprint(number) == numfmt % number
+
+    assert make_number_formatter(next(number_formats(0)))(-12.7) == '-13'
+
+
+@pytest.mark.benchmark
+def test_number_formatter_speed():
+    """
+    Benchmark of the formatter against the former fnprint(), the timings
+    depend on the load of the machine
+    """
+    number_format = next(number_formats(3))
+    fnprint = make_number_formatter(number_format)
+    numbers = random_numbers(random.Random(9), 3) * 10
+
+    def run_reference():
+        for number in numbers:
+            reference_fnprint(number_format, number)
+
+    def run():
+        for number in numbers:
+            fnprint(number)
+
+    reference_time = min(timeit.repeat(run_reference, number=1, repeat=5))
+    time = min(timeit.repeat(run, number=1, repeat=5))
+
+    assert time < reference_time
+
+
+def test_export_replaces_file_only_on_success(postpro, tmpdir, monkeypatch):
+    g.config.vars.General['write_to_stdout'] = False
+    filename = str(tmpdir.join('export.ngc'))
+    with open(filename, 'w') as file_:
+        file_.write('former export')
+
+    postpro.exportShapes('drawing.dxf', filename, Layers([]))
+
+    with open(filename) as file_:
+        code = file_.read()
+    assert 'former export' not in code
+    assert code.rstrip().endswith(postpro.vars.General['code_end'])
+
+    def fail(*args):
+        yield 'G0 X0 Y0\n'
+        raise ValueError('export failed')
+    monkeypatch.setattr(postpro, 'export_fragments', fail)
+
+    with pytest.raises(ValueError):
+        postpro.exportShapes('drawing.dxf', filename, Layers([]))
+
+    with open(filename) as file_:
+        assert file_.read() == code
+    assert not tmpdir.join('export.ngc.tmp').exists()
+
+
+def random_layers(rnd):
+    """
+    Layers with closed and open shapes of lines and arcs, whose depths, feed
+    rates and cutter compensations differ, so that the modal state changes
+    from one shape to the next one
+    """
+    root = EntityContent(nr=0, name='Entities', parent=None, p0=Point(), pb=Point(),
+                         sca=[1, 1, 1], rot=0)
+    layers = Layers([])
+    nr = 0
+    for layer_nr in range(3):
+        layer = LayerContent(layer_nr, 'Layer %i' % layer_nr, [])
+        layer.tool_nr = 1 + layer_nr % 2
+        layer.speed = rnd.choice((6000, 12000))
+        layer.axis3_retract = rnd.choice((10.0, 15.0))
+        for i in range(rnd.randint(5, 12)):
+            x = rnd.uniform(-100, 100)
+            y = rnd.uniform(-100, 100)
+            size = rnd.uniform(5, 20)
+            points = [Point(x, y), Point(x + size, y), Point(x + size, y + size), Point(x, y + size)]
+            closed = rnd.random() < 0.7
+            shape = Shape(nr, closed, root)
+            for Ps, Pe in zip(points, points[1:] + points[:1] if closed else points[1:]):
+                if rnd.random() < 0.3:
+                    shape.append(ArcGeo(Ps=Ps, Pe=Pe, r=Ps.distance(Pe), direction=rnd.choice((-1, 1))))
+                else:
+                    shape.append(LineGeo(Ps, Pe))
+            shape.parentLayer = layer
+            shape.cut_cor = rnd.choice((40, 41, 42))
+            shape.axis3_mill_depth = rnd.choice((-3.0, -4.5))
+            shape.axis3_slice_depth = rnd.choice((-1.5, -2.0))
+            shape.f_g1_plane = rnd.choice((400, 500))
+            shape.f_g1_depth = rnd.choice((100, 150))
+            shape.AnalyseAndOptimize()
+            shape.stmove = StMove(shape)
+            layer.shapes.append(shape)
+            nr += 1
+        layer.exp_order_complete = list(range(len(layer.shapes)))
+        rnd.shuffle(layer.exp_order_complete)
+        layers.append(layer)
+    return layers
+
+
+@pytest.mark.skipif(not hasattr(postprocessor.os, 'fork'), reason="the export workers are forked")
+@pytest.mark.parametrize('abs_export', [True, False])
+@pytest.mark.parametrize('use_line_nrs', [False, True])
+@pytest.mark.parametrize('done_by_machine', [True, False])
+def test_parallel_export_equals_serial(postpro, tmpdir, monkeypatch, abs_export, use_line_nrs, done_by_machine):
+    g.config.vars.General['write_to_stdout'] = False
+    g.config.vars.Cutter_Compensation['done_by_machine'] = done_by_machine
+    postpro.vars.General.abs_export = abs_export
+    postpro.vars.Line_Numbers.use_line_nrs = use_line_nrs
+    layers = random_layers(random.Random(11))
+
+    used = []
+    get_gcode = postprocessor.ShapeExportPool.get_gcode
+
+    def count_gcode(self, postpro):
+        exstr = get_gcode(self, postpro)
+        used.append(exstr is not None)
+        return exstr
+    monkeypatch.setattr(postprocessor.ShapeExportPool, 'get_gcode', count_gcode)
+    monkeypatch.setattr(postprocessor.time, 'asctime', lambda: 'Sun Oct 18 12:00:00 2026')
+
+    codes = []
+    for processes in (1, 3, 0):
+        g.config.vars.General['export_processes'] = processes
+        filename = str(tmpdir.join('export%i.ngc' % processes))
+        postpro.exportShapes('drawing.dxf', filename, layers)
+        with open(filename) as file_:
+            codes.append(file_.read())
+
+    assert codes[1] == codes[0]
+    assert codes[2] == codes[0]
+    # The code of the workers is used, not only the shapes exported again
+    assert any(used)
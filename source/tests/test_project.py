@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+
+"""
+Tests of the reload of the shapes after settings were changed, each setting
+redoes another stage, the settings of the layers and of the shapes are kept
+"""
+
+import pytest
+
+from core.entitycontent import EntityContent
+from core.holegeo import HoleGeo
+from core.layercontent import LayerContent, Layers, Shapes
+from core.linegeo import LineGeo
+from core.point import Point
+from core.project import Project
+from core.shape import Shape
+import globals.globals as g
+
+
+class Stub(object):
+    """
+    Attributes and methods doing nothing
+    """
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+    def __getattr__(self, name):
+        return lambda *args: None
+
+
+class Action(object):
+    def __init__(self, checked=False):
+        self.checked = checked
+
+    def isChecked(self):
+        return self.checked
+
+
+class ReadDXF(object):
+    def __init__(self, window):
+        self.window = window
+        self.fitting_tolerance = g.config.fitting_tolerance
+        self.point_tolerance = g.config.point_tolerance
+
+    def Get_All_Contours(self):
+        self.window.calls.append('contours')
+        self.point_tolerance = g.config.point_tolerance
+
+
+class TreeHandler(object):
+    def __init__(self, window):
+        self.window = window
+
+    def updateExportOrder(self, includeDisableds=False):
+        for layer in self.window.layerContents:
+            layer.exp_order_complete = list(range(len(layer.shapes)))
+
+
+class MainWindow(object):
+    """
+    The parts of the main window used by the reload: a rectangle on the
+    layer CUT and two holes on the layer DRILL
+    """
+    def __init__(self):
+        self.filename = 'drawing.dxf'
+        self.cont_dx = self.cont_dy = self.cont_rotate = 0.0
+        self.cont_scale = 1.0
+        self.moved = False
+        self.calls = []
+
+        self.ui = Stub(actionSplitLineSegments=Action(), actionAutomaticCutterCompensation=Action())
+        self.canvas = self.app = Stub()
+        self.TreeHandler = TreeHandler(self)
+        self.valuesDXF = ReadDXF(self)
+        self.makeShapes()
+        self.calls = []
+
+    def __getattr__(self, name):
+        return lambda *args: None
+
+    def load(self, plot=True):
+        self.valuesDXF = ReadDXF(self)
+        self.makeShapes()
+        return True
+
+    def updateEntityRoot(self):
+        return self.moved
+
+    def makeShapes(self):
+        self.calls.append('shapes')
+        self.entityRoot = EntityContent(nr=0, name='Entities', parent=None, p0=Point(), pb=Point(),
+                                        sca=[1, 1, 1], rot=0)
+        self.layerContents = Layers([])
+        self.shapes = Shapes([])
+
+        self.splitLines = self.ui.actionSplitLineSegments.isChecked()
+        self.machineType = g.config.machine_type
+
+        points = [Point(0, 0), Point(50, 0), Point(100, 0), Point(100, 50), Point(0, 50), Point(0, 0)]
+        if not self.splitLines:
+            del points[1]
+        rectangle = Shape(0, True, self.entityRoot)
+        for Ps, Pe in zip(points, points[1:]):
+            rectangle.append(LineGeo(Ps, Pe))
+        holes = []
+        for nr, x in ((1, 25), (2, 75)):
+            hole = Shape(nr, True, self.entityRoot)
+            hole.append(HoleGeo(Point(x, 25)))
+            hole.type = 'Hole'
+            if g.config.machine_type == 'drag_knife':
+                hole.disabled = True
+                hole.allowedToChange = False
+            holes.append(hole)
+
+        for nr, name, shapes in ((0, 'CUT', [rectangle]), (1, 'DRILL', holes)):
+            layer = LayerContent(nr, name, shapes)
+            for shape in shapes:
+                shape.parentLayer = layer
+                self.shapes.append(shape)
+            self.layerContents.append(layer)
+        self.newNumber = len(self.shapes)
+
+    def layer(self, name):
+        return [layer for layer in self.layerContents if layer.name == name][0]
+
+
+@pytest.fixture
+def window():
+    """
+    The main window with changed settings of a layer and of the shapes
+    """
+    window = MainWindow()
+    window.layer('CUT').tool_nr = 3
+    rectangle = window.layer('CUT').shapes[0]
+    rectangle.cut_cor = 42
+    rectangle.axis3_mill_depth = -7.0
+    window.layer('DRILL').shapes[1].disabled = True
+    return window
+
+
+def assert_settings_kept(window):
+    cut = window.layer('CUT')
+    assert cut.tool_nr == 3
+    assert cut.shapes[0].cut_cor == 42
+    assert cut.shapes[0].axis3_mill_depth == -7.0
+    assert [hole.disabled for hole in window.layer('DRILL').shapes] == [False, True]
+
+
+@pytest.mark.parametrize('compleet', [True, False])
+def test_reload_import(window, compleet):
+    if not compleet:
+        g.config.fitting_tolerance /= 2
+    Project(window).reload(compleet)
+
+    assert window.calls == ['shapes', 'shapes']
+    assert_settings_kept(window)
+
+
+def test_reload_contours(window):
+    g.config.point_tolerance /= 2
+    Project(window).small_reload()
+
+    assert window.calls == ['contours', 'shapes']
+    assert_settings_kept(window)
+
+
+def test_reload_split_lines(window):
+    window.ui.actionSplitLineSegments.checked = True
+    Project(window).small_reload()
+
+    assert window.calls == ['shapes']
+    assert len(window.layer('CUT').shapes[0].geos) == 5
+    assert_settings_kept(window)
+
+
+def test_reload_machine_type(window):
+    project = Project(window)
+    g.config.machine_type = 'drag_knife'
+    project.small_reload()
+
+    assert window.calls == ['shapes']
+    assert window.layer('CUT').shapes[0].cut_cor == 42
+    holes = window.layer('DRILL').shapes
+    assert [hole.disabled for hole in holes] == [True, True]
+    assert [hole.allowedToChange for hole in holes] == [False, False]
+
+    g.config.machine_type = 'milling'
+    project.small_reload()
+
+    assert window.calls == ['shapes', 'shapes']
+    assert window.layer('CUT').shapes[0].cut_cor == 42
+    holes = window.layer('DRILL').shapes
+    # The forced state is not kept
+    assert [hole.disabled for hole in holes] == [False, False]
+    assert [hole.allowedToChange for hole in holes] == [True, True]
+
+
+@pytest.mark.parametrize('moved', [True, False])
+def test_reload_transform(window, moved):
+    shapes = list(window.shapes)
+    for shape in shapes:
+        shape.geos.abs_geo(shape.geos[0])
+    window.moved = moved
+    Project(window).small_reload()
+
+    assert window.calls == []
+    assert list(window.shapes) == shapes
+    assert all((not shape.geos.absGeos) == moved for shape in shapes)
+    assert_settings_kept(window)
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+"""
+Tests of the shapes made from the geometries of a block, which are shared by
+all inserts of the block
+"""
+
+import random
+
+import pytest
+
+from core.arcgeo import ArcGeo
+from core.entitycontent import EntityContent
+from core.linegeo import LineGeo
+from core.point import Point
+from core.shape import Shape, Geos, getDirectionArea
+
+
+def random_contour(rnd):
+    """
+    A closed contour of lines and arcs around the origin, in random direction
+    """
+    nr = rnd.randint(3, 8)
+    points = [Point(0, 0).get_arc_point(i * 6.283 / nr, rnd.uniform(5, 10)) for i in range(nr)]
+    if rnd.random() < 0.5:
+        points.reverse()
+    geos = []
+    for Ps, Pe in zip(points, points[1:] + points[:1]):
+        if rnd.random() < 0.3:
+            geos.append(ArcGeo(Ps=Ps, Pe=Pe, r=1.5 * Ps.distance(Pe), direction=rnd.choice((-1, 1))))
+        else:
+            geos.append(LineGeo(Ps, Pe))
+    return geos
+
+
+def random_insert(rnd, parent):
+    scale = rnd.uniform(0.5, 2)
+    sca = rnd.choice(([scale, scale, 1], [scale, -scale, 1], [scale, 2 * scale, 1]))
+    return EntityContent(nr=0, name='Block', parent=parent,
+                         p0=Point(rnd.uniform(-50, 50), rnd.uniform(-50, 50)),
+                         pb=Point(rnd.uniform(-5, 5), rnd.uniform(-5, 5)),
+                         sca=sca, rot=rnd.uniform(-3, 3))
+
+
+def abs_points(shape):
+    return [(round(geo.Ps.x, 9), round(geo.Ps.y, 9)) for geo in shape.geos.abs_iter()]
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_inserts_share_block_geometries(seed):
+    rnd = random.Random(seed)
+    root = EntityContent(nr=0, name='Entities', parent=None, p0=Point(3, -2), pb=Point(),
+                         sca=[1.5, 1.5, 1.5], rot=0.4)
+    geos = random_contour(rnd)
+    area = getDirectionArea(Geos(geos), True)
+    originals = [(geo.Ps, geo.Pe) for geo in geos]
+
+    for i in range(10):
+        parent = random_insert(rnd, random_insert(rnd, root) if rnd.random() < 0.5 else root)
+        shape = Shape(i, True, parent)
+        expected = Shape(i, True, parent)
+        for geo in geos:
+            shape.append(geo)
+            expected.append(geo)
+
+        shape.AnalyseAndOptimize(area)
+        expected.AnalyseAndOptimize()
+
+        # The absolute geometries are only made if the insert distorts or mirrors them
+        assert not shape.geos.absGeos or not parent.isUniformlyScaled()
+        assert abs_points(shape) == abs_points(expected)
+
+        shape.reverse()
+        shape.setNearestStPoint(Point(rnd.uniform(-50, 50), rnd.uniform(-50, 50)))
+        assert [(geo.Ps, geo.Pe) for geo in geos] == originals
+
+
+def test_drawing_keeps_no_absolute_geometries():
+    rnd = random.Random(0)
+    root = EntityContent(nr=0, name='Entities', parent=None, p0=Point(), pb=Point(),
+                         sca=[1, 1, 1], rot=0)
+    shape = Shape(0, True, random_insert(rnd, root))
+    for geo in random_contour(rnd):
+        shape.append(geo)
+
+    lines = []
+    shape.make_path(lambda caller, Ps, Pe: lines.append(Pe), lambda *args: None)
+    assert lines
+    for Pe in lines:
+        shape.isHit(Pe, 0.01)
+    assert not shape.geos.absGeos
+
+
+def test_bounding_box_follows_the_workpiece_zero():
+    root = EntityContent(nr=0, name='Entities', parent=None, p0=Point(), pb=Point(),
+                         sca=[1, 1, 1], rot=0)
+    shape = Shape(0, True, root)
+    for geo in random_contour(random.Random(0)):
+        shape.append(geo)
+
+    def no_line(*args):
+        pass
+
+    shape.make_path(no_line, no_line)
+    box = (shape.topLeft.x, shape.topLeft.y, shape.bottomRight.x, shape.bottomRight.y)
+
+    for p0 in (Point(100, 50), Point(-30, 20)):
+        # As Project.reload does when only the workpiece zero moved
+        root.p0 = p0
+        shape.geos.clear_abs_geos()
+        shape.make_path(no_line, no_line)
+
+        moved = (box[0] + p0.x, box[1] + p0.y, box[2] + p0.x, box[3] + p0.y)
+        assert (shape.topLeft.x, shape.topLeft.y, shape.bottomRight.x, shape.bottomRight.y) ==\
+            pytest.approx(moved, abs=1e-9)
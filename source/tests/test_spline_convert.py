@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+"""
+Tests of the batch evaluation of NURBS, the results are compared with the
+evaluation point by point
+"""
+
+import random
+
+import pytest
+
+from core.point import Point
+from dxfimport import spline_convert
+from dxfimport.spline_convert import NURBSClass, Spline2Arcs
+
+
+def random_nurbs(rnd):
+    degree = rnd.randint(1, 4)
+    nr = rnd.randint(degree + 1, 15)
+    inner = sorted(rnd.choice((rnd.random(), 0.5)) for i in range(nr - degree - 1))
+    Knots = [0.0] * (degree + 1) + inner + [1.0] * (degree + 1)
+    CPoints = [Point(rnd.uniform(-10, 10), rnd.uniform(-10, 10)) for i in range(nr)]
+    Weights = [rnd.choice((1.0, rnd.uniform(0.2, 3))) for i in range(nr)]
+    return NURBSClass(degree=degree, Knots=Knots, Weights=Weights, CPoints=CPoints)
+
+
+def values(value):
+    if isinstance(value, Point):
+        return value.x, value.y
+    return values(value[0]), value[1]
+
+
+@pytest.mark.skipif(spline_convert.np is None, reason="NumPy is not installed")
+@pytest.mark.parametrize('n', [0, 1])
+def test_batch_evaluation(n):
+    rnd = random.Random(6)
+    for i in range(100):
+        NURBS = random_nurbs(rnd)
+        us = [rnd.choice((rnd.random(), 0.5, 1e-12, 1 - 1e-12))
+              for j in range(rnd.randint(spline_convert.NUMPY_MIN_BATCH, 40))]
+
+        expected = [NURBS.NURBS_evaluate(n=n, u=u) for u in us]
+        result = NURBS.NURBS_evaluate_batch(n=n, us=us)
+        if n > 0:
+            result = list(zip(*result))
+
+        # The points are the same to the last bit, Point.__eq__ has a tolerance
+        assert [values(value) for value in result] == [values(value) for value in expected]
+
+
+def curve_values(Curve):
+    return [(type(geo).__name__, values(geo.Ps), values(geo.Pe), values(getattr(geo, 'O', Point())))
+            for geo in Curve]
+
+
+@pytest.mark.skipif(spline_convert.np is None, reason="NumPy is not installed")
+@pytest.mark.parametrize('fitting', ['stepwise', 'adaptive'])
+def test_fitting_with_and_without_numpy(monkeypatch, fitting):
+    rnd = random.Random(8)
+    splines = []
+    for i in range(30):
+        degree = rnd.randint(2, 3)
+        nr = rnd.randint(degree + 1, 12)
+        Knots = [0.0] * (degree + 1) + sorted(rnd.random() for j in range(nr - degree - 1)) + [1.0] * (degree + 1)
+        CPoints = [Point(rnd.uniform(-10, 10), rnd.uniform(-10, 10)) for j in range(nr)]
+        Weights = [rnd.choice((1.0, rnd.uniform(0.2, 3))) for j in range(nr)]
+        splines.append((degree, Knots, Weights, CPoints))
+
+    def fit():
+        return [curve_values(Spline2Arcs(degree=degree, Knots=Knots, Weights=Weights, CPoints=CPoints,
+                                         tol=0.001, check=1, fitting=fitting).Curve)
+                for degree, Knots, Weights, CPoints in splines]
+
+    expected = fit()
+    monkeypatch.setattr(spline_convert, 'np', None)
+    assert fit() == expected
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+"""
+Tests of the route optimisation
+"""
+
+import multiprocessing
+import random
+
+import pytest
+
+import globals.globals as g
+from core.point import Point
+from postpro import tspoptimisation
+from postpro.tspoptimisation import TspOptimization
+
+
+def random_st_end_points(rnd, nr):
+    """
+    Start and end points of shapes on a coarse grid, so that there are equal
+    distances, and the start and end point of the machine
+    """
+    points = [[Point(rnd.randint(0, 20) * 2.5, rnd.randint(0, 20) * 0.1),
+               Point(rnd.randint(0, 20) * 0.3, rnd.randint(0, 20) * 1.7)] for i in range(nr)]
+    points.append([Point(0, 0), Point(0, 0)])
+    return points
+
+
+def optimize(st_end_points, order, seed):
+    random.seed(seed)
+    TSPs = TspOptimization(st_end_points, order)
+    TSPs.optimize(30)
+    return list(TSPs.opt_route), TSPs.Fittness.best_fittness
+
+
+@pytest.mark.skipif(tspoptimisation.np is None, reason="NumPy is not installed")
+@pytest.mark.parametrize('seed', range(5))
+def test_distance_array_equals_matrix(seed):
+    st_end_points = random_st_end_points(random.Random(seed), 40)
+    matrix = tspoptimisation.DistanceMatrixClass()
+    matrix.generate_matrix(st_end_points)
+
+    assert matrix.matrix.tolist() == [[end.distance(start) for start, _ in st_end_points]
+                                      for _, end in st_end_points]
+
+
+@pytest.mark.skipif(tspoptimisation.np is None, reason="NumPy is not installed")
+@pytest.mark.parametrize('seed', range(5))
+def test_genetic_algorithm_with_and_without_numpy(seed, monkeypatch):
+    g.config.vars.Route_Optimisation['route_engine'] = 'genetic'
+    rnd = random.Random(seed)
+    st_end_points = random_st_end_points(rnd, rnd.randint(5, 40))
+    order = sorted(rnd.sample(range(len(st_end_points) - 1), 3))
+
+    route, fittness = optimize(st_end_points, order, seed)
+    monkeypatch.setattr(tspoptimisation, 'np', None)
+    expected_route, expected_fittness = optimize(st_end_points, order, seed)
+
+    assert route == expected_route
+    assert fittness == expected_fittness
+
+
+def distance_matrix(st_end_points, array):
+    matrix = [[end.distance(start) for start, _ in st_end_points] for _, end in st_end_points]
+    return tspoptimisation.np.array(matrix) if array else matrix
+
+
+@pytest.mark.parametrize('begin', ['nearest_neighbour', 'greedy'])
+@pytest.mark.parametrize('array', [False, True])
+def test_local_search(begin, array):
+    if array and tspoptimisation.np is None:
+        pytest.skip("NumPy is not installed")
+    rnd = random.Random(7)
+    for i in range(100):
+        size = rnd.randint(2, 60)
+        st_end_points = random_st_end_points(rnd, size - 1)
+        order = rnd.sample(range(size - 1), rnd.randint(0, min(6, size - 1)))
+        dmatrix = distance_matrix(st_end_points, array)
+
+        local_search = tspoptimisation.LocalSearchClass(dmatrix, order, rnd.choice((1, 2, 5, 20)), begin)
+        start_length = local_search.length
+        local_search.improve()
+        tour = local_search.tour
+
+        assert sorted(tour) == list(range(size))
+        # The tour starts with the start and end point of the machine
+        assert tour[0] == size - 1
+        assert [nr for nr in tour if nr in order] == order
+        assert local_search.length <= start_length
+        assert local_search.length == pytest.approx(tspoptimisation.calc_tour_length(dmatrix, tour))
+        assert not local_search.queue
+
+
+def test_local_search_engine():
+    g.config.vars.Route_Optimisation['route_engine'] = 'local_search'
+    rnd = random.Random(3)
+    st_end_points = random_st_end_points(rnd, 50)
+    order = [7, 3, 30]
+
+    TSPs = TspOptimization(st_end_points, order)
+    TSPs.optimize(100)
+
+    assert TSPs.is_converged()
+    assert TSPs.opt_route[0] == 50
+    assert [nr for nr in TSPs.opt_route if nr in order] == order
+    assert TSPs.LocalSearch.length <= TSPs.LocalSearch.begin_length
+
+
+def test_layer_in_spawned_worker():
+    # The worker has no config, the job brings the options
+    g.config.vars.Route_Optimisation['route_engine'] = 'local_search'
+    st_end_points = random_st_end_points(random.Random(5), 40)
+    coordinates = [((st.x, st.y), (en.x, en.y)) for st, en in st_end_points]
+    settings = g.config.vars.Route_Optimisation
+    job = (coordinates, [4, 2], 100, dict((key, settings[key]) for key in settings))
+
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    cancel_event = context.Event()
+    pool = context.Pool(1, tspoptimisation.optimize_layer_init, (queue, cancel_event))
+    try:
+        index, route, lengths, records = pool.apply(tspoptimisation.optimize_layer_worker, (3, job))
+    finally:
+        pool.terminate()
+        pool.join()
+
+    TSPs = tspoptimisation.optimize_layer(job)
+    assert index == 3
+    assert route == list(TSPs.opt_route)
+    assert lengths == TSPs.get_lengths()
+    assert any("TSP done" in record.getMessage() for record in records)